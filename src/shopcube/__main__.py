@@ -54,6 +54,44 @@ def main():
         source = os.path.join(dirpathparent, "shopcube")
         print("Package dir", source)
 
+    elif args[1] == "worker":
+        source = os.path.join(dirpathparent, "shopcube")
+        os.chdir(source)
+        sys.path.insert(0, source)
+        from modules.box__default.jobs.worker import main as worker_main
+
+        worker_main(args[2:])
+
+    elif args[1] == "manifest":
+        source = os.path.join(dirpathparent, "shopcube")
+        sys.path.insert(0, source)
+        from utils.manifest import main as manifest_main
+
+        sys.exit(manifest_main(args[2:], source))
+
+    elif args[1] == "profile-startup":
+        source = os.path.join(dirpathparent, "shopcube")
+        sys.path.insert(0, source)
+        from utils.startup_profile import main as profile_main
+
+        sys.exit(profile_main(args[2:], source))
+
+    elif args[1] == "search-index":
+        source = os.path.join(dirpathparent, "shopcube")
+        os.chdir(source)
+        sys.path.insert(0, source)
+        from modules.box__ecommerce.product.search import main as index_main
+
+        sys.exit(index_main(args[2:]))
+
+    elif args[1] == "benchmark":
+        source = os.path.join(dirpathparent, "shopcube")
+        os.chdir(source)
+        sys.path.insert(0, source)
+        from benchmarks.runner import main as benchmark_main
+
+        sys.exit(benchmark_main(args[2:], source))
+
     elif args[1] == "runhere":
         source = os.path.join(dirpathparent, "shopcube")
         commands = ["shopyo", *args[2:]]
@@ -1,4 +1,3 @@
-import importlib
 import json
 import logging
 import os
@@ -29,6 +28,14 @@ from init import modules_path
 from init import productexcel
 from init import productphotos
 from init import subcategoryphotos
+from utils.indexes import check_indexes
+from utils.instrumentation import init_instrumentation
+from utils.manifest import load_manifest
+from utils.manifest import register_modules
+from utils.page_cache import init_page_cache
+from utils.session_store import init_session_store
+from utils.template_globals import TemplateGlobals
+from utils.template_globals import lazy_value
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -80,6 +87,8 @@ def create_app(config_name, configs=None):
 
     migrate.init_app(app, db)
     db.init_app(app)
+    init_session_store(app)
+    init_instrumentation(app)
     ma.init_app(app)
     login_manager.init_app(app)
     csrf = CSRFProtect(app)  # noqa
@@ -101,81 +110,21 @@ def create_app(config_name, configs=None):
             module_static = os.path.join(modules_path, boxormodule, "static")
             return send_from_directory(module_static, filename=filename)
 
-    available_everywhere_entities = {}
-
     #
     #  load blueprints
     #
-    for folder in os.listdir(os.path.join(base_path, "modules")):
-        if folder.startswith("__"):  # ignore __pycache__
-            continue
-
-        if folder.startswith("box__"):
-            # boxes
-            for sub_folder in os.listdir(
-                os.path.join(base_path, "modules", folder)
-            ):
-                if sub_folder.startswith("__"):  # ignore __pycache__
-                    continue
-                elif sub_folder.endswith(".json"):  # box_info.json
-                    continue
-
-                sys.path.insert(0, base_path)
-                sys_mod = importlib.import_module(
-                    f"modules.{folder}.{sub_folder}.view"
-                )
-                print(
-                    "module",
-                    folder,
-                    sub_folder,
-                    file=open("file.log", "a"),
-                    flush=True,
-                )
-                try:
-                    sys.path.insert(0, base_path)
-                    mod_global = importlib.import_module(
-                        f"modules.{folder}.{sub_folder}.global"
-                    )
-                    available_everywhere_entities.update(
-                        mod_global.available_everywhere
-                    )
-                    print(
-                        "module",
-                        mod_global.available_everywhere,
-                        file=open("file.log", "a"),
-                        flush=True,
-                    )
-                except ImportError as e:
-                    # print(e)
-                    print(e, file=open("file.log", "a"), flush=True)
-                    pass
-                app.register_blueprint(
-                    getattr(sys_mod, f"{sub_folder}_blueprint")
-                )
-        else:
-            # apps
-            sys.path.insert(0, base_path)
-            mod = importlib.import_module(f"modules.{folder}.view")
-            print("module", folder, file=open("file.log", "a"), flush=True)
-            try:
-                sys.path.insert(0, base_path)
-                mod_global = importlib.import_module(
-                    f"modules.{folder}.global"
-                )
-                available_everywhere_entities.update(
-                    mod_global.available_everywhere
-                )
-
-                print(
-                    mod_global.available_everywhere,
-                    file=open("file.log", "a"),
-                    flush=True,
-                )
-            except ImportError as e:
-                # e
-                print(e, file=open("file.log", "a"), flush=True)
-                pass
-            app.register_blueprint(getattr(mod, f"{folder}_blueprint"))
+    sys.path.insert(0, base_path)
+    manifest = load_manifest(base_path)
+    app.extensions["module_manifest"] = manifest
+    available_everywhere_entities = register_modules(
+        app,
+        manifest,
+        base_path,
+        lazy=app.config.get("MODULES_LAZY_LOAD", False),
+    )
+    if app.config.get("CHECK_INDEXES_ON_STARTUP", True):
+        check_indexes(app)
+    init_page_cache(app)
 
     #
     # custom templates folder
@@ -198,47 +147,20 @@ def create_app(config_name, configs=None):
     #
     # global vars
     #
-    @app.context_processor
-    def inject_global_vars():
-        # theme_dir = os.path.join(
-        #     app.config["BASE_DIR"], "themes", get_setting("ACTIVE_FRONT_THEME")
-        # )
-        # info_path = os.path.join(theme_dir, "info.json")
-        # with open(info_path) as f:
-        #     info_data = json.load(f)
-        sys.path.insert(0, base_path)
-        from modules.box__default.settings.helpers import get_setting
-
-        APP_NAME = get_setting("APP_NAME")
-        SECTION_NAME = get_setting("SECTION_NAME")
-        SECTION_ITEMS = get_setting("SECTION_ITEMS")
-        # ACTIVE_FRONT_THEME = get_setting("ACTIVE_FRONT_THEME")
-        # ACTIVE_FRONT_THEME_VERSION = info_data["version"]
-        # ACTIVE_FRONT_THEME_STYLES_URL = url_for(
-        #     "resource.active_theme_css",
-        #     active_theme=ACTIVE_FRONT_THEME,
-        #     v=ACTIVE_FRONT_THEME_VERSION,
-        # )
-
-        base_context = {
-            "APP_NAME": APP_NAME,
-            "SECTION_NAME": SECTION_NAME,
-            "SECTION_ITEMS": SECTION_ITEMS,
-            # "ACTIVE_FRONT_THEME": ACTIVE_FRONT_THEME,
-            # "ACTIVE_FRONT_THEME_VERSION": ACTIVE_FRONT_THEME_VERSION,
-            # "ACTIVE_FRONT_THEME_STYLES_URL": ACTIVE_FRONT_THEME_STYLES_URL,
+    from modules.box__default.settings.helpers import get_setting
+
+    template_globals = TemplateGlobals(available_everywhere_entities)
+    template_globals.init_app(
+        app,
+        extra={
+            "APP_NAME": lazy_value(get_setting, "APP_NAME"),
+            "SECTION_NAME": lazy_value(get_setting, "SECTION_NAME"),
+            "SECTION_ITEMS": lazy_value(get_setting, "SECTION_ITEMS"),
             "len": len,
             "current_user": current_user,
-        }
-        base_context.update(available_everywhere_entities)
-
-        app.logger.info(available_everywhere_entities)
-
-        return base_context
-
-    print(
-        available_everywhere_entities, file=open("file.log", "a"), flush=True
+        },
     )
+
     # end of func
     return app
 
@@ -0,0 +1,10 @@
+"""
+Benchmarks of the shop against a synthetic catalogue, run with
+
+    shopcube benchmark [--products N] [--orders N] [--requests N]
+                       [--baseline FILE] [--save-baseline FILE]
+
+dataset.py generates the catalogue, scenarios.py lists the requests
+made to the hot endpoints and runner.py times them with the test client
+and compares the report to a saved baseline.
+"""
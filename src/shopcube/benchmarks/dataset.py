@@ -0,0 +1,346 @@
+"""
+Synthetic catalogue for the benchmarks
+
+generate inserts categories, subcategories, products with their sizes,
+colors and images, and past orders with their items and billing details.
+Rows are inserted in batches with core inserts, not the unit of work, so
+that a catalogue of a few hundred thousand products takes seconds. The
+values are drawn from a seeded random generator: the same sizes and seed
+give the same catalogue.
+
+Images only exist as resources rows, pages link to files that are not
+there, which does not change the time taken to render them.
+"""
+import datetime
+import json
+import os
+import random
+
+from sqlalchemy import func
+
+from init import db
+
+from modules.box__default.admin.models import User
+from modules.box__default.settings.helpers import bump_settings_version
+from modules.box__default.settings.models import Settings
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Color
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
+from modules.box__ecommerce.product.search import rebuild_index
+from modules.box__ecommerce.shop.models import BillingDetail
+from modules.box__ecommerce.shop.models import Order
+from modules.box__ecommerce.shop.models import OrderItem
+from modules.box__ecommerce.shopman.models import DeliveryOption
+from modules.box__ecommerce.shopman.models import PaymentOption
+from modules.resource.models import Resource
+
+BATCH_SIZE = 5000
+
+ADMIN_EMAIL = "benchmark-admin@domain.com"
+ADMIN_PASSWORD = "pass"
+
+ADJECTIVES = (
+    "classic",
+    "urban",
+    "vintage",
+    "sport",
+    "light",
+    "winter",
+    "summer",
+    "slim",
+    "relaxed",
+    "premium",
+)
+MATERIALS = ("leather", "cotton", "linen", "wool", "denim", "suede", "mesh")
+NOUNS = (
+    "sneaker",
+    "boot",
+    "sandal",
+    "jacket",
+    "shirt",
+    "trousers",
+    "dress",
+    "scarf",
+    "cap",
+    "bag",
+)
+SIZES = ("XS", "S", "M", "L", "XL", "36", "38", "40", "42", "44")
+COLORS = ("black", "white", "red", "navy", "green", "beige", "grey")
+ORDER_STATUSES = ("pending", "confirmed", "shipped", "cancelled", "refunded")
+
+
+class Dataset:
+    """
+    What generate inserted, for the scenarios to pick from
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.counts = {}
+        self.category_names = []
+        self.subcategory_ids = []
+        self.barcodes = []
+        self.variants = {}
+        self.delivery_option_id = None
+        self.payment_option_id = None
+        self.admin_id = None
+
+    def to_dict(self):
+        return {"seed": self.seed, "counts": dict(self.counts)}
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(
+            model.__table__.insert(), rows[start : start + BATCH_SIZE]
+        )
+
+
+def _add_settings():
+    config_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "config.json",
+    )
+    with open(config_path) as f:
+        settings = json.load(f)["settings"]
+    for name, value in settings.items():
+        if Settings.query.get(name) is None:
+            db.session.add(Settings(setting=name, value=value))
+    bump_settings_version()
+
+
+def _add_admin():
+    user = User.query.filter(User.email == ADMIN_EMAIL).first()
+    if user is None:
+        user = User(email=ADMIN_EMAIL, password=ADMIN_PASSWORD)
+        user.is_admin = True
+        user.is_email_confirmed = True
+        user.email_confirm_date = datetime.datetime.now()
+        db.session.add(user)
+        db.session.flush()
+    return user.id
+
+
+def _add_options(dataset):
+    delivery = DeliveryOption(option="Standard delivery", price=5)
+    payment = PaymentOption(name="Cash on delivery", text="Pay the courier")
+    db.session.add_all([delivery, payment])
+    db.session.flush()
+    dataset.delivery_option_id = delivery.id
+    dataset.payment_option_id = payment.id
+
+
+def _add_categories(dataset, rng, categories, subcategories):
+    category_id = _next_id(Category)
+    subcategory_id = _next_id(SubCategory)
+    category_rows = []
+    subcategory_rows = []
+    for i in range(categories):
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}s {i}"
+        category_rows.append({"id": category_id + i, "name": name})
+        dataset.category_names.append(name)
+        for j in range(subcategories):
+            subcategory_rows.append(
+                {
+                    "id": subcategory_id,
+                    "name": f"{rng.choice(MATERIALS)} {i}-{j}",
+                    "category_id": category_id + i,
+                }
+            )
+            dataset.subcategory_ids.append(subcategory_id)
+            subcategory_id += 1
+    _insert(Category, category_rows)
+    _insert(SubCategory, subcategory_rows)
+    return dict((row["id"], row["category_id"]) for row in subcategory_rows)
+
+
+def _add_products(dataset, rng, products, category_of):
+    product_id = _next_id(Product)
+    size_id = _next_id(Size)
+    color_id = _next_id(Color)
+    resource_id = _next_id(Resource)
+    today = datetime.date.today()
+    product_rows = []
+    size_rows = []
+    color_rows = []
+    resource_rows = []
+    for i in range(products):
+        pid = product_id + i
+        barcode = f"bench-{dataset.seed}-{i:07d}"
+        subcategory_id = rng.choice(dataset.subcategory_ids)
+        price = round(rng.uniform(5, 300), 2)
+        product_rows.append(
+            {
+                "id": pid,
+                "barcode": barcode,
+                "name": " ".join(
+                    [
+                        rng.choice(ADJECTIVES).capitalize(),
+                        rng.choice(MATERIALS),
+                        rng.choice(NOUNS),
+                        str(i),
+                    ]
+                ),
+                "description": " ".join(
+                    rng.choice(ADJECTIVES + MATERIALS + NOUNS)
+                    for _ in range(20)
+                ),
+                "date": str(today - datetime.timedelta(days=i % 730)),
+                "price": price,
+                "selling_price": round(price * rng.uniform(1, 1.5), 2),
+                "in_stock": rng.randint(0, 500),
+                "discontinued": False,
+                "is_onsale": rng.random() < 0.1,
+                "is_featured": rng.random() < 0.05,
+                "subcategory_id": subcategory_id,
+            }
+        )
+        sizes = rng.sample(SIZES, rng.randint(2, 5))
+        colors = rng.sample(COLORS, rng.randint(1, 3))
+        for name in sizes:
+            size_rows.append({"id": size_id, "name": name, "product_id": pid})
+            size_id += 1
+        for name in colors:
+            color_rows.append(
+                {"id": color_id, "name": name, "product_id": pid}
+            )
+            color_id += 1
+        for k in range(rng.randint(1, 3)):
+            resource_rows.append(
+                {
+                    "id": resource_id,
+                    "filename": f"{barcode}-{k}.jpg",
+                    "type": "image",
+                    "category": "product",
+                    "created_date": datetime.datetime.now(),
+                    "product_id": pid,
+                    "category_id": category_of[subcategory_id],
+                    "subcategory_id": subcategory_id,
+                }
+            )
+            resource_id += 1
+        dataset.barcodes.append(barcode)
+        dataset.variants[barcode] = (sizes, colors, product_rows[-1])
+    _insert(Product, product_rows)
+    _insert(Size, size_rows)
+    _insert(Color, color_rows)
+    _insert(Resource, resource_rows)
+    dataset.counts.update(
+        {
+            "sizes": len(size_rows),
+            "colors": len(color_rows),
+            "images": len(resource_rows),
+        }
+    )
+
+
+def _add_orders(dataset, rng, orders):
+    order_id = _next_id(Order)
+    item_id = _next_id(OrderItem)
+    billing_id = _next_id(BillingDetail)
+    now = datetime.datetime.now()
+    order_rows = []
+    item_rows = []
+    billing_rows = []
+    for i in range(orders):
+        oid = order_id + i
+        placed = now - datetime.timedelta(minutes=rng.randint(0, 525600))
+        total = 0.0
+        for _ in range(rng.randint(1, 4)):
+            barcode = rng.choice(dataset.barcodes)
+            sizes, colors, product = dataset.variants[barcode]
+            quantity = rng.randint(1, 3)
+            total += quantity * product["selling_price"]
+            item_rows.append(
+                {
+                    "id": item_id,
+                    "time": placed,
+                    "quantity": quantity,
+                    "size": rng.choice(sizes),
+                    "color": rng.choice(colors),
+                    "status": "pending",
+                    "barcode": barcode,
+                    "order_id": oid,
+                    "product_name": product["name"],
+                    "unit_price": product["selling_price"],
+                }
+            )
+            item_id += 1
+        email = f"customer{rng.randint(1, max(orders // 3, 1))}@domain.com"
+        order_rows.append(
+            {
+                "id": oid,
+                "time": placed,
+                "logged_in_customer_email": email,
+                "status": rng.choice(ORDER_STATUSES),
+                "total_amount": round(total, 2),
+            }
+        )
+        billing_rows.append(
+            {
+                "id": billing_id + i,
+                "first_name": "Bench",
+                "last_name": f"Customer {i}",
+                "country": "mauritius",
+                "street": f"{i} Royal Road",
+                "town_city": "Port Louis",
+                "phone": "5555555",
+                "email": email,
+                "order_notes": "",
+                "order_id": oid,
+            }
+        )
+    _insert(Order, order_rows)
+    _insert(OrderItem, item_rows)
+    _insert(BillingDetail, billing_rows)
+    dataset.counts["order_items"] = len(item_rows)
+
+
+def generate(
+    categories=10, subcategories=5, products=10000, orders=2000, seed=0
+):
+    """
+    Fills the database of the current app with a synthetic catalogue
+
+    Parameters
+    ----------
+    categories: int
+    subcategories: int
+        subcategories per category
+    products: int
+        each with 2 to 5 sizes, 1 to 3 colors and 1 to 3 images
+    orders: int
+        each with 1 to 4 items
+    seed: int
+
+    Returns
+    -------
+    Dataset
+    """
+    rng = random.Random(seed)
+    dataset = Dataset(seed)
+    db.create_all()
+    _add_settings()
+    dataset.admin_id = _add_admin()
+    _add_options(dataset)
+    category_of = _add_categories(dataset, rng, categories, subcategories)
+    _add_products(dataset, rng, products, category_of)
+    _add_orders(dataset, rng, orders)
+    db.session.commit()
+    # core inserts bypass the session events that keep it up to date
+    rebuild_index()
+    dataset.counts.update(
+        {
+            "categories": categories,
+            "subcategories": len(dataset.subcategory_ids),
+            "products": products,
+            "orders": orders,
+        }
+    )
+    return dataset
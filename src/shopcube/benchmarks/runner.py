@@ -0,0 +1,374 @@
+"""
+Benchmark runner
+
+Builds an app on a fresh sqlite database, fills it with
+benchmarks/dataset.py and makes the requests of every scenario with the
+test client. For each scenario the report gives the p50, p95 and p99
+latencies, the SQL queries per request and the peak memory allocated by
+a request, traced with tracemalloc on separate requests so that tracing
+does not slow down the timed ones.
+
+With --baseline the report is compared to one saved with
+--save-baseline, possibly on another commit, and the command exits with
+status 1 when a scenario got slower by more than the tolerance, runs
+more queries or allocates more memory.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import event
+
+from benchmarks import dataset as dataset_module
+from benchmarks.scenarios import get_scenarios
+from config import Config
+from config import app_config
+from utils.regressions import slower_values
+
+# latency differences below this many milliseconds are noise
+MIN_DELTA_MS = 2.0
+# allocation differences below this many kilobytes are noise
+MIN_DELTA_KB = 64
+
+
+def create_benchmark_app(database_uri):
+    """
+    App configured like production, on the given database
+    """
+    from app import create_app
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        # forms are posted without fetching their csrf token
+        WTF_CSRF_ENABLED = False
+        CHECK_INDEXES_ON_STARTUP = False
+
+    app_config["benchmark"] = BenchmarkConfig
+    app = create_app("benchmark")
+    # the instance config must not point the benchmark at another
+    # database
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    return app
+
+
+def percentile(values, q):
+    """
+    q-th percentile of values, interpolated between the closest ranks
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (
+        position - lower
+    )
+
+
+class QueryCounter:
+    """
+    Counts the statements run on an engine
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, many):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def _client(app, scenario, dataset):
+    client = app.test_client()
+    if scenario.login:
+        with client.session_transaction() as session:
+            session["_user_id"] = str(dataset.admin_id)
+            session["_fresh"] = True
+    return client
+
+
+def run_scenario(
+    app, scenario, dataset, requests=100, warmup=10, memory_requests=5
+):
+    """
+    Times the requests of a scenario
+
+    Returns
+    -------
+    dict
+        p50, p95, p99 and mean latencies in milliseconds, mean and max
+        queries per request, peak memory allocated by a request in
+        kilobytes and the number of responses with an error status
+    """
+    from init import db
+
+    rng = random.Random(dataset.seed)
+    client = _client(app, scenario, dataset)
+    if scenario.setup is not None:
+        scenario.setup(client, dataset, rng)
+
+    latencies = []
+    queries = []
+    errors = 0
+    with QueryCounter(db.get_engine(app)) as counter:
+        for i in range(warmup + requests):
+            if scenario.before is not None:
+                scenario.before(client, dataset, rng)
+            counter.count = 0
+            started = time.perf_counter()
+            response = scenario.request(client, dataset, rng)
+            elapsed = time.perf_counter() - started
+            if i < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            queries.append(counter.count)
+            if response.status_code >= 400:
+                errors += 1
+
+    peaks = []
+    for _ in range(memory_requests):
+        if scenario.before is not None:
+            scenario.before(client, dataset, rng)
+        tracemalloc.start()
+        try:
+            scenario.request(client, dataset, rng)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies),
+        "queries": statistics.mean(queries),
+        "max_queries": max(queries),
+        "memory_kb": max(peaks, default=0.0),
+        "errors": errors,
+        "requests": requests,
+    }
+
+
+def _commit(base_path):
+    try:
+        process = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=base_path,
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    return process.stdout.strip() or None
+
+
+def run_benchmark(
+    base_path,
+    scenario_names=None,
+    database_path=None,
+    requests=100,
+    warmup=10,
+    memory_requests=5,
+    **sizes,
+):
+    """
+    Generates the catalogue and runs the scenarios
+
+    Parameters
+    ----------
+    database_path: str
+        sqlite file to fill, a temporary one removed afterwards if None
+    sizes:
+        keyword arguments of dataset.generate
+
+    Returns
+    -------
+    dict
+        dataset counts, generation time, max resident memory and the
+        results of run_scenario by scenario name
+    """
+    scenarios = get_scenarios(scenario_names)
+    tmp_dir = None
+    if database_path is None:
+        tmp_dir = tempfile.mkdtemp(prefix="shopcube-benchmark-")
+        database_path = os.path.join(tmp_dir, "benchmark.db")
+    try:
+        app = create_benchmark_app(
+            "sqlite:///" + os.path.abspath(database_path)
+        )
+        with app.app_context():
+            started = time.perf_counter()
+            dataset = dataset_module.generate(**sizes)
+            generation = time.perf_counter() - started
+        # outside of the app context: requests made within it would share
+        # its g, and with it the current user and the request caches
+        results = {
+            scenario.name: run_scenario(
+                app,
+                scenario,
+                dataset,
+                requests=requests,
+                warmup=warmup,
+                memory_requests=memory_requests,
+            )
+            for scenario in scenarios
+        }
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        "commit": _commit(base_path),
+        "dataset": dataset.to_dict(),
+        "generation_seconds": generation,
+        # kilobytes on linux
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "scenarios": results,
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.25):
+    """
+    Regressions of a report against a baseline report
+
+    Parameters
+    ----------
+    tolerance: float
+        part by which a latency or an allocation may grow before being
+        a regression
+
+    Returns
+    -------
+    list
+        messages, empty if there is no regression
+    """
+    regressions = []
+    if report["dataset"] != baseline["dataset"]:
+        regressions.append("the baseline was made with another dataset")
+    for name, result in sorted(report["scenarios"].items()):
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        regressions += slower_values(
+            {f"{name} {key}": result[key] for key in ("p50", "p95", "p99")},
+            {f"{name} {key}": before[key] for key in ("p50", "p95", "p99")},
+            tolerance,
+            MIN_DELTA_MS,
+            "{name} went from {before:.1f}ms to {after:.1f}ms",
+        )
+        # queries do not vary from run to run, any increase counts
+        if result["max_queries"] > before["max_queries"]:
+            regressions.append(
+                f"{name} went from {before['max_queries']} to "
+                f"{result['max_queries']} queries per request"
+            )
+        regressions += slower_values(
+            {f"{name} allocation": result["memory_kb"]},
+            {f"{name} allocation": before["memory_kb"]},
+            tolerance,
+            MIN_DELTA_KB,
+            "{name} went from {before:.0f}KB to {after:.0f}KB",
+        )
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{name} has {result['errors']} errors")
+    return regressions
+
+
+def print_report(report):
+    counts = report["dataset"]["counts"]
+    print(
+        "catalogue of {products} products, {orders} orders, "
+        "generated in {seconds:.1f}s".format(
+            seconds=report["generation_seconds"], **counts
+        )
+    )
+    print(
+        f"\n{'scenario':<18}{'p50':>9}{'p95':>9}{'p99':>9}"
+        f"{'queries':>9}{'alloc':>10}{'errors':>8}"
+    )
+    for name, result in report["scenarios"].items():
+        print(
+            f"{name:<18}"
+            f"{result['p50']:>7.1f}ms"
+            f"{result['p95']:>7.1f}ms"
+            f"{result['p99']:>7.1f}ms"
+            f"{result['queries']:>9.1f}"
+            f"{result['memory_kb']:>8.0f}KB"
+            f"{result['errors']:>8}"
+        )
+    print(f"\nmax resident memory {report['max_rss_kb'] / 1024:.0f}MB")
+
+
+def main(argv, base_path):
+    parser = argparse.ArgumentParser(prog="shopcube benchmark")
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument(
+        "--subcategories", type=int, default=5, help="per category"
+    )
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--requests", type=int, default=100, help="timed per scenario"
+    )
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="run only this scenario, can be repeated",
+    )
+    parser.add_argument(
+        "--database", help="sqlite file to fill instead of a temporary one"
+    )
+    parser.add_argument("--baseline", help="baseline json to compare to")
+    parser.add_argument("--save-baseline", help="write the report as json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        base_path,
+        scenario_names=args.scenario,
+        database_path=args.database,
+        requests=args.requests,
+        warmup=args.warmup,
+        categories=args.categories,
+        subcategories=args.subcategories,
+        products=args.products,
+        orders=args.orders,
+        seed=args.seed,
+    )
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        print(f"\nbaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(
+                f"\nregressions against {args.baseline} "
+                f"(commit {baseline.get('commit')})"
+            )
+            for message in regressions:
+                print("  " + message)
+            return 1
+        print("\nno regression against", args.baseline)
+    return 0
@@ -0,0 +1,165 @@
+"""
+Requests made by the benchmarks
+
+A scenario is one kind of request to a hot endpoint. Each scenario gets
+its own test client, so its own session and cart. setup runs once
+before the scenario is timed, before runs ahead of every timed request
+and is not timed itself.
+"""
+from benchmarks.dataset import ADJECTIVES
+from benchmarks.dataset import NOUNS
+
+# products kept in the carts of the cart and checkout scenarios
+CART_LINES = 3
+
+
+class Scenario:
+    def __init__(self, name, request, setup=None, before=None, login=False):
+        self.name = name
+        self.request = request
+        self.setup = setup
+        self.before = before
+        self.login = login
+
+
+def cart_lines(dataset, count=CART_LINES):
+    """
+    (barcode, size, color) of the first products with enough stock to
+    be added many times
+    """
+    lines = []
+    for barcode in dataset.barcodes:
+        sizes, colors, product = dataset.variants[barcode]
+        if product["in_stock"] >= 100:
+            lines.append((barcode, sizes[0], colors[0]))
+        if len(lines) == count:
+            break
+    return lines
+
+
+def add_to_cart(client, barcode, size, color, quantity=1):
+    return client.post(
+        f"/shop/cart/add/{barcode}",
+        data={
+            "barcode": barcode,
+            "quantity": quantity,
+            "size": size,
+            "color": color,
+        },
+    )
+
+
+def fill_cart(client, dataset, rng):
+    for barcode, size, color in cart_lines(dataset):
+        add_to_cart(client, barcode, size, color)
+
+
+def shop_index(client, dataset, rng):
+    return client.get("/shop/")
+
+
+def category(client, dataset, rng):
+    return client.get(f"/shop/c/{rng.choice(dataset.category_names)}")
+
+
+def subcategory(client, dataset, rng):
+    return client.get(f"/shop/sub/{rng.choice(dataset.subcategory_ids)}")
+
+
+def product(client, dataset, rng):
+    return client.get(f"/shop/product/{rng.choice(dataset.barcodes)}")
+
+
+def search(client, dataset, rng):
+    query = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    return client.get("/shop/search", query_string={"q": query})
+
+
+def cart_add(client, dataset, rng):
+    barcode, size, color = rng.choice(cart_lines(dataset))
+    return add_to_cart(client, barcode, size, color)
+
+
+def cart_view(client, dataset, rng):
+    return client.get("/shop/cart")
+
+
+def cart_update(client, dataset, rng):
+    data = {}
+    for number, (barcode, size, color) in enumerate(cart_lines(dataset), 1):
+        data.update(
+            {
+                f"barcode_{number}": barcode,
+                f"size_{number}": size,
+                f"color_{number}": color,
+                f"quantity_{number}": rng.randint(1, 3),
+            }
+        )
+    return client.post("/shop/cart/update", data=data)
+
+
+def checkout(client, dataset, rng):
+    return client.get("/shop/checkout")
+
+
+def setup_checkout(client, dataset, rng):
+    # the checkout page keeps the form data in the session
+    fill_cart(client, dataset, rng)
+    client.get("/shop/checkout")
+
+
+def checkout_process(client, dataset, rng):
+    return client.post(
+        "/shop/checkout/process",
+        data={
+            "default_first_name": "Bench",
+            "default_last_name": "Customer",
+            "default_country": "mauritius",
+            "default_street": "1 Royal Road",
+            "default_town_city": "Port Louis",
+            "default_phone": "5555555",
+            "default_email": "bench@domain.com",
+            "default_order_notes": "",
+            # validated even when the address is the default one
+            "diff_country": "mauritius",
+            "deliveryoption": dataset.delivery_option_id,
+            "paymentoption": dataset.payment_option_id,
+        },
+    )
+
+
+def order_dashboard(client, dataset, rng):
+    return client.get("/shopman/order/dashboard")
+
+
+SCENARIOS = [
+    Scenario("shop_index", shop_index),
+    Scenario("category", category),
+    Scenario("subcategory", subcategory),
+    Scenario("product", product),
+    Scenario("search", search),
+    Scenario("cart_add", cart_add),
+    Scenario("cart_view", cart_view, setup=fill_cart),
+    Scenario("cart_update", cart_update, setup=fill_cart),
+    Scenario("checkout", checkout, setup=fill_cart),
+    Scenario(
+        "checkout_process",
+        checkout_process,
+        setup=setup_checkout,
+        before=fill_cart,
+    ),
+    Scenario("order_dashboard", order_dashboard, login=True),
+]
+
+
+def get_scenarios(names=None):
+    """
+    Scenarios in SCENARIOS order, only the given ones if names is set
+    """
+    if not names:
+        return list(SCENARIOS)
+    known = {scenario.name: scenario for scenario in SCENARIOS}
+    unknown = sorted(set(names) - set(known))
+    if unknown:
+        raise ValueError(f"unknown scenarios: {', '.join(unknown)}")
+    return [scenario for scenario in SCENARIOS if scenario.name in names]
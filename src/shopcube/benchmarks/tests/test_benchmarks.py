@@ -0,0 +1,93 @@
+"""
+Tests the synthetic catalogue and the runner of benchmarks/
+"""
+import pytest
+
+from benchmarks.dataset import generate
+from benchmarks.runner import compare_to_baseline
+from benchmarks.runner import percentile
+from benchmarks.runner import run_scenario
+from benchmarks.scenarios import get_scenarios
+
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.models import Order
+
+
+@pytest.fixture
+def dataset():
+    return generate(
+        categories=2, subcategories=2, products=30, orders=10, seed=7
+    )
+
+
+def make_result(**changes):
+    result = {
+        "p50": 10.0,
+        "p95": 20.0,
+        "p99": 30.0,
+        "queries": 5,
+        "max_queries": 5,
+        "memory_kb": 200.0,
+        "errors": 0,
+    }
+    result.update(changes)
+    return result
+
+
+def make_report(**changes):
+    return {
+        "dataset": {"seed": 0, "counts": {"products": 100}},
+        "scenarios": {"product": make_result(**changes)},
+    }
+
+
+class TestBenchmarks:
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert percentile(values, 50) == 50.5
+        assert percentile(values, 99) == pytest.approx(99.01)
+        assert percentile([3.0], 95) == 3.0
+
+    def test_generate(self, dataset):
+        products = Product.query.filter(
+            Product.barcode.like("bench-7-%")
+        ).all()
+
+        assert len(products) == 30
+        assert all(2 <= len(p.sizes) <= 5 for p in products)
+        assert all(1 <= len(p.colors) <= 3 for p in products)
+        assert all(p.resources for p in products)
+        assert Order.query.filter(Order.total_amount > 0).count() >= 10
+        assert dataset.counts["subcategories"] == 4
+
+    def test_run_scenario(self, flask_app, dataset):
+        for scenario in get_scenarios(["product", "cart_add"]):
+            result = run_scenario(
+                flask_app,
+                scenario,
+                dataset,
+                requests=5,
+                warmup=1,
+                memory_requests=1,
+            )
+
+            assert result["errors"] == 0
+            assert result["queries"] > 0
+            assert result["p50"] <= result["p95"] <= result["p99"]
+            assert result["memory_kb"] > 0
+
+    def test_unknown_scenario(self):
+        with pytest.raises(ValueError):
+            get_scenarios(["nope"])
+
+    def test_regressions(self):
+        report = make_report(p99=60.0, max_queries=7, errors=1)
+
+        regressions = compare_to_baseline(report, make_report())
+
+        assert regressions == [
+            "product p99 went from 30.0ms to 60.0ms",
+            "product went from 5 to 7 queries per request",
+            "product has 1 errors",
+        ]
@@ -12,7 +12,7 @@ class Config:
     BASE_DIR = base_path
     STATIC = os.path.join(BASE_DIR, "static")
     UPLOADED_PATH_IMAGE = os.path.join(STATIC, "uploads", "images")
-    UPLOADED_PATH_THUM = os.path.join(STATIC, "uploads", "thumbs")
+    UPLOADED_PATH_THUMB = os.path.join(STATIC, "uploads", "thumbs")
 
     UPLOADED_PRODUCTPHOTOS_DEST = os.path.join(STATIC, "uploads", "products")
     UPLOADED_CATEGORYPHOTOS_DEST = os.path.join(STATIC, "uploads", "category")
@@ -24,6 +24,83 @@ class Config:
     PASSWORD_SALT = "abcdefghi"
 
     SQLALCHEMY_DATABASE_URI = "sqlite:///shopcube.db"
+    # seconds between checks of the settings version counter
+    SETTINGS_CACHE_TTL = 5
+    # seconds between checks of theme info.json and styles.css changes
+    THEME_CACHE_TTL = 10
+    # seconds between checks that the category tree snapshot of a process
+    # is current, see modules/box__ecommerce/category/tree.py
+    CATEGORY_TREE_TTL = 5
+    # seconds the stock of a cart is held while the visitor checks out
+    STOCK_RESERVATION_TTL = 15 * 60
+    # run enqueued jobs in the request instead of the job workers
+    JOBS_RUN_INLINE = False
+    JOBS_MAX_ATTEMPTS = 3
+    # seconds before the first retry of a failed job, doubled every retry
+    JOBS_RETRY_DELAY = 30
+    # seconds after which a running job is considered lost by its worker
+    JOBS_STALE_AFTER = 3600
+    # import the views of modules marked lazy in the module manifest on
+    # the first request to their urls instead of at startup
+    MODULES_LAZY_LOAD = False
+    # where sessions are kept: sql, memory or cookie
+    SESSION_BACKEND = "sql"
+    # sessions kept by the memory backend
+    SESSION_MEMORY_MAX = 10000
+    # serialized sessions from this many bytes are compressed
+    SESSION_COMPRESS_MIN = 1024
+    # seconds between deletions of expired sessions
+    SESSION_GC_INTERVAL = 3600
+    # product search index: fts5, memory, or auto for fts5 when the
+    # database supports it
+    SEARCH_BACKEND = "auto"
+    # warn at startup about hot path indexes missing from the database
+    CHECK_INDEXES_ON_STARTUP = True
+    # record sql and template timings of every request, see
+    # utils/instrumentation.py
+    INSTRUMENTATION = False
+    # show the timings to admins at the bottom of html pages
+    INSTRUMENTATION_OVERLAY = False
+    # requests per endpoint kept in the instrumentation summary
+    INSTRUMENTATION_WINDOW = 200
+    # times a statement must run in a request to be reported
+    INSTRUMENTATION_DUPLICATE_MIN = 3
+    # directory where every process writes its metrics so that /metrics
+    # adds up all the gunicorn workers, None for a single process
+    METRICS_DIR = None
+    # seconds between writes of the metrics of a process
+    METRICS_FLUSH_INTERVAL = 1.0
+    # bearer token required by /metrics, None to only answer scrapes
+    # from the host itself
+    METRICS_TOKEN = None
+    # cache the storefront pages of anonymous visitors with empty carts,
+    # see utils/page_cache.py
+    PAGE_CACHE = False
+    # where cached pages are kept: memory, filesystem or redis
+    PAGE_CACHE_BACKEND = "memory"
+    # seconds a page is kept at most
+    PAGE_CACHE_TTL = 300
+    # pages and bytes of pages kept by the memory backend
+    PAGE_CACHE_MAX_ENTRIES = 1000
+    PAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # directory of the filesystem backend, None for instance/page_cache
+    PAGE_CACHE_DIR = None
+    # url of the redis backend e.g. redis://localhost:6379/0
+    PAGE_CACHE_URL = None
+    # answer If-None-Match and If-Modified-Since with 304 on the product,
+    # category and page views, see utils/conditional.py
+    CONDITIONAL_GET = True
+    # mail dispatcher: sending threads, each with its own SMTP connection
+    MAIL_DISPATCHER_WORKERS = 2
+    MAIL_QUEUE_SIZE = 1000
+    # messages sent in a row over a connection
+    MAIL_BATCH_SIZE = 20
+    # seconds to wait for room in a full queue before dropping a message
+    MAIL_QUEUE_TIMEOUT = 2
+    # seconds an unused SMTP connection stays open
+    MAIL_CONNECTION_IDLE = 30
+    # send emails from the job workers, retried, instead of the request
+    MAIL_USE_JOBS = False
 
 
 class DevelopmentConfig(Config):
@@ -33,6 +110,9 @@ class DevelopmentConfig(Config):
     DEBUG = True
     # EXPLAIN_TEMPLATE_LOADING = True
     LOGIN_DISABLED = True
+    THEME_CACHE_TTL = 0
+    INSTRUMENTATION = True
+    INSTRUMENTATION_OVERLAY = True
     # control email confirmation for user registration
     EMAIL_CONFIRMATION_DISABLED = False
     # flask-mailman configs
@@ -58,6 +138,9 @@ class TestingConfig(Config):
     BCRYPT_LOG_ROUNDS = 4
     TESTING = True
     WTF_CSRF_ENABLED = False
+    SETTINGS_CACHE_TTL = 0
+    CATEGORY_TREE_TTL = 0
+    SESSION_BACKEND = "memory"
 
 
 app_config = {
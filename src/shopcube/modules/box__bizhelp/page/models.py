@@ -1,9 +1,10 @@
 from datetime import datetime
 
 from init import db
+from utils.conditional import VersionMixin
 
 
-class Page(db.Model):
+class Page(VersionMixin, db.Model):
 
     __tablename__ = "pages"
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,27 @@
+"""
+This file (test_page.py) contains the functional tests for the `page`
+blueprint.
+"""
+from init import db
+
+from modules.box__bizhelp.page.models import Page
+
+
+def test_view_page_not_modified(flask_app, db_session):
+    page = Page(title="About", slug="about", content="<p>About us</p>")
+    page.insert()
+    page_id = page.id
+    client = flask_app.test_client()
+    url = f"/page/{page_id}/about"
+
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    Page.query.get(page_id).content = "<p>About us, again</p>"
+    db.session.commit()
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"About us, again" in response.data
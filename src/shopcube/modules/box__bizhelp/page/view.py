@@ -10,6 +10,11 @@ from flask import url_for
 from flask_login import login_required
 from shopyo.api.forms import flash_errors
 
+from utils.conditional import conditional
+from utils.conditional import latest
+
+from modules.box__ecommerce.category.tree import tree_validators
+
 from .forms import PageForm
 from .models import Page
 
@@ -45,7 +50,24 @@ def index():
     return render_template("page/all_pages.html", **context)
 
 
+def page_validators(page_id, slug):
+    """
+    Conditional GET validators of a page, see utils/conditional.py, with
+    the category tree shown by the menus of the themes
+    """
+    row = (
+        Page.query.with_entities(Page.id, Page.version, Page.updated_at)
+        .filter(Page.id == page_id)
+        .first()
+    )
+    if row is None:
+        return None
+    tree, tree_updated_at = tree_validators()
+    return [row[0], row[1], tree], latest(row[2], tree_updated_at)
+
+
 @module_blueprint.route("/<page_id>/<slug>")
+@conditional(page_validators)
 def view_page(page_id, slug):
     context = {}
     page = Page.query.get(page_id)
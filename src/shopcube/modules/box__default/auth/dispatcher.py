@@ -0,0 +1,266 @@
+"""
+Mail dispatcher sending emails out of the request with a fixed pool of
+threads. Messages wait in a bounded queue, every thread keeps its SMTP
+connection open between messages and sends whatever is queued in
+batches over it, closing the connection after MAIL_CONNECTION_IDLE
+seconds without mail. When the queue is full submit waits at most
+MAIL_QUEUE_TIMEOUT seconds before dropping the message, so that a mail
+server outage cannot pile up unbounded work in the web workers.
+"""
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# put on the queue to stop a thread
+_STOP = object()
+_create_lock = threading.Lock()
+
+
+class MailDispatcher:
+    """
+    Parameters
+    ----------
+    app: Flask
+        application whose mail settings are used
+    workers: int
+        number of sending threads, hence of SMTP connections
+    queue_size: int
+        messages waiting to be sent before submit blocks
+    batch_size: int
+        messages a thread takes from the queue at once
+    queue_timeout: float
+        seconds submit waits for room in a full queue
+    idle_timeout: float
+        seconds a connection stays open without mail to send
+    connection_options: dict
+        optional, passed to flask-mailman get_connection to override the
+        mail settings of the app e.g. backend, host and port
+    """
+
+    def __init__(
+        self,
+        app,
+        workers=2,
+        queue_size=1000,
+        batch_size=20,
+        queue_timeout=2.0,
+        idle_timeout=30.0,
+        connection_options=None,
+    ):
+        self.app = app
+        self.connection_options = connection_options or {}
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "sent": 0,
+            "failed": 0,
+            "rejected": 0,
+            "batches": 0,
+            "connections": 0,
+            "max_queue_depth": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def start(self):
+        with self._lock:
+            if self.threads:
+                return
+            self.threads = [
+                threading.Thread(
+                    target=self._work, name=f"mail-dispatcher-{i}", daemon=True
+                )
+                for i in range(self.workers)
+            ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, msg):
+        """
+        Queues a flask-mailman message
+
+        Returns
+        -------
+        bool
+            False if the message was dropped because the queue stayed
+            full for queue_timeout seconds
+        """
+        self.start()
+        started = time.monotonic()
+        try:
+            self.queue.put(msg, timeout=self.queue_timeout)
+        except queue.Full:
+            self._count("rejected")
+            logger.warning(
+                "Mail queue full, dropped email to %s", ", ".join(msg.to)
+            )
+            return False
+        finally:
+            self._count("wait_seconds", time.monotonic() - started)
+
+        depth = self.queue.qsize()
+        with self._lock:
+            self._stats["submitted"] += 1
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+        return True
+
+    def stats(self):
+        """
+        Counters of the dispatcher plus the current queue depth
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["queue_size"] = self.queue.maxsize
+        stats["workers"] = len(self.threads)
+        return stats
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued message has been handled
+
+        Returns
+        -------
+        bool
+            False if timeout seconds passed first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=10):
+        """
+        Sends what is queued then stops the threads
+        """
+        threads = self.threads
+        if not threads:
+            return
+        self.flush(timeout)
+        for _ in threads:
+            self.queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+        with self._lock:
+            self.threads = []
+
+    def _next_batch(self):
+        """
+        Waits for a message then takes the ones already queued behind it,
+        up to batch_size
+
+        Returns
+        -------
+        tuple
+            the messages and whether the thread was asked to stop
+        """
+        batch = []
+        msg = self.queue.get(timeout=self.idle_timeout)
+        while msg is not _STOP:
+            batch.append(msg)
+            if len(batch) == self.batch_size:
+                return batch, False
+            try:
+                msg = self.queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        self.queue.task_done()
+        return batch, True
+
+    def _open(self, connection):
+        if connection.open():
+            self._count("connections")
+
+    def _send(self, connection, msg):
+        try:
+            self._open(connection)
+            connection.send_messages([msg])
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # the server closed the pooled connection, retry once on a
+            # fresh one
+            self._reset(connection)
+            self._open(connection)
+            connection.send_messages([msg])
+
+    def _reset(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            connection.connection = None
+
+    def _work(self):
+        with self.app.app_context():
+            connection = current_app.extensions["mailman"].get_connection(
+                **self.connection_options
+            )
+            stop = False
+            while not stop:
+                try:
+                    batch, stop = self._next_batch()
+                except queue.Empty:
+                    # idle, give the connection back to the server
+                    self._reset(connection)
+                    continue
+
+                if batch:
+                    self._count("batches")
+                for msg in batch:
+                    try:
+                        self._send(connection, msg)
+                        self._count("sent")
+                    except Exception:
+                        self._count("failed")
+                        logger.exception(
+                            "Could not send email to %s", ", ".join(msg.to)
+                        )
+                        self._reset(connection)
+                    finally:
+                        self.queue.task_done()
+            self._reset(connection)
+
+
+def get_dispatcher(app=None):
+    """
+    Mail dispatcher of an application, created on first use from the
+    MAIL_DISPATCHER_* config
+    """
+    if app is None:
+        app = current_app._get_current_object()
+    with _create_lock:
+        dispatcher = app.extensions.get("mail_dispatcher")
+        if dispatcher is not None:
+            return dispatcher
+        dispatcher = MailDispatcher(
+            app,
+            workers=app.config.get("MAIL_DISPATCHER_WORKERS", 2),
+            queue_size=app.config.get("MAIL_QUEUE_SIZE", 1000),
+            batch_size=app.config.get("MAIL_BATCH_SIZE", 20),
+            queue_timeout=app.config.get("MAIL_QUEUE_TIMEOUT", 2.0),
+            idle_timeout=app.config.get("MAIL_CONNECTION_IDLE", 30.0),
+        )
+        app.extensions["mail_dispatcher"] = dispatcher
+        atexit.register(dispatcher.shutdown)
+    return dispatcher
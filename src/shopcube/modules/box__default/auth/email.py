@@ -2,41 +2,74 @@
 This file email.py contains functions for sending
 text and html rendered emails asynchronously
 """
-from threading import Thread
-
 from flask import current_app
 from flask import render_template
 
 from flask_mailman import EmailMultiAlternatives
 
+from modules.box__default.auth.dispatcher import get_dispatcher
+from modules.box__default.jobs.helpers import task
+
+
+def mail_configured():
+    if (
+        "MAIL_USERNAME" not in current_app.config
+        or "MAIL_PASSWORD" not in current_app.config
+        or current_app.config["MAIL_USERNAME"] is None
+        or current_app.config["MAIL_PASSWORD"] is None
+    ):
+        print(
+            "\nShopyo Error: MAIL_USERNAME, and/or MAIL_PASSWORD"
+            " not configured\n"
+        )
+        return False
+    return True
 
-def _send_email_helper(app, msg):
+
+def dispatch_email(msg):
     """
-    Helper function used for sending email message
+    Hands a message over to the mail dispatcher of the app, which sends
+    it from its pool of SMTP connections
     Args:
-        app (Flask): The flask app object
         msg (flask-mailman email object): any email/messsage object
             defined for flask-mailman. Example EmailMessage
+    Returns:
+        bool: whether the message was queued
     """
-    with app.app_context():
-        if (
-            "MAIL_USERNAME" not in current_app.config
-            or "MAIL_PASSWORD" not in current_app.config
-            or current_app.config["MAIL_USERNAME"] is None
-            or current_app.config["MAIL_PASSWORD"] is None
-        ):
-            print(
-                "\nShopyo Error: MAIL_USERNAME, and/or MAIL_PASSWORD"
-                " not configured\n"
-            )
-            return
+    if not mail_configured():
+        return False
+    return get_dispatcher().submit(msg)
 
-        msg.send()
+
+def _make_message(to, subject, body, html, from_email):
+    msg = EmailMultiAlternatives(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        to=[to],
+    )
+    msg.attach_alternative(html, "text/html")
+    return msg
+
+
+@task("auth.send_email")
+def send_email_job(ctx, to, subject, body, html, from_email):
+    """
+    Job handing an email rendered by send_async_email over to the mail
+    dispatcher of the worker, retried while the dispatcher queue is full
+    """
+    if not mail_configured():
+        return False
+    if not dispatch_email(_make_message(to, subject, body, html, from_email)):
+        raise RuntimeError(f"Mail queue full, email to {to} not sent")
+    return True
 
 
 def send_async_email(to, subject, template, from_email=None, **kwargs):
     """
-    Sends email anachronously i.e the function is non blocking.
+    Sends email anachronously i.e the function is non blocking, the
+    message is sent by the mail dispatcher, or by the job workers with
+    retries when MAIL_USE_JOBS is set.
     Assume email template is valid i.e it can be rendered using
     flask' render_template function and both .html and .txt
     email template files exits
@@ -46,6 +79,9 @@ def send_async_email(to, subject, template, from_email=None, **kwargs):
         template (String): template file path to be used in email body
         from_email (String, optional): sender of the email. If not set
             MAIL_DEFAULT_SENDER is used from config.
+    Returns:
+        bool or Job: whether the message was queued, or the job sending
+            it when MAIL_USE_JOBS is set
     """
 
     if from_email is None:
@@ -58,18 +94,19 @@ def send_async_email(to, subject, template, from_email=None, **kwargs):
 
         from_email = current_app.config["MAIL_DEFAULT_SENDER"]
 
-    app = current_app._get_current_object()
     template_txt = render_template(f"{template}.txt", **kwargs)
     template_html = render_template(f"{template}.html", **kwargs)
 
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=template_txt,
-        from_email=from_email,
-        to=[to],
-    )
-    msg.attach_alternative(template_html, "text/html")
+    if current_app.config.get("MAIL_USE_JOBS", False):
+        # rendered here so that kwargs need not be json serialisable
+        return send_email_job.enqueue(
+            to=to,
+            subject=subject,
+            body=template_txt,
+            html=template_html,
+            from_email=from_email,
+        )
 
-    thr = Thread(target=_send_email_helper, args=[app, msg])
-    thr.start()
-    return thr
+    return dispatch_email(
+        _make_message(to, subject, template_txt, template_html, from_email)
+    )
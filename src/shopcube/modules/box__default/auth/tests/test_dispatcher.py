@@ -0,0 +1,126 @@
+"""
+This file (test_dispatcher.py) contains the tests for the mail
+dispatcher, run against a local debugging SMTP server
+"""
+import socketserver
+import threading
+
+import pytest
+from flask_mailman import EmailMessage
+
+from modules.box__default.auth.dispatcher import MailDispatcher
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        with self.server.lock:
+            self.server.sessions += 1
+        self.reply(b"220 localhost debugging server")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"DATA":
+                self.reply(b"354 end data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in iter(self.rfile.readline, b".\r\n"):
+                    data.append(data_line)
+                with self.server.lock:
+                    self.server.messages.append(b"".join(data))
+                self.reply(b"250 OK")
+            elif command == b"QUIT":
+                self.reply(b"221 bye")
+                return
+            else:
+                self.reply(b"250 OK")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(
+        ("127.0.0.1", 0), DebuggingSMTPHandler
+    )
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.sessions = 0
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_message(i):
+    return EmailMessage(
+        subject=f"Order {i}",
+        body="Thank you for your order",
+        from_email="shop@domain.com",
+        to=[f"customer{i}@domain.com"],
+    )
+
+
+class TestMailDispatcher:
+    def test_messages_share_pooled_connections(self, flask_app, smtp_server):
+        dispatcher = MailDispatcher(
+            flask_app,
+            workers=2,
+            batch_size=5,
+            connection_options={
+                "backend": "smtp",
+                "host": "127.0.0.1",
+                "port": smtp_server.server_address[1],
+                "username": "",
+                "password": "",
+            },
+        )
+        try:
+            for i in range(20):
+                assert dispatcher.submit(make_message(i))
+            assert dispatcher.flush(timeout=10)
+        finally:
+            dispatcher.shutdown()
+
+        stats = dispatcher.stats()
+        assert len(smtp_server.messages) == 20
+        assert stats["sent"] == 20
+        assert stats["failed"] == 0
+        assert stats["connections"] <= 2
+        assert smtp_server.sessions <= 2
+        assert any(b"Subject: Order 19" in m for m in smtp_server.messages)
+
+    def test_full_queue_drops_messages(self, flask_app):
+        # without threads nothing drains the queue
+        dispatcher = MailDispatcher(
+            flask_app, workers=0, queue_size=1, queue_timeout=0.01
+        )
+
+        assert dispatcher.submit(make_message(1))
+        assert not dispatcher.submit(make_message(2))
+
+        stats = dispatcher.stats()
+        assert stats["submitted"] == 1
+        assert stats["rejected"] == 1
+        assert stats["queue_depth"] == 1
+
+    def test_unreachable_server_counts_failures(self, flask_app):
+        dispatcher = MailDispatcher(
+            flask_app,
+            workers=1,
+            connection_options={
+                "backend": "smtp",
+                "host": "127.0.0.1",
+                "port": 1,
+            },
+        )
+        try:
+            dispatcher.submit(make_message(1))
+            assert dispatcher.flush(timeout=10)
+        finally:
+            dispatcher.shutdown()
+
+        assert dispatcher.stats()["failed"] == 1
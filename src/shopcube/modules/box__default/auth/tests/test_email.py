@@ -0,0 +1,52 @@
+"""
+This file (test_email.py) contains the tests for sending the emails
+from the job workers, see auth/email.py
+"""
+import pytest
+
+from modules.box__default.auth import email
+from modules.box__default.jobs.helpers import run_pending_jobs
+from modules.box__default.jobs.models import JOB_DONE
+from modules.box__default.jobs.models import JOB_QUEUED
+
+
+@pytest.fixture
+def mail_jobs(flask_app, monkeypatch):
+    sent = []
+    monkeypatch.setitem(flask_app.config, "MAIL_USE_JOBS", True)
+    monkeypatch.setitem(flask_app.config, "MAIL_USERNAME", "shop")
+    monkeypatch.setitem(flask_app.config, "MAIL_PASSWORD", "secret")
+    monkeypatch.setitem(flask_app.config, "MAIL_DEFAULT_SENDER", "shop@mail")
+    monkeypatch.setattr(email, "render_template", lambda name, **kw: name)
+    monkeypatch.setattr(
+        email, "dispatch_email", lambda msg: sent.append(msg) or True
+    )
+    return sent
+
+
+def test_email_sent_by_a_job(db_session, mail_jobs):
+    job = email.send_async_email("buyer@mail.com", "Order", "shop/order")
+
+    assert job.status == JOB_QUEUED
+    assert mail_jobs == []
+    run_pending_jobs()
+
+    assert job.status == JOB_DONE
+    assert [msg.to for msg in mail_jobs] == [["buyer@mail.com"]]
+    assert mail_jobs[0].body == "shop/order.txt"
+    assert mail_jobs[0].alternatives == [("shop/order.html", "text/html")]
+
+
+def test_email_job_retried_while_the_queue_is_full(
+    db_session, mail_jobs, monkeypatch
+):
+    monkeypatch.setattr(email, "dispatch_email", lambda msg: False)
+    # the rollback of the failed job would undo the test transaction
+    monkeypatch.setattr(db_session, "rollback", lambda: None)
+    job = email.send_async_email("buyer@mail.com", "Order", "shop/order")
+
+    run_pending_jobs()
+
+    assert job.status == JOB_QUEUED
+    assert job.attempts == 1
+    assert "Mail queue full" in job.error
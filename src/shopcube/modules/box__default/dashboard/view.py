@@ -1,6 +1,3 @@
-import json
-import os
-
 from flask import Blueprint
 from flask import current_app
 from flask import flash
@@ -15,7 +12,6 @@ dashboard_blueprint = Blueprint(
     template_folder="templates",
     url_prefix="/dashboard",
 )
-all_info = {}
 
 
 @dashboard_blueprint.route("/")
@@ -23,46 +19,11 @@ all_info = {}
 def index():
     context = {}
 
-    for folder in os.listdir(
-        os.path.join(current_app.config["BASE_DIR"], "modules")
-    ):
-        if folder.startswith("__"):
-            continue
-        elif folder.startswith("box__"):
-            for sub_folder in os.listdir(
-                os.path.join(current_app.config["BASE_DIR"], "modules", folder)
-            ):
-                if sub_folder in ["dashboard"]:
-                    continue
-                if sub_folder.startswith("__"):  # ignore __pycache__
-                    continue
-                elif sub_folder.endswith(".json"):  # box_info.json
-                    continue
-                with open(
-                    os.path.join(
-                        current_app.config["BASE_DIR"],
-                        "modules",
-                        folder,
-                        sub_folder,
-                        "info.json",
-                    )
-                ) as f:
-                    module_info = json.load(f)
-                    all_info[sub_folder] = module_info
-        else:
-
-            if folder not in ["dashboard"]:
-                with open(
-                    os.path.join(
-                        current_app.config["BASE_DIR"],
-                        "modules",
-                        folder,
-                        "info.json",
-                    )
-                ) as f:
-                    module_info = json.load(f)
-                    all_info[folder] = module_info
-
-    context["all_info"] = all_info
+    manifest = current_app.extensions["module_manifest"]
+    context["all_info"] = {
+        entry["name"]: entry["info"]
+        for entry in manifest["modules"]
+        if entry["name"] != "dashboard" and entry["info"] is not None
+    }
     # flash(notify_success("Notif test"))
     return render_template("dashboard/index.html", **context)
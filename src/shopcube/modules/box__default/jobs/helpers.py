@@ -0,0 +1,269 @@
+"""
+Background jobs stored in the jobs table.
+
+A task is a function registered under a name with the task decorator.
+enqueue() stores a job for it and returns at once, the job is then run
+by the workers started with ``shopcube worker``. Tasks receive a
+JobContext as first argument, used to report progress, followed by the
+json payload given to enqueue as keyword arguments. Failed jobs are
+retried with an exponential delay until max_attempts is reached.
+"""
+import functools
+import json
+import logging
+import traceback
+from datetime import datetime
+from datetime import timedelta
+
+from flask import current_app
+
+from init import db
+
+from modules.box__default.jobs.models import JOB_DONE
+from modules.box__default.jobs.models import JOB_FAILED
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import JOB_RUNNING
+from modules.box__default.jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+# task name -> function
+_tasks = {}
+
+
+class JobContext:
+    """
+    Handed to tasks to report how far they are
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    @property
+    def attempt(self):
+        return self.job.attempts
+
+    def progress(self, done, total=None):
+        """
+        Stores the progress of the job. This commits the session, call it
+        where the task would commit anyway
+
+        Parameters
+        ----------
+        done: int
+            units of work done so far
+        total: int
+            optional, total units of work when known
+        """
+        self.job.progress = done
+        if total is not None:
+            self.job.progress_total = total
+        db.session.commit()
+
+
+def task(name, max_attempts=None):
+    """
+    Registers a function as a job task. The function gains an enqueue
+    attribute taking the payload as keyword arguments
+
+    Parameters
+    ----------
+    name: str
+        name the jobs of this task are stored under, prefixed by the
+        module name by convention e.g. category.import_products
+    max_attempts: int
+        optional, defaults to the JOBS_MAX_ATTEMPTS config
+    """
+
+    def decorator(func):
+        func.task_name = name
+        func.max_attempts = max_attempts
+        func.enqueue = functools.partial(enqueue, name)
+        _tasks[name] = func
+        return func
+
+    return decorator
+
+
+def get_task(name):
+    return _tasks.get(name)
+
+
+def new_job(name, delay=0, **payload):
+    """
+    Job of a registered task, not yet added to the session, for the
+    code adding it to a transaction under way e.g. in session events
+
+    Parameters
+    ----------
+    name: str
+        task name
+    delay: int
+        seconds before the job may run
+    payload: dict
+        json serialisable keyword arguments of the task
+
+    Returns
+    -------
+    Job
+    """
+    func = get_task(name)
+    if func is None:
+        raise LookupError(f"No task registered as {name}")
+
+    max_attempts = func.max_attempts
+    if max_attempts is None:
+        max_attempts = current_app.config.get("JOBS_MAX_ATTEMPTS", 3)
+
+    return Job(
+        name=name,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        run_after=datetime.now() + timedelta(seconds=delay),
+    )
+
+
+def enqueue(name, delay=0, **payload):
+    """
+    Stores a job for a registered task
+
+    Parameters
+    ----------
+    name: str
+        task name
+    delay: int
+        seconds before the job may run
+    payload: dict
+        json serialisable keyword arguments of the task
+
+    Returns
+    -------
+    Job
+        the stored job, already run if JOBS_RUN_INLINE is set
+    """
+    job = new_job(name, delay, **payload)
+    job.save()
+
+    if current_app.config.get("JOBS_RUN_INLINE"):
+        _start(job, "inline")
+        db.session.commit()
+        run_job(job)
+    return job
+
+
+def _start(job, worker):
+    job.status = JOB_RUNNING
+    job.worker = worker
+    job.started_at = datetime.now()
+    job.attempts = (job.attempts or 0) + 1
+
+
+def claim_next_job(worker):
+    """
+    Marks the next due job as running for a worker. The status check in
+    the update makes the claim safe between concurrent workers
+
+    Returns
+    -------
+    Job
+        the claimed job or None if no job is due
+    """
+    now = datetime.now()
+    candidates = (
+        db.session.query(Job.id)
+        .filter(Job.status == JOB_QUEUED, Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(10)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = Job.query.filter(
+            Job.id == job_id, Job.status == JOB_QUEUED
+        ).update(
+            {
+                Job.status: JOB_RUNNING,
+                Job.worker: worker,
+                Job.started_at: now,
+                Job.attempts: Job.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+    return None
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records its result, or schedules a retry if
+    it failed and attempts are left
+    """
+    func = get_task(job.name)
+    try:
+        if func is None:
+            raise LookupError(f"No task registered as {job.name}")
+        result = func(JobContext(job), **job.get_payload())
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.id, job.name)
+        db.session.rollback()
+        job = Job.query.get(job.id)
+        job.error = traceback.format_exc()
+        job.worker = None
+        if func is not None and job.attempts < job.max_attempts:
+            delay = current_app.config.get("JOBS_RETRY_DELAY", 30)
+            job.status = JOB_QUEUED
+            job.run_after = datetime.now() + timedelta(
+                seconds=delay * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = JOB_FAILED
+            job.finished_at = datetime.now()
+    else:
+        job.status = JOB_DONE
+        job.result = json.dumps(result)
+        job.error = None
+        job.finished_at = datetime.now()
+    db.session.commit()
+    return job
+
+
+def run_pending_jobs(worker="inline"):
+    """
+    Runs due jobs one after the other until none is left
+
+    Returns
+    -------
+    int
+        number of jobs run
+    """
+    count = 0
+    while True:
+        job = claim_next_job(worker)
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def requeue_stale_jobs(older_than=None):
+    """
+    Puts back in the queue running jobs whose worker died, i.e. jobs
+    started more than older_than seconds ago (JOBS_STALE_AFTER config)
+
+    Returns
+    -------
+    int
+        number of jobs requeued
+    """
+    if older_than is None:
+        older_than = current_app.config.get("JOBS_STALE_AFTER", 3600)
+    limit = datetime.now() - timedelta(seconds=older_than)
+    count = Job.query.filter(
+        Job.status == JOB_RUNNING, Job.started_at < limit
+    ).update(
+        {Job.status: JOB_QUEUED, Job.worker: None},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return count
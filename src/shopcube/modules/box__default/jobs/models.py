@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+
+from shopyo.api.models import PkModel
+
+from init import db
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job(PkModel):
+    """
+    A unit of work run out of band by the job workers. payload holds the
+    keyword arguments of the task as json
+    """
+
+    __tablename__ = "jobs"
+
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, default="{}")
+    status = db.Column(db.String(20), default=JOB_QUEUED, index=True)
+
+    progress = db.Column(db.Integer, default=0)
+    progress_total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    worker = db.Column(db.String(100), nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    run_after = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def get_payload(self):
+        return json.loads(self.payload or "{}")
+
+    def get_result(self):
+        if self.result is None:
+            return None
+        return json.loads(self.result)
+
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "progress_total": self.progress_total,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "result": self.get_result(),
+            "error": self.error,
+        }
@@ -0,0 +1,91 @@
+"""
+This file (test_jobs.py) contains the tests for the job queue
+"""
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+
+from modules.box__default.jobs.helpers import claim_next_job
+from modules.box__default.jobs.helpers import enqueue
+from modules.box__default.jobs.helpers import requeue_stale_jobs
+from modules.box__default.jobs.helpers import run_pending_jobs
+from modules.box__default.jobs.helpers import task
+from modules.box__default.jobs.models import JOB_DONE
+from modules.box__default.jobs.models import JOB_FAILED
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import JOB_RUNNING
+from modules.box__default.jobs.models import Job
+
+calls = []
+
+
+@task("tests.add")
+def add_job(ctx, a, b):
+    ctx.progress(1, 1)
+    return a + b
+
+
+@task("tests.fail", max_attempts=2)
+def fail_job(ctx):
+    calls.append(ctx.attempt)
+    raise RuntimeError("boom")
+
+
+class TestJobs:
+    def test_enqueue_stores_job_without_running_it(self):
+        job = add_job.enqueue(a=1, b=2)
+
+        assert job.status == JOB_QUEUED
+        assert job.get_payload() == {"a": 1, "b": 2}
+        assert job.max_attempts == 3
+
+    def test_enqueue_unknown_task(self):
+        with pytest.raises(LookupError):
+            enqueue("tests.unknown")
+
+    def test_run_pending_jobs(self):
+        job = add_job.enqueue(a=1, b=2)
+
+        assert run_pending_jobs() == 1
+
+        job = Job.query.get(job.id)
+        assert job.status == JOB_DONE
+        assert job.get_result() == 3
+        assert job.progress == 1
+        assert job.progress_total == 1
+        assert job.attempts == 1
+        assert job.finished_at is not None
+
+    def test_delayed_job_is_not_claimed(self):
+        add_job.enqueue(delay=60, a=1, b=2)
+
+        assert claim_next_job("test") is None
+
+    def test_failed_job_is_retried_then_failed(self, db_session, monkeypatch):
+        # the test session lives in a transaction a rollback would end
+        monkeypatch.setattr(db_session, "rollback", lambda: None)
+        calls.clear()
+        job = fail_job.enqueue()
+
+        run_pending_jobs()
+        job = Job.query.get(job.id)
+        assert job.status == JOB_QUEUED
+        assert job.run_after > datetime.now()
+        assert "boom" in job.error
+
+        job.run_after = datetime.now()
+        job.save()
+        run_pending_jobs()
+        job = Job.query.get(job.id)
+        assert job.status == JOB_FAILED
+        assert calls == [1, 2]
+
+    def test_requeue_stale_jobs(self):
+        job = add_job.enqueue(a=1, b=2)
+        job.status = JOB_RUNNING
+        job.started_at = datetime.now() - timedelta(hours=2)
+        job.save()
+
+        assert requeue_stale_jobs(older_than=3600) == 1
+        assert Job.query.get(job.id).status == JOB_QUEUED
@@ -0,0 +1,43 @@
+import json
+import os
+
+from flask import Blueprint
+from flask import jsonify
+from flask import render_template
+
+from flask_login import login_required
+
+from modules.box__default.jobs.models import Job
+
+dirpath = os.path.dirname(os.path.abspath(__file__))
+module_info = {}
+
+with open(dirpath + "/info.json") as f:
+    module_info = json.load(f)
+
+jobs_blueprint = Blueprint(
+    "jobs",
+    __name__,
+    template_folder="templates",
+    url_prefix=module_info["url_prefix"],
+)
+
+DASHBOARD_JOBS = 50
+
+
+@jobs_blueprint.route("/dashboard")
+@login_required
+def dashboard():
+    context = {}
+
+    context["jobs"] = (
+        Job.query.order_by(Job.id.desc()).limit(DASHBOARD_JOBS).all()
+    )
+    return render_template("jobs/dashboard.html", **context)
+
+
+@jobs_blueprint.route("/<int:job_id>")
+@login_required
+def status(job_id):
+    job = Job.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
@@ -0,0 +1,108 @@
+"""
+Job worker pool, started with
+
+    shopcube worker [--concurrency N] [--poll-interval SECONDS] [--burst]
+
+Every worker thread claims due jobs from the jobs table and runs them
+inside its own application context.
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+
+from init import db
+from utils.metrics import registry
+
+from modules.box__default.jobs.helpers import claim_next_job
+from modules.box__default.jobs.helpers import requeue_stale_jobs
+from modules.box__default.jobs.helpers import run_job
+
+logger = logging.getLogger(__name__)
+
+
+def _work(app, name, stop, poll_interval, burst):
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                job = claim_next_job(name)
+                if job is not None:
+                    run_job(job)
+                    # the web process answering /metrics reads the counts
+                    registry.flush()
+                    continue
+            except Exception:
+                logger.exception("Worker %s could not run a job", name)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+            if burst:
+                return
+            stop.wait(poll_interval)
+
+
+def run_worker(app, concurrency=2, poll_interval=1.0, burst=False):
+    """
+    Runs jobs with a pool of threads until interrupted
+
+    Parameters
+    ----------
+    app: Flask
+        application the jobs run in
+    concurrency: int
+        number of worker threads
+    poll_interval: float
+        seconds an idle thread waits before looking for jobs again
+    burst: bool
+        stop once no job is due instead of waiting for new ones
+    """
+    with app.app_context():
+        requeued = requeue_stale_jobs()
+        if requeued:
+            logger.info("Requeued %s stale jobs", requeued)
+
+    stop = threading.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(
+            target=_work,
+            args=(app, f"{prefix}:{i}", stop, poll_interval, burst),
+            daemon=True,
+        )
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        print("stopping workers, waiting for running jobs")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    registry.flush(force=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="shopcube worker")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--burst", action="store_true", help="exit when the queue is empty"
+    )
+    args = parser.parse_args(argv)
+
+    from app import app
+
+    print(f"starting {args.concurrency} job workers")
+    run_worker(
+        app,
+        concurrency=args.concurrency,
+        poll_interval=args.poll_interval,
+        burst=args.burst,
+    )
@@ -0,0 +1,106 @@
+"""
+This file (test_metrics.py) contains the functional tests for the
+`metrics` blueprint.
+"""
+from utils.metrics import registry
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Product
+
+
+def scrape(test_client, **kwargs):
+    response = test_client.get("/metrics", **kwargs)
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    return response.get_data(as_text=True).splitlines()
+
+
+def sample(lines, prefix):
+    for line in lines:
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_exports_requests(test_client):
+    before = scrape(test_client)
+    test_client.get("/shop/search?q=x")
+    lines = scrape(test_client)
+
+    endpoint = '{endpoint="shop.search",method="GET",status="200"}'
+    assert sample(lines, "shopcube_http_requests_total" + endpoint) == (
+        sample(before, "shopcube_http_requests_total" + endpoint) + 1
+    )
+    assert "# TYPE shopcube_http_request_duration_seconds histogram" in lines
+    assert any(
+        line.startswith(
+            'shopcube_http_request_duration_seconds_bucket{endpoint="shop.'
+        )
+        for line in lines
+    )
+    # the scrape itself is in flight
+    assert sample(lines, "shopcube_http_requests_in_flight") == 1
+    assert sample(lines, "shopcube_db_pool_checkouts_total") > 0
+    assert "# TYPE shopcube_jobs_pending gauge" in lines
+
+
+def test_metrics_business_counters(test_client):
+    before = sample(scrape(test_client), "shopcube_orders_placed_total")
+    registry.inc("shopcube_orders_placed_total")
+    test_client.get("/shop/")
+
+    lines = scrape(test_client)
+
+    assert sample(lines, "shopcube_orders_placed_total") == before + 1
+    assert "# TYPE shopcube_carts_created_total counter" in lines
+    assert "# TYPE shopcube_import_rows_total counter" in lines
+    assert any(
+        line.startswith('shopcube_cache_requests_total{cache="settings"')
+        for line in lines
+    )
+
+
+def test_carts_created_counted_once(flask_app, db_session):
+    subcategory = SubCategory(name="metrics boots")
+    subcategory.products.append(
+        Product(barcode="metrics-1", name="Boot", price=10, in_stock=5)
+    )
+    category = Category(name="metrics")
+    category.subcategories.append(subcategory)
+    category.save()
+    item = {"barcode": "metrics-1", "quantity": 1, "size": "", "color": ""}
+    client = flask_app.test_client()
+    before = sample(scrape(client), "shopcube_carts_created_total")
+
+    client.post("/shop/cart/add/metrics-1", data=item)
+    client.post("/shop/cart/add/metrics-1", data=item)
+    client.post(
+        "/shop/cart/update",
+        data={
+            "barcode_1": "metrics-1",
+            "quantity_1": 2,
+            "size_1": "",
+            "color_1": "",
+        },
+    )
+
+    after = sample(scrape(client), "shopcube_carts_created_total")
+    assert after == before + 1
+
+
+def test_metrics_local_only_without_token(test_client):
+    remote = {"REMOTE_ADDR": "203.0.113.7"}
+
+    assert test_client.get("/metrics", environ_base=remote).status_code == 401
+
+
+def test_metrics_token(test_client, flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, "METRICS_TOKEN", "secret")
+
+    assert test_client.get("/metrics").status_code == 401
+    scrape(
+        test_client,
+        headers={"Authorization": "Bearer secret"},
+        environ_base={"REMOTE_ADDR": "203.0.113.7"},
+    )
@@ -0,0 +1,215 @@
+"""
+/metrics endpoint in the Prometheus text format, see utils/metrics.py
+
+Besides the business counters incremented by the other modules, it
+exports per endpoint request counts and latency histograms, requests in
+flight, database pool checkouts, the hit ratios of the settings and
+template globals caches, the mail queue and the pending jobs.
+
+When METRICS_TOKEN is set the endpoint requires it as a bearer token,
+otherwise it only answers requests from the host itself.
+"""
+import hmac
+import json
+import os
+import time
+
+from flask import Blueprint
+from flask import Response
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from flask import request
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from utils.metrics import registry
+
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import Job
+
+dirpath = os.path.dirname(os.path.abspath(__file__))
+module_info = {}
+
+with open(dirpath + "/info.json") as f:
+    module_info = json.load(f)
+
+metrics_blueprint = Blueprint(
+    "metrics",
+    __name__,
+    url_prefix=module_info["url_prefix"],
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+registry.counter(
+    "shopcube_http_requests_total",
+    "Requests answered",
+    ("endpoint", "method", "status"),
+)
+registry.histogram(
+    "shopcube_http_request_duration_seconds",
+    "Time to answer a request",
+    ("endpoint",),
+)
+registry.gauge("shopcube_http_requests_in_flight", "Requests being answered")
+registry.counter(
+    "shopcube_db_pool_connections_total", "Database connections opened"
+)
+registry.counter(
+    "shopcube_db_pool_checkouts_total",
+    "Database connections taken from the pool",
+)
+registry.gauge("shopcube_db_pool_checked_out", "Database connections in use")
+registry.counter(
+    "shopcube_sessions_total",
+    "Server-side session saves by outcome",
+    ("outcome",),
+)
+registry.gauge("shopcube_mail_queue_depth", "Emails waiting to be sent")
+registry.counter(
+    "shopcube_mails_total", "Emails handled by result", ("result",)
+)
+
+_pool_hooks_installed = False
+
+
+def _on_connect(dbapi_connection, connection_record):
+    registry.inc("shopcube_db_pool_connections_total")
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    registry.inc("shopcube_db_pool_checkouts_total")
+    registry.inc("shopcube_db_pool_checked_out")
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    registry.dec("shopcube_db_pool_checked_out")
+
+
+def install_pool_hooks():
+    global _pool_hooks_installed
+    if _pool_hooks_installed:
+        return
+    event.listen(Pool, "connect", _on_connect)
+    event.listen(Pool, "checkout", _on_checkout)
+    event.listen(Pool, "checkin", _on_checkin)
+    _pool_hooks_installed = True
+
+
+def collect_app_stats(app):
+    """
+    Collector copying the counters kept by the template globals, the
+    session interface and the mail dispatcher of an app
+    """
+
+    def collect(registry):
+        template_globals = app.extensions.get("template_globals")
+        if template_globals is not None:
+            stats = template_globals.stats().values()
+            hits = sum(s["request_hits"] + s["ttl_hits"] for s in stats)
+            misses = sum(s["misses"] for s in stats)
+            registry.set(
+                "shopcube_cache_requests_total",
+                hits,
+                cache="template_globals",
+                result="hit",
+            )
+            registry.set(
+                "shopcube_cache_requests_total",
+                misses,
+                cache="template_globals",
+                result="miss",
+            )
+
+        session_stats = getattr(app.session_interface, "stats", None)
+        if session_stats is not None:
+            for outcome in ("writes", "touches", "skipped"):
+                registry.set(
+                    "shopcube_sessions_total",
+                    session_stats[outcome],
+                    outcome=outcome,
+                )
+
+        dispatcher = app.extensions.get("mail_dispatcher")
+        if dispatcher is not None:
+            stats = dispatcher.stats()
+            registry.set("shopcube_mail_queue_depth", stats["queue_depth"])
+            for result in ("sent", "failed", "rejected"):
+                registry.set(
+                    "shopcube_mails_total", stats[result], result=result
+                )
+
+    return collect
+
+
+@metrics_blueprint.record_once
+def setup(state):
+    app = state.app
+    registry.configure(
+        app.config.get("METRICS_DIR"),
+        flush_interval=app.config.get("METRICS_FLUSH_INTERVAL", 1.0),
+    )
+    registry.add_collector("app", collect_app_stats(app))
+    install_pool_hooks()
+
+
+@metrics_blueprint.before_app_request
+def start_timer():
+    g._metrics_started = time.perf_counter()
+    registry.inc("shopcube_http_requests_in_flight")
+
+
+@metrics_blueprint.after_app_request
+def record_request(response):
+    started = g.get("_metrics_started")
+    if started is not None:
+        endpoint = request.endpoint or "<unmatched>"
+        registry.observe(
+            "shopcube_http_request_duration_seconds",
+            time.perf_counter() - started,
+            endpoint=endpoint,
+        )
+        registry.inc(
+            "shopcube_http_requests_total",
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+
+@metrics_blueprint.teardown_app_request
+def end_request(exc):
+    if not has_app_context():
+        return
+    if g.pop("_metrics_started", None) is not None:
+        registry.dec("shopcube_http_requests_in_flight")
+    registry.flush()
+
+
+def _authorized():
+    token = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        return request.remote_addr in LOCAL_ADDRESSES
+    given = request.headers.get("Authorization", "")
+    return hmac.compare_digest(given, f"Bearer {token}")
+
+
+@metrics_blueprint.route("")
+def metrics():
+    if not _authorized():
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+
+    # read from the database on every scrape, not counted per process
+    pending = Job.query.filter(Job.status == JOB_QUEUED).count()
+    body = registry.render() + "\n".join(
+        [
+            "# HELP shopcube_jobs_pending Jobs waiting to run",
+            "# TYPE shopcube_jobs_pending gauge",
+            f"shopcube_jobs_pending {pending}",
+        ]
+    )
+    return Response(body + "\n", content_type=CONTENT_TYPE)
@@ -1,4 +1,97 @@
+import threading
+import time
+
+from flask import current_app
+
+from init import db
+from utils.metrics import registry
+from utils.page_cache import SITE_TAG
+from utils.page_cache import purge_tags
+from utils.template_globals import invalidate_template_globals
+
 from modules.box__default.settings.models import Settings
+from modules.box__default.settings.models import SettingsVersion
+
+# process wide copy of the settings table, revalidated against
+# SettingsVersion at most every SETTINGS_CACHE_TTL seconds
+_cache = {
+    "values": None,
+    "version": None,
+    "updated_at": None,
+    "checked_at": 0.0,
+}
+_lock = threading.Lock()
+
+
+def _get_version():
+    row = SettingsVersion.query.get(1)
+    if row is None:
+        return 0
+    return row.version
+
+
+def _load_settings():
+    row = SettingsVersion.query.get(1)
+    values = {s.setting: s.value for s in Settings.query.all()}
+    _cache.update(
+        {
+            "values": values,
+            "version": 0 if row is None else row.version,
+            "updated_at": None if row is None else row.updated_at,
+            "checked_at": time.monotonic(),
+        }
+    )
+    return values
+
+
+def get_settings():
+    """
+    All settings as a dict, served from the in-memory cache
+
+    Returns
+    -------
+    dict
+        setting name -> value
+    """
+    ttl = current_app.config.get("SETTINGS_CACHE_TTL", 5)
+    with _lock:
+        values = _cache["values"]
+        if (
+            values is not None
+            and time.monotonic() - _cache["checked_at"] >= ttl
+        ):
+            if _get_version() != _cache["version"]:
+                values = None
+            else:
+                _cache["checked_at"] = time.monotonic()
+
+        if values is None:
+            registry.inc(
+                "shopcube_cache_requests_total",
+                cache="settings",
+                result="miss",
+            )
+            return _load_settings()
+
+        registry.inc(
+            "shopcube_cache_requests_total", cache="settings", result="hit"
+        )
+        return values
+
+
+def get_settings_version():
+    """
+    Version and update time of the settings served by get_settings
+
+    Returns
+    -------
+    tuple
+        (version, updated_at), updated_at being None until the settings
+        are first written
+    """
+    get_settings()
+    with _lock:
+        return _cache["version"], _cache["updated_at"]
 
 
 def get_setting(name):
@@ -15,5 +108,46 @@ def get_setting(name):
     str
         value of key
     """
-    s = Settings.query.get(name)
-    return s.value
+    values = get_settings()
+    if name not in values:
+        # may have been added since the cache was loaded, reloaded only
+        # if the version moved so that unknown keys cost one query
+        with _lock:
+            if _get_version() != _cache["version"]:
+                _cache["values"] = None
+        values = get_settings()
+    return values[name]
+
+
+def invalidate_settings_cache():
+    """
+    Drops the settings cache of the current process only
+    """
+    with _lock:
+        _cache.update(
+            {
+                "values": None,
+                "version": None,
+                "updated_at": None,
+                "checked_at": 0.0,
+            }
+        )
+
+
+def bump_settings_version():
+    """
+    To call after writing to the Settings table. Increments the shared
+    version counter so that every worker process reloads its cache, then
+    drops the cache of the current process, template globals derived
+    from the settings included, and the cached pages
+    """
+    updated = SettingsVersion.query.filter(SettingsVersion.id == 1).update(
+        {SettingsVersion.version: SettingsVersion.version + 1},
+        synchronize_session=False,
+    )
+    if not updated:
+        db.session.add(SettingsVersion(id=1, version=1))
+    db.session.commit()
+    invalidate_settings_cache()
+    invalidate_template_globals(current_app)
+    purge_tags(SITE_TAG)
@@ -1,3 +1,5 @@
+import datetime
+
 from init import db
 
 
@@ -19,3 +21,20 @@ class Settings(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+
+
+class SettingsVersion(db.Model):
+    """
+    Single row counter bumped on every settings write so that the
+    settings cache of every worker process knows when to reload
+    """
+
+    __tablename__ = "settings_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # UTC, for the Last-Modified of the pages showing settings
+    updated_at = db.Column(
+        db.DateTime,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+    )
@@ -14,7 +14,12 @@ from flask import url_for
 
 import pytest
 
+from modules.box__default.settings import helpers
+from modules.box__default.settings.helpers import bump_settings_version
+from modules.box__default.settings.helpers import get_setting
+from modules.box__default.settings.helpers import invalidate_settings_cache
 from modules.box__default.settings.models import Settings
+from modules.box__default.settings.models import SettingsVersion
 
 dirpath = os.path.dirname(os.path.abspath(__file__))
 module_path = os.path.dirname(dirpath)
@@ -100,3 +105,65 @@ class TestSettingsAPI:
         assert response.status_code == 200
         assert setting is not None
         assert setting.value == "TEST-APP-NAME"
+
+
+class TestSettingsCache:
+    @pytest.fixture(autouse=True)
+    def long_ttl(self, flask_app):
+        flask_app.config["SETTINGS_CACHE_TTL"] = 60
+        invalidate_settings_cache()
+        yield
+        flask_app.config["SETTINGS_CACHE_TTL"] = 0
+        invalidate_settings_cache()
+
+    def test_get_setting_served_from_cache(self, db_session):
+        original = get_setting("APP_NAME")
+        setting = Settings.query.get("APP_NAME")
+        setting.value = "CHANGED-WITHOUT-BUMP"
+        db_session.commit()
+
+        assert get_setting("APP_NAME") == original
+
+    def test_bump_settings_version_reloads(self, db_session):
+        get_setting("APP_NAME")
+        setting = Settings.query.get("APP_NAME")
+        setting.value = "CHANGED-WITH-BUMP"
+        db_session.commit()
+        bump_settings_version()
+
+        assert get_setting("APP_NAME") == "CHANGED-WITH-BUMP"
+
+    def test_other_worker_bump_is_picked_up(self, flask_app, db_session):
+        get_setting("APP_NAME")
+        setting = Settings.query.get("APP_NAME")
+        setting.value = "CHANGED-BY-OTHER-WORKER"
+        db_session.commit()
+        # simulate another process bumping the counter
+        db_session.add(SettingsVersion(id=1, version=99))
+        db_session.commit()
+        flask_app.config["SETTINGS_CACHE_TTL"] = 0
+
+        assert get_setting("APP_NAME") == "CHANGED-BY-OTHER-WORKER"
+
+    def test_unknown_key_reloads_only_on_new_version(
+        self, monkeypatch, db_session
+    ):
+        get_setting("APP_NAME")
+        loads = []
+        load_settings = helpers._load_settings
+        monkeypatch.setattr(
+            helpers,
+            "_load_settings",
+            lambda: loads.append(1) or load_settings(),
+        )
+
+        for _ in range(3):
+            with pytest.raises(KeyError):
+                get_setting("NOT_A_SETTING")
+        assert loads == []
+
+        db_session.add(Settings(setting="NOT_A_SETTING", value="added"))
+        db_session.commit()
+        bump_settings_version()
+        assert get_setting("NOT_A_SETTING") == "added"
+        assert loads == [1]
@@ -3,6 +3,7 @@ import json
 from app import app
 from init import db
 
+from modules.box__default.settings.helpers import bump_settings_version
 from modules.box__default.settings.models import Settings
 
 
@@ -16,6 +17,7 @@ def add_setting(name, value):
             s = Settings(setting=name, value=value)
             db.session.add(s)
             db.session.commit()
+        bump_settings_version()
 
 
 def upload():
@@ -9,6 +9,7 @@ from flask_login import login_required
 
 from init import db
 
+from modules.box__default.settings.helpers import bump_settings_version
 from modules.box__default.settings.models import Settings
 
 dirpath = os.path.dirname(os.path.abspath(__file__))
@@ -59,6 +60,7 @@ def settings_update():
     s = Settings.query.get(settings_name)
     s.value = settings_value
     db.session.commit()
+    bump_settings_version()
     settings = Settings.query.all()
 
     context["settings"] = settings
@@ -1,29 +1,28 @@
-import json
-import os
-
 from flask import url_for
 
-from init import themes_path
-
 from modules.box__default.settings.helpers import get_setting
+from modules.box__default.theme.helpers import get_styles_version
+from modules.box__default.theme.helpers import resolve_theme
+
+
+def get_front_theme():
+    """
+    The active front theme, the default one if the theme set is not
+    installed
+    """
+    return resolve_theme("front", get_setting("ACTIVE_FRONT_THEME"))
 
 
 def get_front_theme_dir():
-    theme_dir = os.path.join(
-        themes_path, "front", get_setting("ACTIVE_FRONT_THEME")
-    )
-    return theme_dir
+    return get_front_theme()["dir"]
 
 
 def get_front_theme_info_data():
-    info_path = os.path.join(get_front_theme_dir(), "info.json")
-    with open(info_path) as f:
-        info_data = json.load(f)
-    return info_data
+    return get_front_theme()["info"]
 
 
 def get_active_front_theme():
-    return get_setting("ACTIVE_FRONT_THEME")
+    return get_front_theme()["name"]
 
 
 def get_active_front_theme_version():
@@ -31,29 +30,32 @@ def get_active_front_theme_version():
 
 
 def get_active_front_theme_styles_url():
+    theme = get_front_theme()
     return url_for(
         "resource.active_front_theme_css",
-        active_theme=get_active_front_theme(),
-        v=get_active_front_theme_version(),
+        active_theme=theme["name"],
+        v=get_styles_version(theme),
     )
 
 
+def get_back_theme():
+    """
+    The active back theme, the default one if the theme set is not
+    installed
+    """
+    return resolve_theme("back", get_setting("ACTIVE_BACK_THEME"))
+
+
 def get_back_theme_dir():
-    theme_dir = os.path.join(
-        themes_path, "back", get_setting("ACTIVE_BACK_THEME")
-    )
-    return theme_dir
+    return get_back_theme()["dir"]
 
 
 def get_back_theme_info_data():
-    info_path = os.path.join(get_back_theme_dir(), "info.json")
-    with open(info_path) as f:
-        info_data = json.load(f)
-    return info_data
+    return get_back_theme()["info"]
 
 
 def get_active_back_theme():
-    return get_setting("ACTIVE_BACK_THEME")
+    return get_back_theme()["name"]
 
 
 def get_active_back_theme_version():
@@ -61,19 +63,14 @@ def get_active_back_theme_version():
 
 
 def get_active_back_theme_styles_url():
+    theme = get_back_theme()
     return url_for(
         "resource.active_back_theme_css",
-        active_theme=get_active_back_theme(),
-        v=get_active_back_theme_version(),
+        active_theme=theme["name"],
+        v=get_styles_version(theme),
     )
 
 
-print(
-    "theme global @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@",
-    file=open("file.log", "a"),
-    flush=True,
-)
-
 available_everywhere = {
     "get_active_front_theme": get_active_front_theme,
     "get_active_front_theme_version": get_active_front_theme_version,
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+
+from shopyo.api.file import get_folders
+
+from init import themes_path
+
+THEME_KINDS = ("front", "back")
+# themes shipped with shopcube, used when the active one is not installed
+DEFAULT_THEMES = {"front": "ecommerceus", "back": "boogle"}
+
+# info.json and styles.css hash of every installed theme, reloaded when
+# one of those files changes. Changes are looked for at most every
+# THEME_CACHE_TTL seconds
+_registry = {"themes": None, "stamp": None, "checked_at": 0.0}
+_lock = threading.Lock()
+
+
+def _theme_files():
+    for kind in THEME_KINDS:
+        kind_path = os.path.join(themes_path, kind)
+        for folder in sorted(get_folders(kind_path)):
+            yield kind, folder, os.path.join(kind_path, folder)
+
+
+def _scan_stamp():
+    """
+    Modification times of all theme info.json and styles.css files,
+    compared between checks to know if the registry must be reloaded
+    """
+    stamp = []
+    for kind, folder, theme_dir in _theme_files():
+        for filename in ("info.json", "styles.css"):
+            path = os.path.join(theme_dir, filename)
+            try:
+                stamp.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                stamp.append((path, None))
+    return tuple(stamp)
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _load_themes():
+    themes = {kind: {} for kind in THEME_KINDS}
+    for kind, folder, theme_dir in _theme_files():
+        info_path = os.path.join(theme_dir, "info.json")
+        styles_path = os.path.join(theme_dir, "styles.css")
+        try:
+            with open(info_path) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        styles_hash = None
+        if os.path.exists(styles_path):
+            styles_hash = _file_hash(styles_path)
+
+        themes[kind][folder] = {
+            "name": folder,
+            "dir": theme_dir,
+            "info": info,
+            "styles_hash": styles_hash,
+        }
+    return themes
+
+
+def get_themes(kind):
+    """
+    Installed themes of a kind
+
+    Parameters
+    ----------
+    kind: str
+        "front" or "back"
+
+    Returns
+    -------
+    dict
+        theme folder name -> {"name", "dir", "info", "styles_hash"}
+    """
+    ttl = current_app.config.get("THEME_CACHE_TTL", 10)
+    with _lock:
+        now = time.monotonic()
+        if _registry["themes"] is None or now - _registry["checked_at"] >= ttl:
+            stamp = _scan_stamp()
+            if stamp != _registry["stamp"]:
+                _registry.update({"themes": _load_themes(), "stamp": stamp})
+            _registry["checked_at"] = now
+        return _registry["themes"][kind]
+
+
+def get_theme(kind, name):
+    """
+    Registry entry of one theme, None if it is not installed
+    """
+    return get_themes(kind).get(name)
+
+
+def resolve_theme(kind, name):
+    """
+    Registry entry of the theme to use when name is set as active: the
+    theme itself, or the default theme of its kind if it is not
+    installed
+
+    Raises
+    ------
+    LookupError
+        if the default theme is not installed either
+    """
+    theme = get_theme(kind, name)
+    if theme is None:
+        theme = get_theme(kind, DEFAULT_THEMES[kind])
+    if theme is None:
+        raise LookupError(
+            f"{kind} theme {name} is not installed, nor is the default "
+            f"{DEFAULT_THEMES[kind]}"
+        )
+    return theme
+
+
+def get_styles_version(theme):
+    """
+    Value of the v query argument of a theme stylesheet url: the content
+    hash of styles.css, or the theme version if it has no stylesheet
+    """
+    if theme["styles_hash"] is not None:
+        return theme["styles_hash"]
+    return theme["info"].get("version")
+
+
+def clear_theme_registry():
+    with _lock:
+        _registry.update({"themes": None, "stamp": None, "checked_at": 0.0})
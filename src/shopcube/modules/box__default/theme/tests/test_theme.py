@@ -0,0 +1,80 @@
+"""
+This file (test_theme.py) contains the tests for the theme registry
+and the theme stylesheets served by the `resource` blueprint.
+"""
+import pytest
+
+from utils.enhance import set_setting
+
+from modules.box__default.settings.helpers import get_setting
+from modules.box__default.theme.helpers import DEFAULT_THEMES
+from modules.box__default.theme.helpers import get_theme
+from modules.box__default.theme.helpers import resolve_theme
+
+
+def test_styles_url_carries_content_hash(test_client):
+    response = test_client.get("/shop/")
+    theme = get_theme("front", "ecommerceus")
+
+    assert len(theme["styles_hash"]) == 16
+    assert (
+        f"/resource/theme/front/ecommerceus/styles.css?v={theme['styles_hash']}"
+    ).encode() in response.data
+
+
+def test_styles_immutable_when_hash_matches(test_client):
+    theme = get_theme("front", "ecommerceus")
+    response = test_client.get(
+        "/resource/theme/front/ecommerceus/styles.css"
+        f"?v={theme['styles_hash']}"
+    )
+
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 60 * 60 * 24 * 365
+    assert response.get_etag()[0] == theme["styles_hash"]
+
+
+def test_styles_revalidated_when_hash_is_stale(test_client):
+    response = test_client.get(
+        "/resource/theme/front/ecommerceus/styles.css?v=1.0"
+    )
+
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == 0
+
+
+def test_styles_not_modified(test_client):
+    theme = get_theme("front", "ecommerceus")
+    response = test_client.get(
+        "/resource/theme/front/ecommerceus/styles.css",
+        headers={"If-None-Match": f'"{theme["styles_hash"]}"'},
+    )
+
+    assert response.status_code == 304
+
+
+def test_resolve_theme_falls_back_to_the_default():
+    assert resolve_theme("front", "ecommerceus")["name"] == "ecommerceus"
+    assert resolve_theme("front", "not-installed")["name"] == "ecommerceus"
+    assert resolve_theme("back", "not-installed")["name"] == "boogle"
+
+
+def test_pages_render_with_a_missing_theme(test_client, db_session):
+    theme = get_setting("ACTIVE_FRONT_THEME")
+    set_setting("ACTIVE_FRONT_THEME", "not-installed")
+    try:
+        response = test_client.get("/shop/")
+    finally:
+        set_setting("ACTIVE_FRONT_THEME", theme)
+
+    assert response.status_code == 200
+    assert b"/resource/theme/front/ecommerceus/styles.css" in response.data
+
+
+def test_resolve_theme_without_default(monkeypatch):
+    monkeypatch.setitem(DEFAULT_THEMES, "front", "gone")
+
+    with pytest.raises(LookupError):
+        resolve_theme("front", "not-installed")
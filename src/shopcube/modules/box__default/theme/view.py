@@ -2,17 +2,18 @@ import json
 import os
 
 from flask import Blueprint
-from flask import current_app
+from flask import abort
 from flask import redirect
 from flask import render_template
 from flask import url_for
 
 from flask_login import login_required
-from shopyo.api.file import get_folders
 
 from utils.enhance import set_setting
 
 from modules.box__default.settings.helpers import get_setting
+from modules.box__default.theme.helpers import get_theme
+from modules.box__default.theme.helpers import get_themes
 
 # from flask import flash
 # from flask import request
@@ -48,27 +49,12 @@ def index():
 
     context = {}
 
-    front_themes_path = os.path.join(
-        current_app.config["BASE_DIR"], "static", "themes", "front"
-    )
-    all_front_info = {}
-    front_theme_folders = get_folders(front_themes_path)
-    for folder in front_theme_folders:
-        theme_path = os.path.join(front_themes_path, folder)
-        info_path = os.path.join(theme_path, "info.json")
-        with open(info_path) as f:
-            all_front_info[folder] = json.load(f)
-
-    back_themes_path = os.path.join(
-        current_app.config["BASE_DIR"], "static", "themes", "back"
-    )
-    all_back_info = {}
-    back_theme_folders = get_folders(back_themes_path)
-    for folder in back_theme_folders:
-        theme_path = os.path.join(back_themes_path, folder)
-        info_path = os.path.join(theme_path, "info.json")
-        with open(info_path) as f:
-            all_back_info[folder] = json.load(f)
+    all_front_info = {
+        name: theme["info"] for name, theme in get_themes("front").items()
+    }
+    all_back_info = {
+        name: theme["info"] for name, theme in get_themes("back").items()
+    }
 
     active_front_theme = get_setting("ACTIVE_FRONT_THEME")
     active_back_theme = get_setting("ACTIVE_BACK_THEME")
@@ -91,6 +77,8 @@ def index():
 @module_blueprint.route("/activate/front/<theme_name>")
 @login_required
 def activate_front_theme(theme_name):
+    if get_theme("front", theme_name) is None:
+        abort(404)
     set_setting("ACTIVE_FRONT_THEME", theme_name)
 
     # with app.app_context():
@@ -103,6 +91,8 @@ def activate_front_theme(theme_name):
 @module_blueprint.route("/activate/back/<theme_name>")
 @login_required
 def activate_back_theme(theme_name):
+    if get_theme("back", theme_name) is None:
+        abort(404)
     set_setting("ACTIVE_BACK_THEME", theme_name)
 
     # with app.app_context():
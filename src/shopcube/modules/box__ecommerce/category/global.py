@@ -1,8 +1,18 @@
+from modules.box__ecommerce.category.helpers import get_product_count
 from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.tree import get_category_tree
 
 
 def get_categories():
-    return Category.query.all()
+    """
+    Categories of the category tree snapshot, see category/tree.py
+    """
+    return get_category_tree().categories
 
 
-available_everywhere = {"get_categories": get_categories, "Category": Category}
+available_everywhere = {
+    "get_categories": get_categories,
+    "get_category_tree": get_category_tree,
+    "get_product_count": get_product_count,
+    "Category": Category,
+}
@@ -0,0 +1,25 @@
+from utils.page_cache import tag_page
+
+from modules.box__ecommerce.category.tree import get_category_tree
+from modules.box__ecommerce.shop.page_tags import PRODUCTS_TAG
+
+
+def get_product_counts():
+    """
+    Number of products of every category, from the category tree
+    snapshot, see category/tree.py
+
+    Returns
+    -------
+    dict
+        category id -> number of products
+    """
+    return get_category_tree().product_counts()
+
+
+def get_product_count(category):
+    tag_page(PRODUCTS_TAG)
+    node = get_category_tree().get(category.id)
+    if node is None:
+        return 0
+    return node.product_count
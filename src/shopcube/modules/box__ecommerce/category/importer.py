@@ -0,0 +1,398 @@
+"""
+Bulk product import from spreadsheets.
+
+Rows are streamed from the workbook and processed in chunks. Categories
+and subcategories are preloaded once, existing products of a chunk are
+found with a single IN query and products, sizes and colors are written
+with bulk insert/update mappings, committing once per chunk. Where the
+database has the unique barcode index, products are written with a
+single upsert on the barcode instead, so that concurrent imports of the
+same products cannot insert duplicates. Bulk
+mappings bypass the session events, so the products of a chunk are
+marked for the search index, their subcategories touched, the category
+tree version bumped and their cached pages purged before it is
+committed.
+
+Expected columns, after a header row:
+barcode, name, description, colors, sizes, price, selling price,
+in stock, discontinued, category, subcategory
+"""
+import math
+import os
+import re
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+
+from init import db
+from utils.conditional import touch_rows
+from utils.indexes import missing_indexes
+from utils.metrics import registry
+from utils.page_cache import purge_on_commit
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.category.tree import invalidate_on_commit
+from modules.box__ecommerce.product.models import Color
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
+from modules.box__ecommerce.product.search import mark_dirty
+from modules.box__ecommerce.shop.page_tags import PRODUCTS_TAG
+from modules.box__ecommerce.shop.page_tags import product_tag
+from modules.box__ecommerce.shop.page_tags import subcategory_tag
+
+CHUNK_SIZE = 1000
+PRODUCT_COLUMNS = (
+    "barcode",
+    "name",
+    "description",
+    "price",
+    "selling_price",
+    "in_stock",
+    "discontinued",
+    "subcategory_id",
+)
+NUM_COLUMNS = 11
+STREAMABLE_EXTENSIONS = (".xlsx", ".xlsm")
+
+registry.counter(
+    "shopcube_import_rows_total",
+    "Spreadsheet rows processed by the product importer",
+)
+
+
+def isdiscontinued(cell_value):
+    cell_value = cell_str(cell_value).lower()
+    return cell_value in ("yes", "1", "true")
+
+
+def cell_str(value):
+    """
+    Text of a spreadsheet cell, empty cells giving an empty string
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value.is_integer():
+            return str(int(value))
+    return str(value).strip()
+
+
+def split_variants(value):
+    """
+    Sizes and colors are given one per line or comma separated
+    """
+    return [
+        v.strip() for v in re.split(r"[\n,]", cell_str(value)) if v.strip()
+    ]
+
+
+def _to_number(value, convert):
+    value = cell_str(value)
+    if not value:
+        return 0
+    return convert(float(value))
+
+
+def read_rows(file_path):
+    """
+    Yields the data rows of the first sheet of a workbook as tuples.
+    xlsx and xlsm files are streamed with openpyxl, other formats are
+    read through pandas
+    """
+    if os.path.splitext(file_path)[1].lower() in STREAMABLE_EXTENSIONS:
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(
+            file_path, read_only=True, data_only=True
+        )
+        try:
+            sheet = workbook.worksheets[0]
+            for row in sheet.iter_rows(min_row=2, values_only=True):
+                yield row
+        finally:
+            workbook.close()
+    else:
+        import pandas as pd
+
+        frame = pd.read_excel(file_path, sheet_name=0)
+        for row in frame.itertuples(index=False, name=None):
+            yield row
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def upsert_statement(dialect_name):
+    """
+    Insert of product rows updating the products whose barcode exists,
+    None for databases without upserts
+    """
+    table = Product.__table__
+    if dialect_name in ("sqlite", "postgresql"):
+        dialect = sqlite if dialect_name == "sqlite" else postgresql
+        statement = dialect.insert(table)
+        # onupdate defaults do not apply to upserts
+        set_ = {
+            column: statement.excluded[column]
+            for column in PRODUCT_COLUMNS[1:] + ("updated_at",)
+        }
+        set_["version"] = table.c.version + 1
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.barcode], set_=set_
+        )
+    if dialect_name in ("mysql", "mariadb"):
+        statement = mysql.insert(table)
+        set_ = {
+            column: statement.inserted[column]
+            for column in PRODUCT_COLUMNS[1:] + ("updated_at",)
+        }
+        set_["version"] = table.c.version + 1
+        return statement.on_duplicate_key_update(set_)
+    return None
+
+
+def barcode_is_unique(connection):
+    return not any(
+        name == "ix_product_barcode"
+        for _, name, _, _ in missing_indexes(connection)
+    )
+
+
+class ProductImporter:
+    """
+    Imports product rows, keeping the category and subcategory lookups
+    across chunks
+
+    Parameters
+    ----------
+    chunk_size: int
+        number of rows written per commit
+    progress: callable
+        optional, called with the number of rows processed so far after
+        every committed chunk
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, progress=None):
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.stats = {"rows": 0, "inserted": 0, "updated": 0, "errors": []}
+        self.categories = {
+            name: category_id
+            for category_id, name in db.session.query(
+                Category.id, Category.name
+            )
+        }
+        self.subcategories = {
+            (category_id, name): subcategory_id
+            for subcategory_id, category_id, name in db.session.query(
+                SubCategory.id, SubCategory.category_id, SubCategory.name
+            )
+        }
+        connection = db.session.connection()
+        self.upsert = None
+        if barcode_is_unique(connection):
+            self.upsert = upsert_statement(connection.dialect.name)
+
+    def import_file(self, file_path):
+        return self.import_rows(read_rows(file_path))
+
+    def import_rows(self, rows):
+        """
+        Parameters
+        ----------
+        rows: iterable
+            data rows, header excluded
+
+        Returns
+        -------
+        dict
+            rows, inserted, updated and errors (list of (row number,
+            message)) counts
+        """
+        row_number = 1  # header
+        for chunk in chunked(rows, self.chunk_size):
+            parsed = {}
+            for row in chunk:
+                row_number += 1
+                try:
+                    product = self._parse_row(row)
+                except ValueError as e:
+                    self.stats["errors"].append((row_number, str(e)))
+                    continue
+                if product is not None:
+                    # last row wins for barcodes repeated in a chunk
+                    parsed[product["barcode"]] = product
+
+            self._write_chunk(parsed)
+            registry.inc("shopcube_import_rows_total", len(chunk))
+            self.stats["rows"] = row_number - 1
+            if self.progress is not None:
+                self.progress(self.stats["rows"])
+        return self.stats
+
+    def _parse_row(self, row):
+        row = tuple(row) + (None,) * (NUM_COLUMNS - len(row))
+        barcode = cell_str(row[0])
+        if not barcode:
+            return None
+
+        category_name = cell_str(row[9]).lower()
+        subcategory_name = cell_str(row[10]).lower()
+        if not category_name or not subcategory_name:
+            raise ValueError(f"{barcode}: category and subcategory required")
+
+        try:
+            price = _to_number(row[5], float)
+            selling_price = _to_number(row[6], float)
+            in_stock = _to_number(row[7], int)
+        except ValueError:
+            raise ValueError(f"{barcode}: price and stock must be numbers")
+
+        return {
+            "barcode": barcode,
+            "name": cell_str(row[1]),
+            "description": cell_str(row[2]),
+            "price": price,
+            "selling_price": selling_price,
+            "in_stock": in_stock,
+            "discontinued": isdiscontinued(row[8]),
+            "subcategory_id": self._get_subcategory_id(
+                category_name, subcategory_name
+            ),
+            "colors": split_variants(row[3]),
+            "sizes": split_variants(row[4]),
+        }
+
+    def _get_subcategory_id(self, category_name, subcategory_name):
+        category_id = self.categories.get(category_name)
+        if category_id is None:
+            category = Category(name=category_name)
+            db.session.add(category)
+            db.session.flush()
+            category_id = self.categories[category_name] = category.id
+
+        key = (category_id, subcategory_name)
+        if key not in self.subcategories:
+            subcategory = SubCategory(
+                name=subcategory_name, category_id=category_id
+            )
+            db.session.add(subcategory)
+            db.session.flush()
+            self.subcategories[key] = subcategory.id
+        return self.subcategories[key]
+
+    def _write_chunk(self, parsed):
+        if not parsed:
+            db.session.commit()
+            return
+
+        existing = dict(
+            db.session.query(Product.barcode, Product.id).filter(
+                Product.barcode.in_(parsed.keys())
+            )
+        )
+        mappings = [
+            {column: product[column] for column in PRODUCT_COLUMNS}
+            for product in parsed.values()
+        ]
+        updated_ids = list(existing.values())
+        inserted = len(parsed) - len(existing)
+        # subcategories the products are added to or moved out of
+        subcategory_ids = {
+            product["subcategory_id"] for product in parsed.values()
+        }
+        if updated_ids:
+            subcategory_ids.update(
+                subcategory_id
+                for (subcategory_id,) in db.session.query(
+                    Product.subcategory_id
+                )
+                .filter(Product.id.in_(updated_ids))
+                .distinct()
+            )
+
+        if self.upsert is not None:
+            db.session.execute(self.upsert, mappings)
+        else:
+            updates = []
+            inserts = []
+            for mapping in mappings:
+                if mapping["barcode"] in existing:
+                    mapping["id"] = existing[mapping["barcode"]]
+                    updates.append(mapping)
+                else:
+                    inserts.append(mapping)
+            db.session.bulk_update_mappings(Product, updates)
+            db.session.bulk_insert_mappings(Product, inserts)
+
+        if inserted:
+            existing.update(
+                db.session.query(Product.barcode, Product.id).filter(
+                    Product.barcode.in_(
+                        [b for b in parsed if b not in existing]
+                    )
+                )
+            )
+
+        # sizes and colors are replaced by the ones of the sheet
+        if updated_ids:
+            Size.query.filter(Size.product_id.in_(updated_ids)).delete(
+                synchronize_session=False
+            )
+            Color.query.filter(Color.product_id.in_(updated_ids)).delete(
+                synchronize_session=False
+            )
+
+        sizes = []
+        colors = []
+        for barcode, product in parsed.items():
+            product_id = existing[barcode]
+            sizes.extend(
+                {"name": name, "product_id": product_id}
+                for name in product["sizes"]
+            )
+            colors.extend(
+                {"name": name, "product_id": product_id}
+                for name in product["colors"]
+            )
+        db.session.bulk_insert_mappings(Size, sizes)
+        db.session.bulk_insert_mappings(Color, colors)
+
+        mark_dirty(db.session, existing.values())
+        touch_rows(db.session, SubCategory, subcategory_ids)
+        # product counts and subcategory covers may have changed
+        invalidate_on_commit(db.session)
+        purge_on_commit(
+            db.session,
+            [PRODUCTS_TAG]
+            + [product_tag(i) for i in existing.values()]
+            + [subcategory_tag(i) for i in subcategory_ids],
+        )
+        db.session.commit()
+        self.stats["inserted"] += inserted
+        self.stats["updated"] += len(updated_ids)
+
+
+def import_products(file_path, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Imports the products of a workbook, see ProductImporter
+
+    Returns
+    -------
+    dict
+        import stats
+    """
+    importer = ProductImporter(chunk_size=chunk_size, progress=progress)
+    return importer.import_file(file_path)
@@ -1,6 +1,7 @@
 """
 remember: backrefs should be unique
 """
+import datetime
 
 from flask import url_for
 
@@ -9,11 +10,16 @@ from sqlalchemy import exists
 from sqlalchemy.orm import validates
 
 from init import db
+from utils.conditional import VersionMixin
+from utils.indexes import hot_path_index
 
 
-class Category(PkModel):
+class Category(VersionMixin, PkModel):
     __tablename__ = "categories"
-    name = db.Column(db.String(100), unique=True, nullable=False)
+    __table_args__ = (
+        hot_path_index("ix_categories_name", "name", unique=True),
+    )
+    name = db.Column(db.String(100), nullable=False)
     subcategories = db.relationship(
         "SubCategory", backref="category", lazy=True
     )
@@ -51,8 +57,14 @@ class Category(PkModel):
         return url_for("shop.category", category_name=self.name)
 
 
-class SubCategory(PkModel):
+class SubCategory(VersionMixin, PkModel):
     __tablename__ = "subcategories"
+    __table_args__ = (
+        # subcategories of a category, lookups by name in the importer
+        hot_path_index(
+            "ix_subcategories_category_id_name", "category_id", "name"
+        ),
+    )
     name = db.Column(db.String(100), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey("categories.id"))
     products = db.relationship("Product", backref="subcategory", lazy=True)
@@ -104,3 +116,17 @@ class SubCategory(PkModel):
                     "static",
                     filename=f"uploads/subcategory/{resource.filename}",
                 )
+
+
+class CategoryTreeVersion(db.Model):
+    """
+    Single row counter bumped by every transaction changing the category
+    tree, so that the tree snapshot of every process knows when to
+    rebuild, see category/tree.py
+    """
+
+    __tablename__ = "category_tree_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # UTC, for the Last-Modified of the pages showing the tree
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
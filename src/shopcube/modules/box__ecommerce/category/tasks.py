@@ -0,0 +1,20 @@
+import os
+
+from modules.box__default.jobs.helpers import task
+from modules.box__ecommerce.category.importer import import_products
+
+# rows errors kept in the job result
+MAX_REPORTED_ERRORS = 100
+
+
+@task("category.import_products")
+def import_products_job(ctx, file_path):
+    """
+    Imports an uploaded product workbook, removing it once imported.
+    The upsert is idempotent so a failed import can simply be retried
+    """
+    stats = import_products(file_path, progress=ctx.progress)
+    os.remove(file_path)
+    stats["error_count"] = len(stats["errors"])
+    stats["errors"] = stats["errors"][:MAX_REPORTED_ERRORS]
+    return stats
@@ -13,8 +13,15 @@ from flask import url_for
 
 import pytest
 
+from modules.box__default.jobs.helpers import run_pending_jobs
+from modules.box__default.jobs.models import Job
+from modules.box__ecommerce.category.importer import ProductImporter
+from modules.box__ecommerce.category.importer import import_products
 from modules.box__ecommerce.category.models import Category
 from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.category.tasks import import_products_job
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
 
 dirpath = os.path.dirname(os.path.abspath(__file__))
 module_path = os.path.dirname(dirpath)
@@ -316,3 +323,132 @@ class TestCategoryApi:
         assert response.status_code == 400
         assert b"category does not exist" in response.data
         assert subcategories == 0
+
+
+class TestProductImport:
+    """
+    Test the bulk product importer used by the upload page
+    """
+
+    header = (
+        "Barcode",
+        "Name",
+        "Description",
+        "Colors",
+        "Sizes",
+        "Price",
+        "Selling price",
+        "In stock",
+        "Discontinued",
+        "Category",
+        "Subcategory",
+    )
+
+    def write_workbook(self, path, rows):
+        import openpyxl
+
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(self.header)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(path)
+
+    def test_import_inserts_and_updates_products(self, tmp_path):
+        category = Category(name="women")
+        subcategory = SubCategory(name="sandals")
+        category.subcategories.append(subcategory)
+        existing = Product(barcode="import-1", name="Old", price=1)
+        existing.sizes.append(Size(name="1"))
+        subcategory.products.append(existing)
+        category.save()
+        file_path = str(tmp_path / "products.xlsx")
+        self.write_workbook(
+            file_path,
+            [
+                (
+                    "import-1",
+                    "Max 1",
+                    "Lorem ipsum",
+                    "blue, yellow",
+                    "40\n45",
+                    300,
+                    350,
+                    20,
+                    0,
+                    "Men",
+                    "Air Jordan",
+                ),
+                (
+                    "import-2",
+                    "Max 2",
+                    "",
+                    "",
+                    "41",
+                    100.0,
+                    120,
+                    5,
+                    "yes",
+                    "men",
+                    "air jordan",
+                ),
+                ("import-3", "Bad", "", "", "", "abc", 1, 1, 0, "men", "x"),
+            ],
+        )
+        progress = []
+
+        stats = import_products(
+            file_path, chunk_size=2, progress=progress.append
+        )
+
+        assert stats["rows"] == 3
+        assert stats["inserted"] == 1
+        assert stats["updated"] == 1
+        assert [row for row, _ in stats["errors"]] == [4]
+        assert progress == [2, 3]
+        assert Category.query.filter_by(name="men").count() == 1
+        assert SubCategory.query.filter_by(name="air jordan").count() == 1
+
+        updated = Product.query.filter_by(barcode="import-1").one()
+        assert updated.id == existing.id
+        assert updated.name == "Max 1"
+        assert updated.selling_price == 350
+        assert updated.subcategory.name == "air jordan"
+        assert sorted(s.name for s in updated.sizes) == ["40", "45"]
+        assert sorted(c.name for c in updated.colors) == ["blue", "yellow"]
+
+        inserted = Product.query.filter_by(barcode="import-2").one()
+        assert inserted.discontinued is True
+        assert inserted.in_stock == 5
+        assert [s.name for s in inserted.sizes] == ["41"]
+
+    def test_import_upserts_on_unique_barcode(self):
+        category = Category(name="men")
+        subcategory = SubCategory(name="boots")
+        category.subcategories.append(subcategory)
+        category.save()
+        importer = ProductImporter()
+        rows = [("upsert-1", "Boot", "", "", "", 1, 2, 3, 0, "men", "boots")]
+
+        assert importer.upsert is not None
+        importer.import_rows(rows)
+        stats = importer.import_rows(rows)
+
+        assert stats["inserted"] == 1
+        assert stats["updated"] == 1
+        assert Product.query.filter_by(barcode="upsert-1").one().version == 2
+
+    def test_import_job_removes_imported_file(self, tmp_path):
+        file_path = str(tmp_path / "products.xlsx")
+        self.write_workbook(
+            file_path,
+            [("job-1", "Max", "", "", "", 1, 2, 3, 0, "men", "shoes")],
+        )
+
+        job = import_products_job.enqueue(file_path=file_path)
+        run_pending_jobs()
+
+        job = Job.query.get(job.id)
+        assert job.status == "done"
+        assert job.get_result()["inserted"] == 1
+        assert not os.path.exists(file_path)
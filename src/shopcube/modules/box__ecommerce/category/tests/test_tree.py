@@ -0,0 +1,122 @@
+"""
+This file (test_tree.py) contains the tests of the category tree
+snapshot, see category/tree.py
+"""
+import pytest
+from sqlalchemy import event
+
+from init import db
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.category.tree import bump_tree_version
+from modules.box__ecommerce.category.tree import get_category_tree
+from modules.box__ecommerce.product.models import Product
+from modules.resource.models import Resource
+
+
+@pytest.fixture
+def catalogue(db_session):
+    category = Category(name="tree")
+    boots = SubCategory(name="tree boots")
+    sandals = SubCategory(name="tree sandals")
+    for i in range(3):
+        boots.products.append(Product(barcode=f"tree-{i}", name="Boot"))
+    boots.products[0].resources.append(
+        Resource(
+            filename="boot.jpg",
+            type="image",
+            category="product_image",
+            resource_category=category,
+        )
+    )
+    category.subcategories.extend([boots, sandals])
+    category.save()
+    return category.id
+
+
+@pytest.fixture
+def cached_tree(flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, "CATEGORY_TREE_TTL", 60)
+
+
+class QueryCount:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, "before_cursor_execute", self)
+
+
+def test_tree(catalogue):
+    category = get_category_tree().get(catalogue)
+    boots, sandals = category.subcategories
+
+    assert category.name == "tree"
+    assert category.url == "/shop/c/tree"
+    assert category.product_count == 3
+    # images of products are images of their category too
+    assert category.image_filename == "boot.jpg"
+    assert boots.url == f"/shop/sub/{boots.id}"
+    assert boots.product_count == 3
+    assert boots.get_one_image_url().endswith("uploads/products/boot.jpg")
+    assert sandals.product_count == 0
+    assert sandals.get_one_image_url().endswith(
+        "default/default_subcategory.jpg"
+    )
+    assert get_category_tree().by_name("tree") is category
+
+
+def test_reading_costs_no_query(catalogue, cached_tree):
+    tree = get_category_tree()
+
+    with QueryCount() as queries:
+        assert get_category_tree() is tree
+        assert get_category_tree().get(catalogue).product_count == 3
+    assert queries.count == 0
+
+
+def test_commit_swaps_the_tree(catalogue, cached_tree):
+    tree = get_category_tree()
+    subcategory = SubCategory.query.filter_by(name="tree sandals").one()
+    subcategory.products.append(Product(barcode="tree-new", name="Sandal"))
+    db.session.commit()
+
+    new_tree = get_category_tree()
+    assert new_tree is not tree
+    assert new_tree.get(catalogue).product_count == 4
+    # the snapshot read before is left as it was
+    assert tree.get(catalogue).product_count == 3
+
+
+def test_changes_of_other_processes(catalogue, cached_tree):
+    tree = get_category_tree()
+    # as another process would, its session events bumping the version
+    db.session.execute(
+        SubCategory.__table__.insert().values(
+            name="tree slippers", category_id=catalogue
+        )
+    )
+    bump_tree_version(db.session)
+
+    assert get_category_tree() is tree
+    # checking reads the version row only
+    with QueryCount() as queries:
+        assert get_category_tree(fresh=True) is not tree
+    assert queries.count > 1
+    with QueryCount() as queries:
+        get_category_tree(fresh=True)
+    assert queries.count == 1
+    fresh = get_category_tree(fresh=True)
+    assert [s.name for s in fresh.get(catalogue).subcategories] == [
+        "tree boots",
+        "tree sandals",
+        "tree slippers",
+    ]
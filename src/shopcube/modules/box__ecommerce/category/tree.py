@@ -0,0 +1,387 @@
+"""
+Snapshot of the category tree.
+
+The storefront menu and homepage, the category pages, the point of sale
+and the category dashboard all show the categories with their
+subcategories, product counts and cover images. get_category_tree
+returns a snapshot of them shared by all the requests of the app, built
+with a handful of grouped queries instead of walking the relationships
+lazily, so that reading it costs no query.
+
+The snapshot is immutable and replaced as a whole. A transaction
+changing the tree (see shop/changes.py) bumps the single row of
+category_tree_version, and drops the snapshot of its process on commit.
+Other processes notice at most CATEGORY_TREE_TTL seconds later, by
+comparing the version of the row with the one of their snapshot.
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from flask import has_app_context
+from flask import url_for
+
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from init import db
+from utils.page_cache import tag_page
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import CategoryTreeVersion
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.changes import changed_rows
+from modules.box__ecommerce.shop.page_tags import CATEGORIES_TAG
+from modules.box__ecommerce.shop.page_tags import PRODUCTS_TAG
+from modules.box__ecommerce.shop.page_tags import category_tag
+from modules.resource.models import Resource
+
+DEFAULT_IMAGE = "default/default_subcategory.jpg"
+
+
+class SubCategoryNode(
+    namedtuple(
+        "SubCategoryNode",
+        ("id", "name", "category_id", "url", "image_url", "product_count"),
+    )
+):
+    """
+    A subcategory in the tree, with the methods of SubCategory used by
+    the templates. They tag the page for the page cache with what the
+    values come from: images belong to a category, even those of the
+    products
+    """
+
+    __slots__ = ()
+
+    def get_page_url(self):
+        return self.url
+
+    def get_one_image_url(self):
+        tag_page(category_tag(self.category_id))
+        return self.image_url
+
+    def get_num_products(self):
+        tag_page(PRODUCTS_TAG)
+        return self.product_count
+
+
+class CategoryNode(
+    namedtuple(
+        "CategoryNode",
+        (
+            "id",
+            "name",
+            "url",
+            "image_url",
+            "image_filename",
+            "product_count",
+            "subcategories",
+        ),
+    )
+):
+    """
+    A category in the tree, image_filename being its own first image,
+    None if it has none
+    """
+
+    __slots__ = ()
+
+    def get_page_url(self):
+        return self.url
+
+    def get_one_image_url(self):
+        tag_page(category_tag(self.id))
+        return self.image_url
+
+
+class CategoryTree:
+    """
+    Parameters
+    ----------
+    categories: iterable
+        CategoryNode, with their subcategories
+    fingerprint: tuple
+        version and update time of the tree it was built from
+    """
+
+    def __init__(self, categories, fingerprint=None):
+        self.categories = tuple(categories)
+        self.fingerprint = fingerprint
+        self._by_name = {c.name: c for c in self.categories}
+        self._by_id = {c.id: c for c in self.categories}
+
+    def __iter__(self):
+        return iter(self.categories)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def get(self, category_id):
+        return self._by_id.get(category_id)
+
+    def by_name(self, name):
+        return self._by_name.get(name)
+
+    def product_counts(self):
+        """
+        Returns
+        -------
+        dict
+            category id -> number of products
+        """
+        return {c.id: c.product_count for c in self.categories}
+
+
+def fingerprint():
+    """
+    Version and update time of the tree, from the category_tree_version
+    row
+
+    Returns
+    -------
+    tuple
+        (0, None) if the tree never changed
+    """
+    row = db.session.execute(
+        select(
+            CategoryTreeVersion.version, CategoryTreeVersion.updated_at
+        ).where(CategoryTreeVersion.id == 1)
+    ).first()
+    if row is None:
+        return (0, None)
+    return tuple(row)
+
+
+def bump_tree_version(session):
+    """
+    Bumps the version of the tree in the transaction of a session
+    """
+    table = CategoryTreeVersion.__table__
+    now = datetime.utcnow()
+    updated = session.execute(
+        table.update()
+        .where(table.c.id == 1)
+        .values(version=table.c.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        session.execute(table.insert().values(id=1, version=1, updated_at=now))
+
+
+def _first_images():
+    """
+    File names of the first image of every category and subcategory,
+    and of the first product of every subcategory
+    """
+    first_product = (
+        select(
+            Product.subcategory_id.label("subcategory_id"),
+            func.min(Product.id).label("product_id"),
+        )
+        .group_by(Product.subcategory_id)
+        .subquery()
+    )
+    queries = {
+        "category": select(Resource.category_id, func.min(Resource.id))
+        .where(Resource.category_id.isnot(None))
+        .group_by(Resource.category_id),
+        "subcategory": select(Resource.subcategory_id, func.min(Resource.id))
+        .where(Resource.subcategory_id.isnot(None))
+        .group_by(Resource.subcategory_id),
+        "product": select(
+            first_product.c.subcategory_id, func.min(Resource.id)
+        )
+        .join(Resource, Resource.product_id == first_product.c.product_id)
+        .group_by(first_product.c.subcategory_id),
+    }
+    first_ids = {
+        kind: dict(db.session.execute(query).all())
+        for kind, query in queries.items()
+    }
+    ids = set()
+    for values in first_ids.values():
+        ids.update(values.values())
+    filenames = {}
+    if ids:
+        filenames = dict(
+            db.session.execute(
+                select(Resource.id, Resource.filename).where(
+                    Resource.id.in_(ids)
+                )
+            ).all()
+        )
+    return {
+        kind: {key: filenames[i] for key, i in values.items()}
+        for kind, values in first_ids.items()
+    }
+
+
+def _static_url(filename):
+    return url_for("static", filename=filename)
+
+
+def build_category_tree():
+    """
+    Builds a snapshot of the category tree from the database. Must run
+    in a request, for the urls
+
+    Returns
+    -------
+    CategoryTree
+    """
+    state = fingerprint()
+    counts = dict(
+        db.session.query(Product.subcategory_id, func.count(Product.id))
+        .group_by(Product.subcategory_id)
+        .all()
+    )
+    images = _first_images()
+
+    subcategories = {}
+    for subcategory_id, name, category_id in (
+        db.session.query(
+            SubCategory.id, SubCategory.name, SubCategory.category_id
+        )
+        .order_by(SubCategory.id)
+        .all()
+    ):
+        # as SubCategory.get_one_image_url
+        if subcategory_id in images["product"]:
+            image = f"uploads/products/{images['product'][subcategory_id]}"
+        elif subcategory_id in images["subcategory"]:
+            filename = images["subcategory"][subcategory_id]
+            image = f"uploads/subcategory/{filename}"
+        else:
+            image = DEFAULT_IMAGE
+        subcategories.setdefault(category_id, []).append(
+            SubCategoryNode(
+                id=subcategory_id,
+                name=name,
+                category_id=category_id,
+                url=url_for("shop.subcategory", sub_id=subcategory_id),
+                image_url=_static_url(image),
+                product_count=counts.get(subcategory_id, 0),
+            )
+        )
+
+    categories = []
+    for category_id, name in (
+        db.session.query(Category.id, Category.name)
+        .order_by(Category.id)
+        .all()
+    ):
+        children = tuple(subcategories.get(category_id, ()))
+        filename = images["category"].get(category_id)
+        # as Category.get_one_image_url
+        image = DEFAULT_IMAGE
+        if filename is not None:
+            image = f"uploads/products/{filename}"
+        categories.append(
+            CategoryNode(
+                id=category_id,
+                name=name,
+                url=url_for("shop.category", category_name=name),
+                image_url=_static_url(image),
+                image_filename=filename,
+                product_count=sum(c.product_count for c in children),
+                subcategories=children,
+            )
+        )
+    return CategoryTree(categories, state)
+
+
+def _holder(app):
+    return app.extensions.setdefault(
+        "category_tree",
+        {"tree": None, "checked_at": 0.0, "lock": threading.Lock()},
+    )
+
+
+def get_category_tree(fresh=False):
+    """
+    The snapshot of the category tree of the current app
+
+    Parameters
+    ----------
+    fresh: bool
+        check that the snapshot is current now instead of every
+        CATEGORY_TREE_TTL seconds, for the admin views
+
+    Returns
+    -------
+    CategoryTree
+    """
+    tag_page(CATEGORIES_TAG)
+    holder = _holder(current_app)
+    ttl = current_app.config.get("CATEGORY_TREE_TTL", 5)
+    with holder["lock"]:
+        tree = holder["tree"]
+        now = time.monotonic()
+        if tree is not None and (fresh or now - holder["checked_at"] >= ttl):
+            if fingerprint() != tree.fingerprint:
+                tree = None
+            else:
+                holder["checked_at"] = now
+        if tree is None:
+            tree = build_category_tree()
+            holder.update({"tree": tree, "checked_at": time.monotonic()})
+        return tree
+
+
+def tree_validators():
+    """
+    Conditional GET validators of the category tree, for the pages
+    showing it, e.g. in the menu of the theme (see utils/conditional.py).
+    Checked now, as the snapshot of the process may lag behind the
+    changes of other processes
+
+    Returns
+    -------
+    tuple
+        value changing with the tree, latest update time
+    """
+    state = get_category_tree(fresh=True).fingerprint
+    return state, state[1]
+
+
+def invalidate_category_tree(app=None):
+    """
+    Drops the snapshot of the current process, rebuilt when next read
+    """
+    holder = _holder(app or current_app)
+    with holder["lock"]:
+        holder.update({"tree": None, "checked_at": 0.0})
+
+
+def invalidate_on_commit(session):
+    """
+    Bumps the version of the tree and drops the snapshot when the
+    session commits, also for writes bypassing the session events, e.g.
+    bulk inserts
+    """
+    if not session.info.get("category_tree_changed"):
+        bump_tree_version(session)
+        session.info["category_tree_changed"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_tree_changes(session, flush_context):
+    if changed_rows(session).category_tree:
+        invalidate_on_commit(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed_tree(session):
+    changed = session.info.pop("category_tree_changed", False)
+    if changed and has_app_context():
+        invalidate_category_tree()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_tree_changes(session, previous_transaction):
+    session.info.pop("category_tree_changed", None)
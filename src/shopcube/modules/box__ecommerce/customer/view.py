@@ -73,12 +73,15 @@ def orders():
     NO_OF_ITEMS = 5
 
     page = request.args.get("page", 1, type=int)
-    logged_in_orders = Order.query.filter(
-        Order.logged_in_customer_email == current_user.email
-    ).paginate(page, NO_OF_ITEMS, False)
+    logged_in_orders = (
+        Order.query.options(*Order.load_details())
+        .filter(Order.logged_in_customer_email == current_user.email)
+        .paginate(page, NO_OF_ITEMS, False)
+    )
 
     not_logged_in_orders = (
         Order.query.join(BillingDetail)
+        .options(*Order.load_details())
         .filter(
             (BillingDetail.email == current_user.email)
             & (Order.logged_in_customer_email == "")
@@ -100,7 +103,7 @@ def orders():
 @module_blueprint.route("/order/<order_id>/view", methods=["GET", "POST"])
 @login_required
 def order_view(order_id):
-    order = Order.query.get(order_id)
+    order = Order.query.options(*Order.load_details()).get_or_404(order_id)
     context = mhelp.context()
     context.update({"order": order})
     context.update(
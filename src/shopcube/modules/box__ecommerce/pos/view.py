@@ -9,9 +9,11 @@ from flask import request
 from flask_login import current_user
 from flask_login import login_required
 
-from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.tree import get_category_tree
 from modules.box__ecommerce.pos.models import Transaction
 from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.inventory import OutOfStock
+from modules.box__ecommerce.shop.inventory import take_stock
 
 # from flask import url_for
 # from flask import redirect
@@ -43,8 +45,14 @@ module_blueprint = globals()["{}_blueprint".format(module_info["module_name"])]
 @login_required
 def index():
     context = {}
-    categories = Category.query.all()
-    context.update({"categories": categories})
+    categories = get_category_tree(fresh=True).categories
+    # the products in stock of all subcategories in one query
+    products = {}
+    for product in (
+        Product.query.filter(Product.in_stock > 0).order_by(Product.id).all()
+    ):
+        products.setdefault(product.subcategory_id, []).append(product)
+    context.update({"categories": categories, "products": products})
     return render_template("pos/index.html", **context)
 
 
@@ -53,17 +61,19 @@ def index():
 def transaction():
     if request.method == "POST":
         json = request.get_json()
-        for key in json:
-            prod_id = key
-            number_items = json[key]["count"]
-            product = Product.query.get(prod_id)
-            product.in_stock -= number_items
-
-            product.update()
+        lines = {int(key): int(json[key]["count"]) for key in json}
+        if any(count < 1 for count in lines.values()):
+            return jsonify({"message": "Counts must be at least 1"}), 400
+        try:
+            take_stock(lines)
+        except OutOfStock as error:
+            return jsonify({"message": f"Not enough stock for {error}"}), 409
 
         transaction = Transaction()
         transaction.chashier_id = current_user.id
-        transaction.products = [Product.query.get(key) for key in json]
+        transaction.products = Product.query.filter(
+            Product.id.in_(lines)
+        ).all()
         transaction.insert()
 
     return jsonify({"message": "ok"})
@@ -1,10 +1,29 @@
+from sqlalchemy.orm import selectinload
+
+from utils.page_cache import tag_page
+
 from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.page_tags import PRODUCTS_TAG
 
 
 def get_products():
     return Product.query.all()
 
 
+def get_latest_products(limit=5):
+    """
+    Newest products, with their images loaded for get_one_image_url
+    """
+    tag_page(PRODUCTS_TAG)
+    return (
+        Product.query.options(selectinload(Product.resources))
+        .order_by(Product.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
 available_everywhere = {
     "get_products": get_products,
+    "get_latest_products": get_latest_products,
 }
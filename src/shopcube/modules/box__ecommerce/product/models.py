@@ -3,6 +3,8 @@ from flask import url_for
 from shopyo.api.models import PkModel
 
 from init import db
+from utils.conditional import VersionMixin
+from utils.indexes import hot_path_index
 
 # from modules.box__ecommerce.pos.models import Transaction
 
@@ -13,8 +15,16 @@ transaction_helpers = db.Table(
 )
 
 
-class Product(PkModel):
+class Product(VersionMixin, PkModel):
     __tablename__ = "product"
+    __table_args__ = (
+        # product pages, cart, orders, importer upserts
+        hot_path_index("ix_product_barcode", "barcode", unique=True),
+        # subcategory listings, keyset pages sorted by price or id
+        hot_path_index(
+            "ix_product_subcategory", "subcategory_id", "selling_price", "id"
+        ),
+    )
 
     barcode = db.Column(db.String(100))
     price = db.Column(db.Float)
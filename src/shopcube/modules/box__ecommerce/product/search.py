@@ -0,0 +1,808 @@
+"""
+Product search index.
+
+Products are indexed on their name, description, colors, sizes and the
+names of their category and subcategory. On SQLite with FTS5 the index
+is the product_search virtual table ranked with bm25, elsewhere, or with
+the SEARCH_BACKEND config set to memory, an inverted index kept by the
+process is used instead.
+
+Query terms match as prefixes. A term matching nothing is replaced by
+the indexed terms one edit away from it, so that "shrit" finds shirts.
+
+The index follows the products through session events: adding, changing
+or deleting products, their sizes or colors marks products dirty, and
+dirty products are reindexed in the committing transaction. Renaming a
+category or subcategory queues a product.reindex_subcategories job for
+their products instead, see tasks.py. Bulk writes that bypass the unit
+of work, like the spreadsheet importer, call mark_dirty themselves.
+
+Commits never build the index. It is built by rebuild_index, run by
+``shopcube search-index`` or by the product.rebuild_search_index job,
+which the first search queues should the FTS5 table be missing. The
+in-memory index, private to its process, is built on the first search.
+"""
+import bisect
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from flask import current_app
+from flask import has_app_context
+
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import selectinload
+
+from init import db
+
+from modules.box__default.jobs.helpers import enqueue
+from modules.box__default.jobs.helpers import new_job
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import JOB_RUNNING
+from modules.box__default.jobs.models import Job
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Color
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("name", "description", "colors", "sizes", "categories")
+WEIGHTS = {
+    "name": 10.0,
+    "description": 1.0,
+    "colors": 3.0,
+    "sizes": 2.0,
+    "categories": 4.0,
+}
+# terms shorter than this are not corrected
+MIN_TYPO_LENGTH = 4
+# corrections tried for a misspelled term
+MAX_CORRECTIONS = 5
+# ids per IN query when loading documents
+BATCH_SIZE = 500
+PRODUCT_ATTRIBUTES = ("name", "description", "subcategory_id")
+TOKEN_RE = re.compile(r"\w+")
+REBUILD_TASK = "product.rebuild_search_index"
+REINDEX_TASK = "product.reindex_subcategories"
+
+
+def tokenize(value):
+    """
+    Lowercased words of a text, accents removed
+    """
+    if not value:
+        return []
+    value = unicodedata.normalize("NFKD", value.lower())
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return TOKEN_RE.findall(value)
+
+
+def within_one_edit(a, b):
+    """
+    Whether b is a, with at most one character inserted, deleted,
+    replaced, or two neighbouring characters swapped
+    """
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1 :] == b[i + 1 :] or (
+            a[i : i + 2] == b[i : i + 2][::-1] and a[i + 2 :] == b[i + 2 :]
+        )
+    return a[i:] == b[i + 1 :]
+
+
+def _prefix_end(prefix):
+    return prefix + "\U0010ffff"
+
+
+def load_documents(connection, product_ids):
+    """
+    Searchable text of products
+
+    Returns
+    -------
+    dict
+        product id -> field -> text, products that no longer exist being
+        left out
+    """
+    documents = {}
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        ids = product_ids[start : start + BATCH_SIZE]
+        rows = connection.execute(
+            select(
+                Product.id,
+                Product.name,
+                Product.description,
+                SubCategory.name,
+                Category.name,
+            )
+            .join(SubCategory, Product.subcategory_id == SubCategory.id)
+            .join(Category, SubCategory.category_id == Category.id)
+            .where(Product.id.in_(ids))
+        )
+        variants = defaultdict(lambda: {"colors": [], "sizes": []})
+        for field, model in (("colors", Color), ("sizes", Size)):
+            for product_id, name in connection.execute(
+                select(model.product_id, model.name).where(
+                    model.product_id.in_(ids)
+                )
+            ):
+                variants[product_id][field].append(name or "")
+        for product_id, name, description, subcategory, category in rows:
+            documents[product_id] = {
+                "name": name or "",
+                "description": description or "",
+                "colors": " ".join(variants[product_id]["colors"]),
+                "sizes": " ".join(variants[product_id]["sizes"]),
+                "categories": f"{category} {subcategory}",
+            }
+    return documents
+
+
+def all_product_ids(connection):
+    return [
+        product_id
+        for (product_id,) in connection.execute(
+            select(Product.id).order_by(Product.id)
+        )
+    ]
+
+
+class FTS5Index:
+    """
+    Index stored in the product_search FTS5 table of the app database,
+    written in the transactions that change the products
+    """
+
+    table = "product_search"
+    vocabulary = "product_search_vocab"
+    transactional = True
+
+    def ready(self, connection):
+        return (
+            connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                {"name": self.table},
+            ).first()
+            is not None
+        )
+
+    def ensure(self, connection):
+        """
+        Creates the index tables if they do not exist, left empty for
+        rebuild_index to fill
+        """
+        if self.ready(connection):
+            return
+        columns = ", ".join(FIELDS)
+        connection.execute(
+            text(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5({columns}, "
+                "tokenize = 'unicode61 remove_diacritics 2', "
+                "prefix = '2 3')"
+            )
+        )
+        connection.execute(
+            text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.vocabulary} "
+                f"USING fts5vocab({self.table}, row)"
+            )
+        )
+
+    def index(self, connection, documents, deleted_ids):
+        ids = list(documents) + list(deleted_ids)
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start : start + BATCH_SIZE]
+            params = {
+                f"id{i}": product_id for i, product_id in enumerate(batch)
+            }
+            placeholders = ", ".join(f":{name}" for name in params)
+            connection.execute(
+                text(
+                    f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})"
+                ),
+                params,
+            )
+        if documents:
+            columns = ", ".join(FIELDS)
+            values = ", ".join(f":{field}" for field in FIELDS)
+            connection.execute(
+                text(
+                    f"INSERT INTO {self.table} (rowid, {columns}) "
+                    f"VALUES (:rowid, {values})"
+                ),
+                [
+                    dict(document, rowid=product_id)
+                    for product_id, document in documents.items()
+                ],
+            )
+
+    def has_prefix(self, connection, prefix):
+        return (
+            connection.execute(
+                text(
+                    f"SELECT 1 FROM {self.vocabulary} "
+                    "WHERE term >= :start AND term < :end LIMIT 1"
+                ),
+                {"start": prefix, "end": _prefix_end(prefix)},
+            ).first()
+            is not None
+        )
+
+    def terms_starting(self, connection, first, min_length, max_length):
+        """
+        Indexed terms starting with first and their document frequency
+        """
+        return connection.execute(
+            text(
+                f"SELECT term, doc FROM {self.vocabulary} "
+                "WHERE term >= :start AND term < :end "
+                "AND length(term) BETWEEN :min_length AND :max_length"
+            ),
+            {
+                "start": first,
+                "end": _prefix_end(first),
+                "min_length": min_length,
+                "max_length": max_length,
+            },
+        ).all()
+
+    def query(self, connection, plan, fields, limit, offset):
+        groups = []
+        for alternatives in plan:
+            terms = [
+                f'"{term}"' + ("*" if prefix else "")
+                for term, prefix in alternatives
+            ]
+            groups.append("(" + " OR ".join(terms) + ")")
+        expression = " AND ".join(groups)
+        if fields:
+            expression = "{" + " ".join(fields) + "} : (" + expression + ")"
+        weights = ", ".join(str(WEIGHTS[field]) for field in FIELDS)
+        rows = connection.execute(
+            text(
+                f"SELECT rowid, bm25({self.table}, {weights}) AS score "
+                f"FROM {self.table} WHERE {self.table} MATCH :expression "
+                "ORDER BY score LIMIT :limit OFFSET :offset"
+            ),
+            {"expression": expression, "limit": limit, "offset": offset},
+        )
+        # bm25 is lower for better matches
+        return [(product_id, -score) for product_id, score in rows]
+
+
+class InvertedIndex:
+    """
+    Index kept in memory by the process, built from the products table
+    on first use. Changes committed by other processes are not seen.
+    The products of renamed categories are reindexed on the next search
+    """
+
+    transactional = False
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.built = False
+        # term -> product id -> field -> term frequency
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.lengths = {}
+        self.total_length = 0.0
+        self._terms = None
+        # renamed subcategories and categories not yet reindexed
+        self._stale = (set(), set())
+        self._lock = threading.RLock()
+
+    def ready(self, connection):
+        return self.built
+
+    def mark_stale(self, subcategories, categories):
+        with self._lock:
+            self._stale[0].update(subcategories)
+            self._stale[1].update(categories)
+
+    def ensure(self, connection):
+        """
+        Builds the index on first use, then reindexes the products of
+        the categories renamed since the last call
+        """
+        with self._lock:
+            if not self.built:
+                logger.info("Building the in-memory product search index")
+                self._stale = (set(), set())
+                product_ids = all_product_ids(connection)
+                for start in range(0, len(product_ids), BATCH_SIZE):
+                    ids = product_ids[start : start + BATCH_SIZE]
+                    self.index(connection, load_documents(connection, ids), [])
+                self.built = True
+                return
+            if not any(self._stale):
+                return
+            subcategories, categories = self._stale
+            self._stale = (set(), set())
+            ids = subcategory_product_ids(
+                connection, subcategories, categories
+            )
+            documents = load_documents(connection, ids)
+            self.index(connection, documents, ids - documents.keys())
+
+    def _remove(self, product_id):
+        terms = self.documents.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(product_id)
+
+    def index(self, connection, documents, deleted_ids):
+        with self._lock:
+            for product_id in list(documents) + list(deleted_ids):
+                self._remove(product_id)
+            for product_id, document in documents.items():
+                length = 0.0
+                terms = set()
+                for field in FIELDS:
+                    tokens = tokenize(document[field])
+                    length += WEIGHTS[field] * len(tokens)
+                    for token in tokens:
+                        frequencies = self.postings[token].setdefault(
+                            product_id, {}
+                        )
+                        frequencies[field] = frequencies.get(field, 0) + 1
+                        terms.add(token)
+                self.documents[product_id] = terms
+                self.lengths[product_id] = length
+                self.total_length += length
+            self._terms = None
+
+    @property
+    def terms(self):
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        return self._terms
+
+    def _terms_with_prefix(self, prefix):
+        terms = self.terms
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, _prefix_end(prefix))
+        return terms[start:end]
+
+    def has_prefix(self, connection, prefix):
+        with self._lock:
+            return bool(self._terms_with_prefix(prefix))
+
+    def terms_starting(self, connection, first, min_length, max_length):
+        with self._lock:
+            return [
+                (term, len(self.postings[term]))
+                for term in self._terms_with_prefix(first)
+                if min_length <= len(term) <= max_length
+            ]
+
+    def _term_scores(self, term, fields, average_length):
+        postings = self.postings.get(term, {})
+        idf = math.log(
+            1
+            + (len(self.documents) - len(postings) + 0.5)
+            / (len(postings) + 0.5)
+        )
+        scores = {}
+        for product_id, frequencies in postings.items():
+            frequency = sum(
+                WEIGHTS[field] * count
+                for field, count in frequencies.items()
+                if fields is None or field in fields
+            )
+            if not frequency:
+                continue
+            norm = self.k1 * (
+                1 - self.b + self.b * self.lengths[product_id] / average_length
+            )
+            scores[product_id] = (
+                idf * frequency * (self.k1 + 1) / (frequency + norm)
+            )
+        return scores
+
+    def query(self, connection, plan, fields, limit, offset):
+        with self._lock:
+            if not self.documents:
+                return []
+            average_length = self.total_length / len(self.documents) or 1.0
+            totals = None
+            for alternatives in plan:
+                group = {}
+                for term, prefix in alternatives:
+                    terms = self._terms_with_prefix(term) if prefix else [term]
+                    for matched in terms:
+                        scores = self._term_scores(
+                            matched, fields, average_length
+                        )
+                        for product_id, score in scores.items():
+                            if score > group.get(product_id, 0.0):
+                                group[product_id] = score
+                if totals is None:
+                    totals = group
+                else:
+                    totals = {
+                        product_id: score + group[product_id]
+                        for product_id, score in totals.items()
+                        if product_id in group
+                    }
+                if not totals:
+                    return []
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[offset : offset + limit]
+
+
+def _fts5_available(engine):
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as connection:
+        options = {
+            option
+            for (option,) in connection.execute(text("PRAGMA compile_options"))
+        }
+    return "ENABLE_FTS5" in options
+
+
+def get_index(app=None):
+    """
+    Search index of an app, chosen with the SEARCH_BACKEND config: fts5,
+    memory, or auto for fts5 when the database supports it
+    """
+    if app is None:
+        app = current_app._get_current_object()
+    index = app.extensions.get("product_search")
+    if index is None:
+        backend = app.config.get("SEARCH_BACKEND", "auto")
+        if backend == "auto":
+            backend = "fts5" if _fts5_available(db.engine) else "memory"
+        if backend == "fts5":
+            index = FTS5Index()
+        elif backend == "memory":
+            index = InvertedIndex()
+        else:
+            raise ValueError(f"Unknown SEARCH_BACKEND {backend}")
+        index = app.extensions.setdefault("product_search", index)
+    return index
+
+
+def plan_query(index, connection, query):
+    """
+    Terms to look for, each query word giving a list of (term, prefix)
+    alternatives: the word itself as a prefix, or its corrections
+
+    Returns
+    -------
+    list
+        alternatives per word, None if a word matches nothing
+    """
+    plan = []
+    for token in dict.fromkeys(tokenize(query)):
+        if index.has_prefix(connection, token):
+            plan.append([(token, True)])
+            continue
+        if len(token) < MIN_TYPO_LENGTH:
+            return None
+        candidates = index.terms_starting(
+            connection, token[0], len(token) - 1, len(token) + 1
+        )
+        corrections = sorted(
+            (
+                (frequency, term)
+                for term, frequency in candidates
+                if within_one_edit(token, term)
+            ),
+            reverse=True,
+        )[:MAX_CORRECTIONS]
+        if not corrections:
+            return None
+        plan.append([(term, False) for _, term in corrections])
+    return plan
+
+
+def search_product_ids(query, page=1, per_page=20, fields=None):
+    """
+    Ids of the products matching a query, best first
+
+    Parameters
+    ----------
+    query: str
+        words to look for
+    page: int
+        page number, from 1
+    per_page: int
+        ids per page
+    fields: list
+        optional, fields to look in among FIELDS, all by default
+
+    Returns
+    -------
+    tuple
+        list of (product id, score) and whether there is a next page
+    """
+    index = get_index()
+    page = max(page, 1)
+    connection = db.session.connection()
+    if not index.transactional:
+        index.ensure(connection)
+    elif not index.ready(connection):
+        schedule_rebuild()
+        # built already if jobs run inline
+        connection = db.session.connection()
+        if not index.ready(connection):
+            return [], False
+    plan = plan_query(index, connection, query)
+    if not plan:
+        return [], False
+    results = index.query(
+        connection, plan, fields, per_page + 1, (page - 1) * per_page
+    )
+    return results[:per_page], len(results) > per_page
+
+
+def search_products(query, page=1, per_page=20, fields=None):
+    """
+    Products matching a query, best first, with their images loaded
+
+    Returns
+    -------
+    tuple
+        list of products and whether there is a next page
+    """
+    results, has_next = search_product_ids(query, page, per_page, fields)
+    if not results:
+        return [], has_next
+    ids = [product_id for product_id, _ in results]
+    products = {
+        product.id: product
+        for product in Product.query.options(
+            selectinload(Product.resources)
+        ).filter(Product.id.in_(ids))
+    }
+    return [products[i] for i in ids if i in products], has_next
+
+
+def rebuild_index(app=None):
+    """
+    Builds the index if missing and reindexes every product
+    """
+    index = get_index(app)
+    connection = db.session.connection()
+    logger.info("Building the product search index")
+    index.ensure(connection)
+    product_ids = all_product_ids(connection)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        ids = product_ids[start : start + BATCH_SIZE]
+        index.index(connection, load_documents(connection, ids), [])
+    db.session.commit()
+    return len(product_ids)
+
+
+def schedule_rebuild():
+    """
+    Queues a product.rebuild_search_index job unless one is already
+    queued or running
+    """
+    pending = (
+        db.session.query(Job.id)
+        .filter(
+            Job.name == REBUILD_TASK,
+            Job.status.in_((JOB_QUEUED, JOB_RUNNING)),
+        )
+        .first()
+    )
+    if pending is None:
+        logger.warning("Product search index missing, queuing its build")
+        enqueue(REBUILD_TASK)
+
+
+def subcategory_product_ids(connection, subcategories=(), categories=()):
+    """
+    Ids of the products of subcategories and of the subcategories of
+    categories
+    """
+    subcategories = set(subcategories)
+    if categories:
+        subcategories.update(
+            subcategory_id
+            for (subcategory_id,) in connection.execute(
+                select(SubCategory.id).where(
+                    SubCategory.category_id.in_(categories)
+                )
+            )
+        )
+    if not subcategories:
+        return set()
+    return {
+        product_id
+        for (product_id,) in connection.execute(
+            select(Product.id).where(
+                Product.subcategory_id.in_(sorted(subcategories))
+            )
+        )
+    }
+
+
+def reindex_products(product_ids):
+    """
+    Reindexes products, in batches committed one after the other, when
+    the index is built
+
+    Returns
+    -------
+    int
+        number of products reindexed
+    """
+    index = get_index()
+    product_ids = sorted(product_ids)
+    if not index.ready(db.session.connection()):
+        return 0
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        ids = product_ids[start : start + BATCH_SIZE]
+        connection = db.session.connection()
+        documents = load_documents(connection, ids)
+        index.index(connection, documents, set(ids) - documents.keys())
+        db.session.commit()
+    return len(product_ids)
+
+
+def main(argv):
+    """
+    ``shopcube search-index``: builds the index, or rebuilds it after
+    the database was changed outside the app
+    """
+    from app import app
+
+    with app.app_context():
+        print(f"indexed {rebuild_index()} products")
+    return 0
+
+
+#
+# index maintenance
+#
+
+
+def mark_dirty(session, product_ids):
+    """
+    Reindexes products when the session commits, for changes made
+    without the unit of work e.g. bulk_insert_mappings
+    """
+    session.info.setdefault("search_dirty", set()).update(product_ids)
+
+
+def _history_values(state, key):
+    history = state.attrs[key].history
+    return [value for value in history.sum() if value is not None]
+
+
+def _changed(state, keys):
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty_products(session, flush_context):
+    dirty = set()
+    subcategories = set()
+    categories = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Product):
+            state = inspect(obj)
+            if obj in session.dirty and not _changed(
+                state, PRODUCT_ATTRIBUTES
+            ):
+                continue
+            dirty.add(obj.id)
+        elif isinstance(obj, (Color, Size)):
+            dirty.update(_history_values(inspect(obj), "product_id"))
+        elif isinstance(obj, SubCategory) and obj in session.dirty:
+            if _changed(inspect(obj), ("name",)):
+                subcategories.add(obj.id)
+        elif isinstance(obj, Category) and obj in session.dirty:
+            if _changed(inspect(obj), ("name",)):
+                categories.add(obj.id)
+    if dirty:
+        mark_dirty(session, dirty)
+    if subcategories:
+        session.info.setdefault("search_subcategories", set()).update(
+            subcategories
+        )
+    if categories:
+        session.info.setdefault("search_categories", set()).update(categories)
+
+
+@event.listens_for(Session, "before_commit")
+def _index_dirty_products(session):
+    if not has_app_context():
+        return
+    # before_commit runs before the commit flushes the pending changes
+    session.flush()
+    if not (
+        session.info.get("search_dirty")
+        or session.info.get("search_subcategories")
+        or session.info.get("search_categories")
+    ):
+        return
+    dirty = session.info.pop("search_dirty", set())
+    subcategories = session.info.pop("search_subcategories", set())
+    categories = session.info.pop("search_categories", set())
+
+    connection = session.connection()
+    index = get_index()
+    # rows changed while the index is missing are picked up by its build
+    if not index.ready(connection):
+        return
+    if subcategories or categories:
+        if not index.transactional:
+            session.info["search_stale"] = (subcategories, categories)
+        elif current_app.config.get("JOBS_RUN_INLINE"):
+            dirty.update(
+                subcategory_product_ids(connection, subcategories, categories)
+            )
+        else:
+            # a renamed category may hold any number of products, they
+            # are reindexed by a job queued in this transaction
+            session.add(
+                new_job(
+                    REINDEX_TASK,
+                    subcategories=sorted(subcategories),
+                    categories=sorted(categories),
+                )
+            )
+    if not dirty:
+        return
+
+    documents = load_documents(connection, dirty)
+    deleted = dirty - documents.keys()
+    if index.transactional:
+        index.index(connection, documents, deleted)
+    else:
+        session.info["search_pending"] = (documents, deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending_documents(session):
+    pending = session.info.pop("search_pending", None)
+    stale = session.info.pop("search_stale", None)
+    if (pending or stale) and has_app_context():
+        index = get_index()
+        if not index.built:
+            return
+        if pending is not None:
+            index.index(None, *pending)
+        if stale is not None:
+            index.mark_stale(*stale)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_dirty_products(session, previous_transaction):
+    for key in (
+        "search_dirty",
+        "search_subcategories",
+        "search_categories",
+        "search_pending",
+        "search_stale",
+    ):
+        session.info.pop(key, None)
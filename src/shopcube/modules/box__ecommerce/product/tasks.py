@@ -0,0 +1,28 @@
+from init import db
+
+from modules.box__default.jobs.helpers import task
+from modules.box__ecommerce.product.search import REBUILD_TASK
+from modules.box__ecommerce.product.search import REINDEX_TASK
+from modules.box__ecommerce.product.search import rebuild_index
+from modules.box__ecommerce.product.search import reindex_products
+from modules.box__ecommerce.product.search import subcategory_product_ids
+
+
+@task(REBUILD_TASK)
+def rebuild_search_index_job(ctx):
+    """
+    Builds the search index, or reindexes every product for databases
+    changed outside the app
+    """
+    return {"products": rebuild_index()}
+
+
+@task(REINDEX_TASK)
+def reindex_subcategories_job(ctx, subcategories=(), categories=()):
+    """
+    Reindexes the products of renamed categories and subcategories
+    """
+    product_ids = subcategory_product_ids(
+        db.session.connection(), subcategories, categories
+    )
+    return {"products": reindex_products(product_ids)}
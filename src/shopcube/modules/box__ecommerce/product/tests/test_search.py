@@ -0,0 +1,202 @@
+"""
+Tests the product search index of product/search.py, both with the
+FTS5 table and with the in-memory inverted index
+"""
+import pytest
+
+from init import db
+
+from modules.box__default.jobs.helpers import run_pending_jobs
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import Job
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Color
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
+from modules.box__ecommerce.product.search import REBUILD_TASK
+from modules.box__ecommerce.product.search import REINDEX_TASK
+from modules.box__ecommerce.product.search import InvertedIndex
+from modules.box__ecommerce.product.search import get_index
+from modules.box__ecommerce.product.search import mark_dirty
+from modules.box__ecommerce.product.search import rebuild_index
+from modules.box__ecommerce.product.search import search_products
+from modules.box__ecommerce.product.search import tokenize
+from modules.box__ecommerce.product.search import within_one_edit
+
+
+@pytest.fixture(params=["fts5", "memory"])
+def index_backend(request, flask_app, monkeypatch):
+    if request.param == "memory":
+        monkeypatch.setitem(
+            flask_app.extensions, "product_search", InvertedIndex()
+        )
+    else:
+        monkeypatch.delitem(
+            flask_app.extensions, "product_search", raising=False
+        )
+        monkeypatch.setitem(flask_app.config, "SEARCH_BACKEND", "fts5")
+    return request.param
+
+
+@pytest.fixture
+def products(index_backend):
+    category = Category(name="clothing")
+    subcategory = SubCategory(name="tops")
+    category.subcategories.append(subcategory)
+    shirt = Product(
+        barcode="search-1",
+        name="Linen shirt",
+        description="Light summer wear",
+        price=30,
+    )
+    shirt.colors.append(Color(name="navy"))
+    shirt.sizes.append(Size(name="XL"))
+    tee = Product(
+        barcode="search-2",
+        name="Cotton tee",
+        description="Goes well under a shirt",
+        price=10,
+    )
+    cafe = Product(barcode="search-3", name="Café crème mug", price=5)
+    subcategory.products.extend([shirt, tee, cafe])
+    category.save()
+    return subcategory
+
+
+@pytest.fixture
+def catalogue(products):
+    rebuild_index()
+    return products
+
+
+def names(query, **kwargs):
+    products, _ = search_products(query, **kwargs)
+    return [p.name for p in products]
+
+
+def test_tokenize_removes_accents():
+    assert tokenize("Café CRÈME, 2-pack") == ["cafe", "creme", "2", "pack"]
+
+
+@pytest.mark.parametrize(
+    "word, result",
+    [("shrit", True), ("shir", True), ("shirts", True), ("shorts", False)],
+)
+def test_within_one_edit(word, result):
+    assert within_one_edit("shirt", word) is result
+
+
+class TestProductSearch:
+    def test_name_ranks_above_description(self, catalogue):
+        assert names("shirt") == ["Linen shirt", "Cotton tee"]
+
+    def test_prefix(self, catalogue):
+        assert names("lin") == ["Linen shirt"]
+        assert names("cafe") == ["Café crème mug"]
+
+    def test_typo(self, catalogue):
+        assert names("cotton shrit") == ["Cotton tee"]
+        assert names("xyzzy") == []
+
+    def test_colors_sizes_and_categories(self, catalogue):
+        assert names("navy xl") == ["Linen shirt"]
+        assert len(names("clothing tops")) == 3
+
+    def test_fields(self, catalogue):
+        assert names("shirt", fields=["name"]) == ["Linen shirt"]
+
+    def test_pagination(self, catalogue):
+        first, has_next = search_products("clothing", per_page=2)
+        last, has_last_next = search_products("clothing", page=2, per_page=2)
+
+        assert has_next and not has_last_next
+        assert len(first) == 2 and len(last) == 1
+        assert not {p.id for p in first} & {p.id for p in last}
+
+    def test_new_product(self, catalogue):
+        assert names("boots") == []
+        catalogue.products.append(
+            Product(barcode="search-5", name="Rain boots", price=1)
+        )
+        db.session.commit()
+
+        assert names("boots") == ["Rain boots"]
+
+    def test_update_and_delete(self, catalogue):
+        shirt = Product.query.filter_by(barcode="search-1").one()
+        shirt.name = "Linen blouse"
+        db.session.commit()
+
+        assert names("blouse") == ["Linen blouse"]
+        assert names("linen shirt") == []
+
+        shirt.delete()
+        assert names("blouse") == []
+
+    def test_color_and_category_changes(self, catalogue, index_backend):
+        tee = Product.query.filter_by(barcode="search-2").one()
+        tee.colors.append(Color(name="olive"))
+        catalogue.name = "basics"
+        db.session.commit()
+        # only the tee is reindexed on commit, the other products of the
+        # subcategory by a job
+        if index_backend == "fts5":
+            assert names("basics") == ["Cotton tee"]
+            assert Job.query.filter_by(name=REINDEX_TASK).count() == 1
+            run_pending_jobs()
+
+        assert names("olive") == ["Cotton tee"]
+        assert len(names("basics")) == 3
+        assert names("tops") == []
+
+    def test_bulk_writes_marked_dirty(self, catalogue):
+        db.session.bulk_insert_mappings(
+            Product,
+            [
+                {
+                    "barcode": "search-4",
+                    "name": "Woollen scarf",
+                    "price": 1,
+                    "subcategory_id": catalogue.id,
+                }
+            ],
+        )
+        scarf = Product.query.filter_by(barcode="search-4").one()
+        mark_dirty(db.session, [scarf.id])
+        db.session.commit()
+
+        assert names("wool") == ["Woollen scarf"]
+
+    def test_commits_do_not_build_the_index(self, products, index_backend):
+        products.products.append(
+            Product(barcode="search-5", name="Rain boots", price=1)
+        )
+        db.session.commit()
+
+        index = get_index()
+        assert not index.ready(db.session.connection())
+        if index_backend == "fts5":
+            # the first search queues the build
+            assert names("boots") == []
+            assert names("shirt") == []
+            queued = Job.query.filter_by(name=REBUILD_TASK, status=JOB_QUEUED)
+            assert queued.count() == 1
+            run_pending_jobs()
+        assert names("boots") == ["Rain boots"]
+
+    def test_rebuild(self, catalogue):
+        assert rebuild_index() == Product.query.count()
+        assert names("shirt") == ["Linen shirt", "Cotton tee"]
+
+
+def test_search_json(test_client, catalogue):
+    first = test_client.get("/shop/search?q=clothing&per_page=2").get_json()
+    second = test_client.get(
+        f"/shop/search?q=clothing&per_page=2&page={first['next']}"
+    ).get_json()
+
+    assert len(first["products"]) == 2
+    assert [p["barcode"] for p in second["products"]]
+    assert second["next"] is None
+    assert test_client.get("/shop/search?q=x&fields=price").status_code == 400
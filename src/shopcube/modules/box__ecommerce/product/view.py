@@ -26,6 +26,10 @@ from modules.box__ecommerce.category.models import SubCategory
 from modules.box__ecommerce.product.models import Color
 from modules.box__ecommerce.product.models import Product
 from modules.box__ecommerce.product.models import Size
+from modules.box__ecommerce.product.search import search_product_ids
+
+# registers the search index jobs queued by product/search.py
+from modules.box__ecommerce.product import tasks  # noqa: F401 isort:skip
 
 dirpath = os.path.dirname(os.path.abspath(__file__))
 module_info = {}
@@ -59,6 +63,10 @@ class Productchema(ma.Schema):
 product_schema = Productchema()
 product_schema = Productchema(many=True)
 
+# lookup fields answered by the search index, others use LIKE
+SEARCH_INDEX_FIELDS = ("name", "description")
+LOOKUP_RESULTS = 100
+
 module_blueprint = globals()["{}_blueprint".format(module_info["module_name"])]
 
 module_name = module_info["module_name"]
@@ -300,24 +308,28 @@ def lookup(subcategory_id):
 )
 @login_required
 def search(subcategory_id, user_input):
-    if request.method == "GET":
-        subcategory = SubCategory.query.get(subcategory_id)
-        print(request.args["field"], request.args["global_search"])
-        field = request.args["field"]
-        global_search = request.args["global_search"]
-        if global_search == "True":
-            subcategory_name = subcategory.name
-            all_p = Product.query.filter(
-                (getattr(Product, field).like("%" + user_input + "%"))
-                & (Product.subcategory_name == subcategory_name)
-            ).all()
-            result = product_schema.dump(all_p)
-        else:
-            all_p = Product.query.filter(
-                getattr(Product, field).like("%" + user_input + "%")
-            ).all()
-            result = product_schema.dump(all_p)
-    return jsonify(result)
+    field = request.args["field"]
+    global_search = request.args["global_search"]
+    query = Product.query
+    if field in SEARCH_INDEX_FIELDS:
+        # ranked, prefix and typo tolerant matches from the search index
+        results, _ = search_product_ids(
+            user_input, per_page=LOOKUP_RESULTS, fields=[field]
+        )
+        ids = [product_id for product_id, _ in results]
+        rank = {product_id: i for i, product_id in enumerate(ids)}
+        query = query.filter(Product.id.in_(ids))
+    else:
+        rank = None
+        query = query.filter(
+            getattr(Product, field).like("%" + user_input + "%")
+        )
+    if global_search == "True":
+        query = query.filter(Product.subcategory_id == subcategory_id)
+    all_p = query.all()
+    if rank is not None:
+        all_p.sort(key=lambda product: rank[product.id])
+    return jsonify(product_schema.dump(all_p))
 
 
 # api
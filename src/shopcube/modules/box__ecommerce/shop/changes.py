@@ -0,0 +1,110 @@
+"""
+Storefront rows changed by a flush
+
+A product page shows the sizes, colors and images of the product, a
+category page the subcategories of the category and how many products
+they have. changed_rows maps the rows added, changed or deleted by a
+flush to the products, categories and subcategories whose pages they
+change, for the page cache tags (see page_tags.py) and for the versions
+of the rows, touched here so that the conditional GET validators of
+their pages change (see utils/conditional.py).
+"""
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from utils.conditional import touch_rows
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Color
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
+from modules.resource.models import Resource
+
+
+class ChangedRows:
+    """
+    Ids of the products, categories and subcategories whose pages
+    changed, and whether the listings of all products or categories did
+    """
+
+    def __init__(self):
+        self.products = set()
+        self.categories = set()
+        self.subcategories = set()
+        # a product was added, deleted or moved to another subcategory
+        self.product_listings = False
+        # a category or subcategory was added, deleted or changed
+        self.category_listings = False
+        # the category tree changed, see category/tree.py: the above, or
+        # a product or an image was added, deleted or moved
+        self.category_tree = False
+
+
+def _values(obj, key):
+    """
+    Values of an attribute before and after the flush
+    """
+    history = inspect(obj).attrs[key].history
+    return [value for value in history.sum() if value is not None]
+
+
+def changed_rows(session):
+    """
+    Rows whose pages are changed by the rows added, changed or deleted
+    by a flush
+
+    Returns
+    -------
+    ChangedRows
+    """
+    rows = ChangedRows()
+    image_products = set()
+    for obj in session.new | session.dirty | session.deleted:
+        added_or_deleted = obj in session.new or obj in session.deleted
+        if not added_or_deleted and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Product):
+            rows.products.add(obj.id)
+            moved = len(_values(obj, "subcategory_id")) > 1
+            if added_or_deleted or moved:
+                rows.product_listings = True
+                rows.category_tree = True
+                rows.subcategories.update(_values(obj, "subcategory_id"))
+        elif isinstance(obj, (Color, Size)):
+            rows.products.update(_values(obj, "product_id"))
+        elif isinstance(obj, Resource):
+            image_products.update(_values(obj, "product_id"))
+            rows.categories.update(_values(obj, "category_id"))
+            rows.subcategories.update(_values(obj, "subcategory_id"))
+            rows.category_tree = True
+        elif isinstance(obj, SubCategory):
+            rows.subcategories.add(obj.id)
+            rows.categories.update(_values(obj, "category_id"))
+            rows.category_listings = rows.category_tree = True
+        elif isinstance(obj, Category):
+            rows.categories.add(obj.id)
+            rows.category_listings = rows.category_tree = True
+    if image_products:
+        # the first image of a product is the cover of its subcategory
+        # on the category pages and the homepage, tagged with the
+        # category of the product, see category/tree.py
+        rows.products.update(image_products)
+        rows.categories.update(
+            session.execute(
+                select(SubCategory.category_id)
+                .join(Product, Product.subcategory_id == SubCategory.id)
+                .where(Product.id.in_(image_products))
+            ).scalars()
+        )
+    return rows
+
+
+@event.listens_for(Session, "after_flush")
+def _touch_changed_rows(session, flush_context):
+    rows = changed_rows(session)
+    touch_rows(session, Product, rows.products)
+    touch_rows(session, Category, rows.categories)
+    touch_rows(session, SubCategory, rows.subcategories)
@@ -1,33 +1,38 @@
+import base64
+import binascii
 import json
-import os
 
 from flask import session
 
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_
+from sqlalchemy import case
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+
+from init import db
+from utils.conditional import latest
 from utils.session import Cart
 
 from modules.box__default.settings.helpers import get_setting
 from modules.box__ecommerce.category.models import Category
 from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.category.tree import get_category_tree
+from modules.box__ecommerce.category.tree import tree_validators
 from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shopman.reference import currency_symbol
 
-dirpath = os.path.dirname(os.path.abspath(__file__))
-box_path = os.path.dirname(dirpath)
+PAGINATION = 5
+DEFAULT_MIN_MAX = [0, 2000]
 
 
 def get_currency_symbol():
-    curr_code = get_setting("CURRENCY")
-    with open(
-        os.path.join(
-            box_path,
-            "shopman",
-            "data",
-            "currency.json",
-        )
-    ) as f:
-        currencies = json.load(f)
-    for curr in currencies:
-        if curr["cc"] == curr_code:
-            return curr["symbol"]
+    """
+    Symbol of the CURRENCY setting, both being kept in memory, so that it
+    follows a change of currency at once
+    """
+    return currency_symbol(get_setting("CURRENCY"))
 
 
 def get_cart_data():
@@ -40,13 +45,330 @@ def get_cart_data():
 
 
 def get_min_max_subcateg(subcategory_name):
-    subcateg = SubCategory.query.filter(
-        SubCategory.name == subcategory_name
-    ).first()
-    if len(subcateg.products) > 0:
-        min_price = min(p.selling_price for p in subcateg.products)
-        max_price = max(p.selling_price for p in subcateg.products)
+    min_price, max_price = (
+        Product.query.join(SubCategory)
+        .filter(SubCategory.name == subcategory_name)
+        .with_entities(
+            func.min(Product.selling_price), func.max(Product.selling_price)
+        )
+        .one()
+    )
+    if min_price is None or max_price is None:
+        return list(DEFAULT_MIN_MAX)
+    return [min_price, max_price]
+
+
+def get_price_filter(args):
+    """
+    Reads the min and max price filter from query arguments
+
+    Parameters
+    ----------
+    args: dict
+        request arguments, normally request.args
+
+    Returns
+    -------
+    list or None
+        [min_price, max_price] if both are valid numbers else None
+    """
+    min_price = args.get("min")
+    max_price = args.get("max")
+    if not (min_price and max_price):
+        return None
+    if not (min_price.isnumeric() and max_price.isnumeric()):
+        return None
+    return [int(min_price), int(max_price)]
+
+
+def paginate_products(query, page, per_page=PAGINATION, price_filter=None):
+    """
+    Paginates a product query inside the database. The total count of
+    matching products and the price bounds of the unfiltered query are
+    computed in a single aggregate query and the page itself is fetched
+    with LIMIT/OFFSET, so the cost does not depend on catalogue size
+
+    Parameters
+    ----------
+    query: flask_sqlalchemy.BaseQuery
+        product query, optionally already filtered (eg by subcategory)
+    page: int
+        page number, starting at 1
+    per_page: int
+        number of products per page
+    price_filter: list
+        [min_price, max_price] to filter selling price on, or None
+
+    Returns
+    -------
+    tuple
+        (Pagination of products, [min_price, max_price] of the query)
+    """
+    page = max(page, 1)
+    selling_price = Product.selling_price
+
+    if price_filter is None:
+        matching = func.count(Product.id)
+        filtered_query = query
+    else:
+        in_range = selling_price.between(*price_filter)
+        matching = func.sum(case((in_range, 1), else_=0))
+        filtered_query = query.filter(in_range)
+
+    total, min_price, max_price = (
+        query.order_by(None)
+        .with_entities(
+            matching, func.min(selling_price), func.max(selling_price)
+        )
+        .one()
+    )
+    total = total or 0
+
+    if min_price is None or max_price is None:
+        min_max = list(DEFAULT_MIN_MAX)
     else:
-        min_price = 0
-        max_price = 2000
+        min_max = [min_price, max_price]
+
+    items = []
+    if total > (page - 1) * per_page:
+        items = (
+            filtered_query.order_by(Product.id.desc())
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+            .all()
+        )
+
+    pagination = Pagination(filtered_query, page, per_page, total, items)
+    return pagination, min_max
+
+
+def price_bounds(query):
+    """
+    Lowest and highest selling price of a product query, in one
+    aggregate query, for the price filter slider
+
+    Returns
+    -------
+    list
+        [min_price, max_price], DEFAULT_MIN_MAX if no product has a
+        price
+    """
+    min_price, max_price = (
+        query.order_by(None)
+        .with_entities(
+            func.min(Product.selling_price), func.max(Product.selling_price)
+        )
+        .one()
+    )
+    if min_price is None or max_price is None:
+        return list(DEFAULT_MIN_MAX)
     return [min_price, max_price]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a listing cursor cannot be decoded"""
+
+
+def encode_cursor(values):
+    """
+    Encodes the sort key of the last product of a page into an opaque
+    url safe string
+
+    Parameters
+    ----------
+    values: list
+        sort key values, eg [selling_price, id]
+
+    Returns
+    -------
+    str
+        cursor
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """
+    Decodes a cursor made by encode_cursor
+
+    Parameters
+    ----------
+    cursor: str
+        cursor string
+    length: int
+        number of values the sort key is expected to have
+
+    Returns
+    -------
+    list
+        sort key values
+
+    Raises
+    ------
+    InvalidCursor
+        if the cursor was tampered with or belongs to another sort
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if (
+        not isinstance(values, list)
+        or len(values) != length
+        or not all(
+            isinstance(v, (int, float)) and not isinstance(v, bool)
+            for v in values
+        )
+    ):
+        raise InvalidCursor(cursor)
+    return values
+
+
+KEYSET_SORTS = ("new", "price")
+
+
+def keyset_paginate_products(
+    query, cursor=None, per_page=PAGINATION, sort="new", price_filter=None
+):
+    """
+    Cursor based pagination of a product query. Instead of skipping rows
+    with OFFSET, the next page starts right after the sort key of the
+    last product seen, so deep pages cost the same as the first one
+
+    Parameters
+    ----------
+    query: flask_sqlalchemy.BaseQuery
+        product query, optionally already filtered (eg by subcategory)
+    cursor: str
+        cursor returned for the previous page, None for the first page
+    per_page: int
+        number of products per page
+    sort: str
+        "new" for newest first, keyed on id, or "price" for cheapest
+        first, keyed on (selling_price IS NULL, selling_price, id) so
+        that the products without a selling price come last
+    price_filter: list
+        [min_price, max_price] to filter selling price on, or None
+
+    Returns
+    -------
+    tuple
+        (list of products, cursor of the next page or None)
+
+    Raises
+    ------
+    InvalidCursor
+        if the cursor cannot be decoded for this sort
+    """
+    if sort not in KEYSET_SORTS:
+        raise ValueError(
+            f"unknown sort {sort}, expected one of {KEYSET_SORTS}"
+        )
+
+    price = Product.selling_price
+
+    if price_filter is not None:
+        query = query.filter(Product.selling_price.between(*price_filter))
+
+    if sort == "new":
+        if cursor is not None:
+            (last_id,) = decode_cursor(cursor, 1)
+            query = query.filter(Product.id < last_id)
+        query = query.order_by(Product.id.desc())
+    else:
+        no_price = price.is_(None)
+        if cursor is not None:
+            last_no_price, last_price, last_id = decode_cursor(cursor, 3)
+            if last_no_price:
+                query = query.filter(no_price, Product.id > last_id)
+            else:
+                query = query.filter(
+                    or_(
+                        price > last_price,
+                        and_(price == last_price, Product.id > last_id),
+                        no_price,
+                    )
+                )
+        query = query.order_by(no_price, price.asc(), Product.id.asc())
+
+    # fetch one extra row to know whether there is a next page
+    rows = (
+        query.options(selectinload(Product.resources))
+        .limit(per_page + 1)
+        .all()
+    )
+    products = rows[:per_page]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last = products[-1]
+        if sort == "new":
+            next_cursor = encode_cursor([last.id])
+        else:
+            next_cursor = encode_cursor(
+                [1, 0, last.id]
+                if last.selling_price is None
+                else [0, last.selling_price, last.id]
+            )
+
+    return products, next_cursor
+
+
+def product_card_data(product):
+    """
+    Minimal product representation used by the json listings
+    """
+    return {
+        "barcode": product.barcode,
+        "name": product.name,
+        "selling_price": product.selling_price,
+        "in_stock": product.in_stock,
+        "url": product.get_page_url(),
+        "image_url": product.get_one_image_url(),
+    }
+
+
+def product_validators(product_barcode):
+    """
+    Conditional GET validators of a product page, see
+    utils/conditional.py: the product and the subcategory and category
+    of its breadcrumb, and the category tree of the menu. Sizes, colors
+    and images touch the product
+    """
+    row = (
+        db.session.query(
+            Product.id,
+            Product.version,
+            Product.updated_at,
+            SubCategory.version,
+            SubCategory.updated_at,
+            Category.version,
+            Category.updated_at,
+        )
+        .join(SubCategory, Product.subcategory_id == SubCategory.id)
+        .join(Category, SubCategory.category_id == Category.id)
+        .filter(Product.barcode == product_barcode)
+        .first()
+    )
+    if row is None:
+        return None
+    tree, tree_updated_at = tree_validators()
+    return (
+        [row[0], row[1], row[3], row[5], tree],
+        latest(row[2], row[4], row[6], tree_updated_at),
+    )
+
+
+def category_validators(category_name):
+    """
+    Conditional GET validators of a category page, see
+    utils/conditional.py. The page is rendered from the category tree
+    snapshot, see category/tree.py
+    """
+    tree, updated_at = tree_validators()
+    category = get_category_tree().by_name(category_name)
+    if category is None:
+        return None
+    return [category.id, tree], updated_at
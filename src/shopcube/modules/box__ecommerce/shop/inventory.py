@@ -0,0 +1,324 @@
+"""
+Stock of the products sold by the shop.
+
+Stock is taken for all the lines of a cart at once by a single
+conditional UPDATE, decrementing product.in_stock only if every product
+has enough left, so that concurrent checkouts can neither sell the same
+items twice nor lose each other's decrements. in_stock is thus what is
+left to sell.
+
+The checkout page reserves the stock of the cart for
+STOCK_RESERVATION_TTL seconds, StockReservation rows recording what was
+taken. Placing the order keeps the stock taken, abandoned reservations
+are given back once expired, by the shop.release_expired_reservations
+job (see tasks.py) and before every new reservation.
+"""
+import uuid
+from collections import Counter
+from datetime import datetime
+from datetime import timedelta
+
+from flask import current_app
+
+from sqlalchemy import case
+from sqlalchemy import func
+from sqlalchemy import select
+
+from init import db
+from utils.page_cache import purge_on_commit
+
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.models import StockReservation
+from modules.box__ecommerce.shop.page_tags import product_tag
+
+
+class OutOfStock(ValueError):
+    """
+    Raised when some products do not have enough stock left
+
+    Parameters
+    ----------
+    products: list
+        Product short of stock
+    """
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__(", ".join(p.name or p.barcode for p in products))
+
+
+def cart_lines(products, items):
+    """
+    Quantities to take from the stock for a cart
+
+    Parameters
+    ----------
+    products: dict
+        barcode -> Product or None, as Cart.products
+    items: dict
+        barcode -> cart items, as Cart.data()["items"]
+
+    Returns
+    -------
+    dict
+        product id -> quantity
+    """
+    lines = Counter()
+    for barcode, product in products.items():
+        if product is None:
+            continue
+        for item in items.get(barcode, ()):
+            lines[product.id] += int(item["quantity"])
+    return {i: quantity for i, quantity in lines.items() if quantity > 0}
+
+
+def _change_stock(lines, take):
+    """
+    Takes or gives back the quantities of lines in one UPDATE, taking
+    only if all the products have enough stock
+
+    Returns
+    -------
+    int
+        number of products updated
+    """
+    table = Product.__table__
+    ids = sorted(lines)
+    quantity = case(lines, value=table.c.id)
+    statement = table.update().where(table.c.id.in_(ids))
+    if take:
+        other = table.alias()
+        enough = (
+            select(func.count())
+            .select_from(other)
+            .where(
+                other.c.id.in_(ids),
+                other.c.in_stock >= case(lines, value=other.c.id),
+            )
+            .scalar_subquery()
+        )
+        # the first condition guards each row against the decrements
+        # committed meanwhile by concurrent checkouts
+        statement = statement.where(
+            table.c.in_stock >= quantity, enough == len(ids)
+        ).values(in_stock=table.c.in_stock - quantity)
+    else:
+        statement = statement.values(in_stock=table.c.in_stock + quantity)
+    updated = db.session.execute(statement).rowcount
+    # product pages show the stock, the version of the rows is bumped by
+    # the UPDATE itself for their conditional GET
+    purge_on_commit(db.session, {product_tag(i) for i in lines})
+    return updated
+
+
+def take_stock(lines):
+    """
+    Takes the stock of all the lines or none. Should a concurrent
+    checkout take some of the stock while this one runs, the session is
+    rolled back
+
+    Parameters
+    ----------
+    lines: dict
+        product id -> quantity
+
+    Raises
+    ------
+    OutOfStock
+    ValueError
+        if a quantity is below 1, which would add to the stock
+    """
+    if not lines:
+        return
+    if any(quantity < 1 for quantity in lines.values()):
+        raise ValueError("Quantities taken from the stock must be positive")
+    updated = _change_stock(lines, take=True)
+    if updated == len(lines):
+        return
+    if updated:
+        db.session.rollback()
+    products = (
+        Product.query.filter(Product.id.in_(sorted(lines)))
+        .order_by(Product.id)
+        .populate_existing()
+        .all()
+    )
+    short = [p for p in products if (p.in_stock or 0) < lines[p.id]]
+    # the stock may have been given back since
+    raise OutOfStock(short or products)
+
+
+def give_back_stock(lines):
+    if lines:
+        _change_stock(lines, take=False)
+
+
+def _claim(reservations):
+    """
+    Deletes reservations, returning what they held, or None if another
+    process claimed some of them first, the session having then to be
+    rolled back
+
+    Returns
+    -------
+    dict
+        product id -> quantity
+    """
+    if not reservations:
+        return {}
+    table = StockReservation.__table__
+    ids = [r.id for r in reservations]
+    deleted = db.session.execute(
+        table.delete().where(table.c.id.in_(ids))
+    ).rowcount
+    if deleted != len(ids):
+        return None
+    return _held_lines(reservations)
+
+
+def _held(token, now=None):
+    query = select(
+        StockReservation.id,
+        StockReservation.product_id,
+        StockReservation.quantity,
+    ).where(StockReservation.token == token)
+    if now is not None:
+        query = query.where(StockReservation.expires_at > now)
+    return db.session.execute(query).all()
+
+
+def _held_lines(held):
+    lines = Counter()
+    for reservation in held:
+        lines[reservation.product_id] += reservation.quantity
+    return dict(lines)
+
+
+def _extend(held, expires_at):
+    """
+    Pushes back the expiry of a reservation still held in full
+    """
+    table = StockReservation.__table__
+    extended = db.session.execute(
+        table.update()
+        .where(table.c.id.in_([r.id for r in held]))
+        .where(table.c.expires_at > datetime.now())
+        .values(expires_at=expires_at)
+    ).rowcount
+    return extended == len(held)
+
+
+def release_reservation(token):
+    """
+    Gives back the stock held by a reservation, if not already done
+    """
+    if token is None:
+        return
+    lines = _claim(_held(token))
+    if lines is None:
+        # released meanwhile by another process
+        db.session.rollback()
+        return
+    give_back_stock(lines)
+
+
+def reserve_stock(lines, token=None):
+    """
+    Reserves the stock of a cart for STOCK_RESERVATION_TTL seconds. The
+    previous reservation of the visitor is only extended when it still
+    holds the same lines, so that reloading the checkout page leaves the
+    stock, and the pages showing it, alone. Otherwise it is replaced,
+    the caller then commits and calls tasks.schedule_release
+
+    Parameters
+    ----------
+    lines: dict
+        product id -> quantity
+    token: str
+        previous reservation of the visitor
+
+    Returns
+    -------
+    str
+        token of the reservation, the previous one if extended
+
+    Raises
+    ------
+    OutOfStock
+    """
+    ttl = current_app.config.get("STOCK_RESERVATION_TTL", 900)
+    expires_at = datetime.now() + timedelta(seconds=ttl)
+    if token is not None and lines:
+        held = _held(token, now=datetime.now())
+        if _held_lines(held) == lines and _extend(held, expires_at):
+            return token
+
+    release_expired_reservations(commit=False)
+    release_reservation(token)
+    take_stock(lines)
+
+    token = uuid.uuid4().hex
+    if lines:
+        db.session.execute(
+            StockReservation.__table__.insert(),
+            [
+                {
+                    "token": token,
+                    "product_id": product_id,
+                    "quantity": quantity,
+                    "expires_at": expires_at,
+                }
+                for product_id, quantity in lines.items()
+            ],
+        )
+    return token
+
+
+def take_reserved_stock(token, lines):
+    """
+    Takes the stock of an order, using the reservation made for it when
+    it is still held and for the same lines, taking the stock anew
+    otherwise. Must be called before the order is added to the session,
+    which may be rolled back
+
+    Raises
+    ------
+    OutOfStock
+    """
+    held = _held(token, now=datetime.now()) if token else []
+    if held and _held_lines(held) == lines:
+        if _claim(held) is not None:
+            return
+        # expired and released meanwhile by another process
+        db.session.rollback()
+    else:
+        release_reservation(token)
+    take_stock(lines)
+
+
+def release_expired_reservations(now=None, commit=True):
+    """
+    Gives back the stock of the reservations expired by now
+
+    Returns
+    -------
+    int
+        number of reservations released
+    """
+    now = now or datetime.now()
+    expired = db.session.execute(
+        select(
+            StockReservation.id,
+            StockReservation.product_id,
+            StockReservation.quantity,
+        ).where(StockReservation.expires_at <= now)
+    ).all()
+    lines = _claim(expired)
+    if lines is None:
+        # released meanwhile by another process
+        db.session.rollback()
+        return 0
+    give_back_stock(lines)
+    if commit:
+        db.session.commit()
+    return len(expired)
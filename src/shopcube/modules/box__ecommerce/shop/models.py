@@ -1,17 +1,30 @@
 from datetime import datetime
 
 from shopyo.api.models import PkModel
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from init import db
+from utils.indexes import hot_path_index
 
 from modules.box__ecommerce.product.models import Product
 
 
 class Order(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        # order dashboard filters and sorting
+        db.Index("ix_orders_status_time", "status", "time"),
+        db.Index("ix_orders_time", "time"),
+        # orders of a customer
+        hot_path_index(
+            "ix_orders_logged_in_customer_email", "logged_in_customer_email"
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    time = db.Column(db.DateTime, default=datetime.now())
+    time = db.Column(db.DateTime, default=datetime.now)
 
     logged_in_customer_email = db.Column(db.String(120), default="")
 
@@ -36,6 +49,9 @@ class Order(db.Model):
         db.String(120), default="pending"
     )  # pending, confirmed, shipped, cancelled, refunded
 
+    # sum of the order items at checkout, shipping excluded
+    total_amount = db.Column(db.Float, nullable=True)
+
     payment_option_name = db.Column(db.String(120))
     payment_option_text = db.Column(db.String(120))
 
@@ -73,20 +89,33 @@ class Order(db.Model):
     def get_ref(self):
         return f"{int(self.id) * 19}#{self.get_std_formatted_time()}"
 
+    def compute_total_amount(self):
+        return sum(item.get_total() for item in self.order_items)
+
     def get_total_amount(self):
-        prices = []
-        for item in self.order_items:
-            product = item.get_product()
-            price = product.selling_price * item.quantity
-            prices.append(price)
-        total_prices = sum(prices)
-        return total_prices
+        if self.total_amount is not None:
+            return self.total_amount
+        # orders placed before totals were stored
+        return self.compute_total_amount()
+
+    @staticmethod
+    def load_details():
+        """
+        Loader options fetching the items of a set of orders with their
+        products and billing details in a constant number of queries
+
+        Example: Order.query.options(*Order.load_details()).all()
+        """
+        return (
+            selectinload(Order.order_items).joinedload(OrderItem.product),
+            joinedload(Order.billing_detail),
+        )
 
 
 class OrderItem(PkModel):
     __tablename__ = "order_items"
 
-    time = db.Column(db.DateTime, default=datetime.now())
+    time = db.Column(db.DateTime, default=datetime.now)
     quantity = db.Column(db.Integer)
     color = db.Column(db.String(100))
     size = db.Column(db.String(100))
@@ -96,6 +125,17 @@ class OrderItem(PkModel):
         db.Integer, db.ForeignKey("orders.id"), nullable=False
     )
 
+    # product as it was at checkout
+    product_name = db.Column(db.String(100))
+    unit_price = db.Column(db.Float)
+
+    product = db.relationship(
+        Product,
+        primaryjoin="foreign(OrderItem.barcode) == Product.barcode",
+        uselist=False,
+        viewonly=True,
+    )
+
     def add(self):
         db.session.add(self)
 
@@ -111,11 +151,40 @@ class OrderItem(PkModel):
         db.session.commit()
 
     def get_product(self):
-        return Product.query.filter_by(barcode=self.barcode).first()
+        return self.product
+
+    def snapshot(self, product):
+        """
+        Copies the name and selling price of the product on the item so
+        that the order is unaffected by later product changes
+        """
+        self.barcode = product.barcode
+        self.product_name = product.name
+        self.unit_price = product.selling_price
+        set_committed_value(self, "product", product)
+
+    def get_name(self):
+        if self.product_name is not None:
+            return self.product_name
+        return self.product.name if self.product else ""
+
+    def get_unit_price(self):
+        if self.unit_price is not None:
+            return self.unit_price
+        if self.product is None or self.product.selling_price is None:
+            return 0
+        return self.product.selling_price
+
+    def get_total(self):
+        return self.get_unit_price() * self.quantity
 
 
 class BillingDetail(db.Model):
     __tablename__ = "billing_details"
+    __table_args__ = (
+        # guest orders of a customer, order dashboard email filter
+        hot_path_index("ix_billing_details_email", "email"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -143,3 +212,22 @@ class BillingDetail(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+
+
+class StockReservation(PkModel):
+    """
+    Stock taken for the cart of a visitor going through the checkout,
+    given back when the checkout is not completed by expires_at, see
+    inventory.py. token identifies the reservation in the session
+    """
+
+    __tablename__ = "stock_reservations"
+
+    token = db.Column(db.String(32), nullable=False, index=True)
+    product_id = db.Column(
+        db.Integer,
+        db.ForeignKey("product.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
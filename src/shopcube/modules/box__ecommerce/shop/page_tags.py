@@ -0,0 +1,78 @@
+"""
+Tags of the storefront pages in the page cache, see utils/page_cache.py
+
+A page rendered for the cache is tagged with every product, category
+and subcategory loaded while rendering it. Listings whose content
+changes when a product or a category is added or removed are tagged
+with PRODUCTS_TAG or CATEGORIES_TAG by the functions building them.
+
+When a commit changes products, their sizes, colors or images,
+categories or subcategories, the tags of the rows whose pages changed,
+see changes.py, are purged, so only the pages showing them are rendered
+again.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.page_cache import purge_on_commit
+from utils.page_cache import tag_page
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.changes import changed_rows
+
+# listings of all the products, e.g. the latest products
+PRODUCTS_TAG = "products"
+# listings of all the categories, e.g. the navigation menu
+CATEGORIES_TAG = "categories"
+
+
+def product_tag(product_id):
+    return f"product:{product_id}"
+
+
+def category_tag(category_id):
+    return f"category:{category_id}"
+
+
+def subcategory_tag(subcategory_id):
+    return f"subcategory:{subcategory_id}"
+
+
+TAGS_OF_MODEL = {
+    Product: product_tag,
+    Category: category_tag,
+    SubCategory: subcategory_tag,
+}
+
+
+def _tag_loaded(target, *args):
+    tag_page(TAGS_OF_MODEL[type(target)](target.id))
+
+
+for model in TAGS_OF_MODEL:
+    event.listen(model, "load", _tag_loaded)
+    event.listen(model, "refresh", _tag_loaded)
+
+
+def changed_tags(session):
+    """
+    Tags of the rows added, changed or deleted by a flush
+    """
+    rows = changed_rows(session)
+    tags = set(product_tag(i) for i in rows.products)
+    tags.update(category_tag(i) for i in rows.categories)
+    tags.update(subcategory_tag(i) for i in rows.subcategories)
+    if rows.product_listings:
+        tags.add(PRODUCTS_TAG)
+    if rows.category_listings:
+        tags.add(CATEGORIES_TAG)
+    return tags
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_tags(session, flush_context):
+    tags = changed_tags(session)
+    if tags:
+        purge_on_commit(session, tags)
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from flask import current_app
+
+from sqlalchemy import func
+
+from init import db
+
+from modules.box__default.jobs.helpers import task
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import Job
+from modules.box__ecommerce.shop.inventory import release_expired_reservations
+from modules.box__ecommerce.shop.models import StockReservation
+
+RELEASE_TASK = "shop.release_expired_reservations"
+
+
+@task(RELEASE_TASK)
+def release_expired_reservations_job(ctx):
+    """
+    Gives back the stock of the expired reservations, then queues itself
+    for the next reservation to expire
+    """
+    released = release_expired_reservations()
+    # run inline, the next job would run at once
+    if not current_app.config.get("JOBS_RUN_INLINE"):
+        schedule_release()
+    return {"released": released}
+
+
+def schedule_release():
+    """
+    Makes sure a job will give back the stock of the reservations when
+    they expire, one job being queued at a time
+    """
+    queued = (
+        db.session.query(Job.id)
+        .filter(Job.name == RELEASE_TASK, Job.status == JOB_QUEUED)
+        .first()
+    )
+    if queued is not None:
+        return
+    next_expiry = db.session.query(
+        func.min(StockReservation.expires_at)
+    ).scalar()
+    if next_expiry is None:
+        return
+    delay = (next_expiry - datetime.now()).total_seconds()
+    release_expired_reservations_job.enqueue(delay=max(int(delay) + 1, 0))
@@ -0,0 +1,144 @@
+"""
+This file (test_conditional_get.py) contains the functional tests of
+the conditional GET of the storefront pages, see utils/conditional.py
+"""
+import datetime
+
+import pytest
+from werkzeug.http import http_date
+
+from init import db
+
+from modules.box__default.settings.helpers import bump_settings_version
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.models import Size
+
+
+@pytest.fixture
+def client(flask_app):
+    # own cookies, so an empty session
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def product(db_session):
+    category = Category(name="conditional")
+    subcategory = SubCategory(name="conditional boots")
+    subcategory.products.append(
+        Product(
+            barcode="conditional-1",
+            name="Conditional 1",
+            price=10,
+            selling_price=10,
+            in_stock=10,
+        )
+    )
+    category.subcategories.append(subcategory)
+    category.save()
+    return subcategory.products[0].id
+
+
+def revalidate(client, url, response):
+    return client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+
+
+class TestProductPage:
+    url = "/shop/product/conditional-1"
+
+    def test_not_modified(self, client, product):
+        first = client.get(self.url)
+        second = revalidate(client, self.url, first)
+
+        assert first.status_code == 200
+        assert first.headers["ETag"].startswith('W/"')
+        assert "no-cache" in first.headers["Cache-Control"]
+        assert second.status_code == 304
+        assert second.data == b""
+        assert second.headers["ETag"] == first.headers["ETag"]
+
+    def test_product_edit(self, client, product):
+        first = client.get(self.url)
+        Product.query.get(product).name = "Renamed conditional 1"
+        db.session.commit()
+
+        second = revalidate(client, self.url, first)
+        assert second.status_code == 200
+        assert b"Renamed conditional 1" in second.data
+        assert Product.query.get(product).version == 2
+
+    def test_new_size_touches_the_product(self, client, product):
+        first = client.get(self.url)
+        db.session.add(Size(name="44", product_id=product))
+        db.session.commit()
+
+        assert revalidate(client, self.url, first).status_code == 200
+
+    def test_menu_change(self, client, product):
+        first = client.get(self.url)
+        category = Category(name="conditional men")
+        category.subcategories.append(SubCategory(name="conditional hats"))
+        category.save()
+
+        # the menu of the page lists the subcategories of all categories
+        assert revalidate(client, self.url, first).status_code == 200
+
+    def test_settings_change(self, client, product):
+        first = client.get(self.url)
+        bump_settings_version()
+
+        assert revalidate(client, self.url, first).status_code == 200
+
+    def test_cart_change(self, client, product):
+        first = client.get(self.url)
+        client.post(
+            "/shop/cart/add/conditional-1",
+            data={
+                "barcode": "conditional-1",
+                "quantity": 1,
+                "size": "",
+                "color": "",
+            },
+        )
+
+        response = revalidate(client, self.url, first)
+        assert response.status_code == 200
+        # the session is no longer empty
+        assert "Last-Modified" not in response.headers
+
+    def test_if_modified_since(self, client, product):
+        first = client.get(self.url)
+        last_modified = first.headers["Last-Modified"]
+        earlier = http_date(
+            first.last_modified - datetime.timedelta(seconds=1)
+        )
+
+        response = client.get(
+            self.url, headers={"If-Modified-Since": last_modified}
+        )
+        assert response.status_code == 304
+        response = client.get(self.url, headers={"If-Modified-Since": earlier})
+        assert response.status_code == 200
+
+
+def test_category_page_new_product(client, product):
+    url = "/shop/c/conditional"
+    first = client.get(url)
+    assert revalidate(client, url, first).status_code == 304
+
+    subcategory = Product.query.get(product).subcategory
+    subcategory.products.append(
+        Product(barcode="conditional-2", name="Conditional 2", price=1)
+    )
+    db.session.commit()
+
+    assert revalidate(client, url, first).status_code == 200
+
+
+def test_product_image_not_modified(client):
+    url = "/resource/product/default"
+    first = client.get(url)
+
+    assert first.headers["ETag"]
+    assert revalidate(client, url, first).status_code == 304
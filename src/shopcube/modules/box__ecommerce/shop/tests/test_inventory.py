@@ -0,0 +1,217 @@
+"""
+This file (test_inventory.py) contains the tests of the stock taken at
+checkout, see shop/inventory.py
+"""
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+from init import db
+
+from modules.box__default.jobs.models import JOB_QUEUED
+from modules.box__default.jobs.models import Job
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.inventory import OutOfStock
+from modules.box__ecommerce.shop.inventory import release_expired_reservations
+from modules.box__ecommerce.shop.inventory import reserve_stock
+from modules.box__ecommerce.shop.inventory import take_reserved_stock
+from modules.box__ecommerce.shop.inventory import take_stock
+from modules.box__ecommerce.shop.models import StockReservation
+from modules.box__ecommerce.shop.tasks import RELEASE_TASK
+from modules.box__ecommerce.shop.tasks import schedule_release
+
+
+@pytest.fixture
+def products(db_session):
+    """
+    Two products, 5 and 2 in stock
+    """
+    category = Category(name="inventory")
+    subcategory = SubCategory(name="inventory boots")
+    for i, in_stock in ((1, 5), (2, 2)):
+        subcategory.products.append(
+            Product(
+                barcode=f"inventory-{i}",
+                name=f"Inventory {i}",
+                price=10,
+                selling_price=10,
+                in_stock=in_stock,
+            )
+        )
+    category.subcategories.append(subcategory)
+    category.save()
+    return [p.id for p in subcategory.products]
+
+
+def stock(product_id):
+    return db.session.query(Product.in_stock).filter_by(id=product_id).scalar()
+
+
+def test_take_stock_in_one_statement(products):
+    first, second = products
+    statements = []
+
+    def count_updates(conn, cursor, statement, *args):
+        if statement.lstrip().startswith("UPDATE product"):
+            statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count_updates)
+    try:
+        take_stock({first: 3, second: 2})
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count_updates)
+    db.session.commit()
+
+    assert len(statements) == 1
+    assert stock(first) == 2
+    assert stock(second) == 0
+    # the conditional GET of the product pages sees the change
+    assert Product.query.get(first).version == 2
+
+
+def test_take_stock_all_or_nothing(products):
+    first, second = products
+
+    with pytest.raises(OutOfStock) as error:
+        take_stock({first: 3, second: 3})
+
+    assert [p.id for p in error.value.products] == [second]
+    assert stock(first) == 5
+    assert stock(second) == 2
+
+
+def test_reservation_taken_by_the_order(products):
+    first, second = products
+    token = reserve_stock({first: 2})
+    db.session.commit()
+    assert stock(first) == 3
+
+    take_reserved_stock(token, {first: 2})
+    db.session.commit()
+
+    assert stock(first) == 3
+    assert StockReservation.query.filter_by(token=token).count() == 0
+
+
+def test_reservation_of_a_changed_cart(products):
+    first, second = products
+    token = reserve_stock({first: 2})
+    db.session.commit()
+
+    take_reserved_stock(token, {first: 1, second: 1})
+    db.session.commit()
+
+    assert stock(first) == 4
+    assert stock(second) == 1
+    assert StockReservation.query.filter_by(token=token).count() == 0
+
+
+def test_expired_reservations_released(products):
+    first, second = products
+    token = reserve_stock({first: 2, second: 2})
+    db.session.commit()
+    assert stock(second) == 0
+
+    assert release_expired_reservations() == 0
+    later = datetime.now() + timedelta(days=1)
+    assert release_expired_reservations(now=later) == 2
+
+    assert stock(first) == 5
+    assert stock(second) == 2
+    # too late, the stock is taken anew
+    take_reserved_stock(token, {first: 2, second: 2})
+    assert stock(second) == 0
+
+
+def test_checkout_holds_the_stock(flask_app, products):
+    first, second = products
+    client = flask_app.test_client()
+    client.post(
+        "/shop/cart/add/inventory-1",
+        data={
+            "barcode": "inventory-1",
+            "quantity": 2,
+            "size": "",
+            "color": "",
+        },
+    )
+
+    assert client.get("/shop/checkout").status_code == 200
+    assert stock(first) == 3
+    with client.session_transaction() as session:
+        token = session["stock_reservation"]
+    version = Product.query.get(first).version
+    reservation = StockReservation.query.filter_by(token=token).one()
+    expires_at = reservation.expires_at
+
+    # the reservation is only extended, the product left alone
+    assert client.get("/shop/checkout").status_code == 200
+    with client.session_transaction() as session:
+        assert session["stock_reservation"] == token
+    db.session.expire_all()
+    assert stock(first) == 3
+    assert Product.query.get(first).version == version
+    assert StockReservation.query.get(reservation.id).expires_at > expires_at
+
+    # a changed cart is reserved anew
+    client.post(
+        "/shop/cart/add/inventory-1",
+        data={
+            "barcode": "inventory-1",
+            "quantity": 1,
+            "size": "",
+            "color": "",
+        },
+    )
+    assert client.get("/shop/checkout").status_code == 200
+    assert stock(first) == 2
+    with client.session_transaction() as session:
+        assert session["stock_reservation"] != token
+    assert StockReservation.query.filter_by(token=token).count() == 0
+
+
+def test_checkout_short_of_stock(flask_app, products):
+    first, second = products
+    client = flask_app.test_client()
+    client.post(
+        "/shop/cart/add/inventory-2",
+        data={
+            "barcode": "inventory-2",
+            "quantity": 2,
+            "size": "",
+            "color": "",
+        },
+    )
+    take_stock({second: 1})
+    db.session.commit()
+
+    response = client.get("/shop/checkout")
+
+    assert response.status_code == 302
+    assert response.location.endswith("/shop/cart")
+    assert stock(second) == 1
+
+
+def test_quantities_must_be_positive(products):
+    with pytest.raises(ValueError):
+        take_stock({products[0]: 0})
+    with pytest.raises(ValueError):
+        take_stock({products[0]: -3})
+
+    assert stock(products[0]) == 5
+
+
+def test_one_release_job_queued(products):
+    reserve_stock({products[0]: 1})
+    db.session.commit()
+
+    schedule_release()
+    schedule_release()
+
+    jobs = Job.query.filter_by(name=RELEASE_TASK, status=JOB_QUEUED).all()
+    assert len(jobs) == 1
+    assert jobs[0].run_after > datetime.now()
@@ -0,0 +1,174 @@
+"""
+This file (test_page_cache.py) contains the functional tests of the
+full-page cache of the storefront, see utils/page_cache.py
+"""
+import pytest
+
+from app import create_app
+from config import TestingConfig
+from init import db
+
+from modules.box__default.settings.helpers import bump_settings_version
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.product.models import Product
+from modules.resource.models import Resource
+
+
+@pytest.fixture
+def cached_app(monkeypatch):
+    monkeypatch.setattr(TestingConfig, "PAGE_CACHE", True, raising=False)
+    return create_app("testing")
+
+
+@pytest.fixture
+def catalogue(db_session):
+    category = Category(name="cached")
+    subcategory = SubCategory(name="cached sneakers")
+    for i in range(1, 4):
+        subcategory.products.append(
+            Product(
+                barcode=f"cached-{i}",
+                name=f"Cached {i}",
+                price=10,
+                selling_price=10,
+                in_stock=10,
+            )
+        )
+    other = SubCategory(name="cached boots")
+    other.products.append(
+        Product(
+            barcode="cached-other",
+            name="Cached other",
+            price=10,
+            selling_price=10,
+            in_stock=10,
+        )
+    )
+    category.subcategories.extend([subcategory, other])
+    category.save()
+    return subcategory.id, other.id
+
+
+def cache_status(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.headers.get("X-Page-Cache")
+
+
+def test_product_page_is_cached(cached_app, catalogue):
+    client = cached_app.test_client()
+
+    assert cache_status(client, "/shop/product/cached-1") == "miss"
+    assert cache_status(client, "/shop/product/cached-1") == "hit"
+
+
+def test_cached_page_not_modified(cached_app, catalogue):
+    first = cached_app.test_client().get("/shop/product/cached-1")
+
+    response = cached_app.test_client().get(
+        "/shop/product/cached-1",
+        headers={"If-None-Match": first.headers["ETag"]},
+    )
+    assert response.status_code == 304
+    assert response.headers["X-Page-Cache"] == "hit"
+    assert response.headers["ETag"] == first.headers["ETag"]
+
+
+def test_product_edit_purges_its_pages_only(cached_app, catalogue):
+    subcategory_id, other_id = catalogue
+    client = cached_app.test_client()
+    urls = [
+        "/shop/product/cached-1",
+        "/shop/product/cached-2",
+        f"/shop/sub/{subcategory_id}",
+        f"/shop/sub/{other_id}",
+    ]
+    for url in urls:
+        cache_status(client, url)
+
+    with cached_app.app_context():
+        product = Product.query.filter_by(barcode="cached-1").first()
+        product.name = "Renamed cached 1"
+        db.session.commit()
+
+    response = client.get("/shop/product/cached-1")
+    assert response.headers["X-Page-Cache"] == "miss"
+    assert b"Renamed cached 1" in response.data
+    # listed on the subcategory page
+    assert cache_status(client, urls[2]) == "miss"
+    assert cache_status(client, urls[1]) == "hit"
+    assert cache_status(client, urls[3]) == "hit"
+
+
+def test_new_product_purges_its_subcategory(cached_app, catalogue):
+    _, other_id = catalogue
+    client = cached_app.test_client()
+    cache_status(client, "/shop/product/cached-1")
+    cache_status(client, f"/shop/sub/{other_id}")
+
+    with cached_app.app_context():
+        db.session.add(
+            Product(
+                barcode="cached-new",
+                name="Cached new",
+                price=1,
+                subcategory_id=other_id,
+            )
+        )
+        db.session.commit()
+
+    assert cache_status(client, f"/shop/sub/{other_id}") == "miss"
+    # product pages do not list the other products
+    assert cache_status(client, "/shop/product/cached-1") == "hit"
+
+
+def test_product_image_purges_category_pages(cached_app, catalogue):
+    client = cached_app.test_client()
+    with cached_app.app_context():
+        # the image is filed under another category
+        Category(name="cached elsewhere").save()
+    cache_status(client, "/shop/c/cached")
+    cache_status(client, "/shop/home")
+
+    with cached_app.app_context():
+        product = Product.query.filter_by(barcode="cached-1").one()
+        elsewhere = Category.query.filter_by(name="cached elsewhere").one()
+        product.resources.append(
+            Resource(
+                filename="cached.jpg",
+                type="image",
+                category="product_image",
+                category_id=elsewhere.id,
+            )
+        )
+        db.session.commit()
+
+    assert cache_status(client, "/shop/c/cached") == "miss"
+    assert cache_status(client, "/shop/home") == "miss"
+
+
+def test_settings_change_purges_every_page(cached_app, catalogue):
+    client = cached_app.test_client()
+    cache_status(client, "/shop/product/cached-1")
+
+    with cached_app.app_context():
+        bump_settings_version()
+
+    assert cache_status(client, "/shop/product/cached-1") == "miss"
+
+
+def test_visitors_with_a_cart_are_not_served_from_cache(cached_app, catalogue):
+    client = cached_app.test_client()
+    cache_status(client, "/shop/product/cached-1")
+    client.post(
+        "/shop/cart/add/cached-1",
+        data={
+            "barcode": "cached-1",
+            "quantity": 1,
+            "size": "",
+            "color": "",
+        },
+    )
+
+    assert cache_status(client, "/shop/product/cached-1") is None
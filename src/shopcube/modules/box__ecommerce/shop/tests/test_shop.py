@@ -6,6 +6,20 @@ These tests use GETs and POSTs to different endpoints to check
 for the proper behavior of the `shop` blueprint.
 """
 import pytest
+from sqlalchemy import event
+
+from init import db as _db
+
+from modules.box__ecommerce.category.models import Category
+from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.category.tree import get_category_tree
+from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.shop.helpers import keyset_paginate_products
+from modules.box__ecommerce.shop.helpers import paginate_products
+from modules.box__ecommerce.shop.helpers import price_bounds
+from modules.box__ecommerce.shop.models import BillingDetail
+from modules.box__ecommerce.shop.models import Order
+from modules.box__ecommerce.shop.models import OrderItem
 
 
 @pytest.mark.order("first")
@@ -18,3 +32,293 @@ def test_shop_home_page(test_client):
     # '/' redirects to /shop/home
     response = test_client.get("/", follow_redirects=True)
     assert response.status_code == 200
+
+
+@pytest.fixture
+def shop_products(db_session):
+    """
+    A pytest fixture that adds a subcategory with 12 products priced
+    10, 20, ..., 120
+    """
+    category = Category(name="shoes")
+    subcategory = SubCategory(name="sneakers")
+    for i in range(1, 13):
+        subcategory.products.append(
+            Product(
+                barcode=f"shop-test-{i}",
+                name=f"Shop Test {i}",
+                price=i * 10,
+                selling_price=i * 10,
+                in_stock=10,
+            )
+        )
+    category.subcategories.append(subcategory)
+    category.save()
+    return subcategory
+
+
+def test_paginate_products_newest_first(shop_products):
+    pagination, min_max = paginate_products(Product.query, 1, per_page=5)
+
+    assert pagination.total == 12
+    assert pagination.pages == 3
+    assert [p.name for p in pagination.items][0] == "Shop Test 12"
+    assert min_max == [10, 120]
+
+
+def test_paginate_products_price_filter(shop_products):
+    pagination, min_max = paginate_products(
+        Product.query, 2, per_page=2, price_filter=[30, 70]
+    )
+
+    assert pagination.total == 5
+    assert pagination.pages == 3
+    assert [p.selling_price for p in pagination.items] == [50, 40]
+    # bounds stay the ones of the unfiltered listing for the slider
+    assert min_max == [10, 120]
+
+
+def test_price_bounds(shop_products):
+    assert price_bounds(Product.query) == [10, 120]
+    assert price_bounds(Product.query.filter(Product.id < 0)) == [0, 2000]
+
+
+def test_shop_index_price_filter(test_client, shop_products):
+    response = test_client.get("/shop/?min=100&max=120")
+
+    assert response.status_code == 200
+    assert b"Shop Test 11" in response.data
+    assert b"Shop Test 9<" not in response.data
+
+
+@pytest.mark.parametrize("sort", ["new", "price"])
+def test_keyset_paginate_products_walks_all_products(shop_products, sort):
+    seen = []
+    cursor = None
+    while True:
+        products, cursor = keyset_paginate_products(
+            Product.query, cursor=cursor, per_page=5, sort=sort
+        )
+        seen.extend(p.name for p in products)
+        if cursor is None:
+            break
+
+    assert len(seen) == 12
+    assert len(set(seen)) == 12
+    if sort == "price":
+        assert seen[0] == "Shop Test 1"
+    else:
+        assert seen[0] == "Shop Test 12"
+
+
+def test_keyset_price_sort_puts_products_without_price_last(
+    shop_products,
+):
+    for i in (1, 2, 3):
+        shop_products.products.append(
+            Product(barcode=f"shop-test-free-{i}", name=f"Shop Free {i}")
+        )
+    _db.session.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        products, cursor = keyset_paginate_products(
+            Product.query, cursor=cursor, per_page=7, sort="price"
+        )
+        seen.extend(p.name for p in products)
+        if cursor is None:
+            break
+
+    # the second page ends on a product without price
+    assert len(seen) == 15
+    assert seen[0] == "Shop Test 1"
+    assert seen[-4:] == [
+        "Shop Test 12",
+        "Shop Free 1",
+        "Shop Free 2",
+        "Shop Free 3",
+    ]
+
+
+def test_subcategory_products_json(test_client, shop_products):
+    url = f"/shop/sub/{shop_products.id}/products?sort=price&min=30&max=90"
+    first = test_client.get(url).get_json()
+    second = test_client.get(f"{url}&after={first['next']}").get_json()
+
+    assert [p["selling_price"] for p in first["products"]] == [
+        30,
+        40,
+        50,
+        60,
+        70,
+    ]
+    assert [p["selling_price"] for p in second["products"]] == [80, 90]
+    assert second["next"] is None
+
+
+def test_subcategory_products_json_invalid_cursor(test_client, shop_products):
+    response = test_client.get(
+        f"/shop/sub/{shop_products.id}/products?after=notacursor"
+    )
+
+    assert response.status_code == 400
+
+
+def test_subcategory_page_walks_filtered_pages(test_client, shop_products):
+    url = f"/shop/sub/{shop_products.id}"
+    first = test_client.get(f"{url}?min=10&max=70")
+    cursor = first.data.split(b"after=", 1)[1].split(b"&", 1)[0].decode()
+    second = test_client.get(f"{url}?after={cursor}&min=10&max=70")
+
+    assert first.status_code == 200
+    assert b"Shop Test 7<" in first.data
+    assert b"Shop Test 2<" not in first.data
+    assert b"Shop Test 2<" in second.data
+    # the last page links to none after it
+    assert b"after=" not in second.data
+
+
+def test_numbered_pages_redirect_to_the_first(test_client, shop_products):
+    response = test_client.get(
+        f"/shop/sub/{shop_products.id}/page/2?min=10&max=70"
+    )
+    invalid = test_client.get(f"/shop/sub/{shop_products.id}?after=notacursor")
+
+    assert response.status_code == 302
+    assert response.location.endswith(
+        f"/shop/sub/{shop_products.id}?min=10&max=70"
+    )
+    assert invalid.status_code == 302
+
+
+def test_shop_index_numbered_pages(test_client, shop_products):
+    response = test_client.get("/shop/page/2?min=10&max=70")
+
+    assert response.status_code == 200
+    assert b"Shop Test 2<" in response.data
+    assert b"/shop/page/3" not in response.data
+
+
+def test_cart_resolves_products_in_one_query(test_client, shop_products):
+    for i in range(1, 6):
+        test_client.post(
+            f"/shop/cart/add/shop-test-{i}",
+            data=dict(
+                barcode=f"shop-test-{i}", quantity=1, size="s", color="c"
+            ),
+        )
+
+    statements = []
+
+    def count_product_selects(conn, cursor, statement, *args):
+        if statement.lstrip().startswith("SELECT") and "FROM product" in (
+            statement
+        ):
+            statements.append(statement)
+
+    # built once for all requests, see category/tree.py
+    get_category_tree()
+    event.listen(_db.engine, "before_cursor_execute", count_product_selects)
+    try:
+        response = test_client.get("/shop/cart")
+    finally:
+        event.remove(
+            _db.engine, "before_cursor_execute", count_product_selects
+        )
+
+    assert response.status_code == 200
+    assert b"Shop Test 5" in response.data
+    assert len(statements) == 1
+    with test_client.session_transaction() as session:
+        session.pop("cart", None)
+
+
+def make_order(products, email="order@domain.com"):
+    order = Order()
+    order.billing_detail = BillingDetail(email=email)
+    for product in products:
+        order_item = OrderItem(quantity=2)
+        order_item.snapshot(product)
+        order.order_items.append(order_item)
+    order.total_amount = order.compute_total_amount()
+    order.insert()
+    return order
+
+
+def test_order_snapshots_product_prices(shop_products):
+    products = shop_products.products[:2]
+    order = make_order(products)
+
+    products[0].selling_price = 1000
+    products[0].name = "Renamed"
+    _db.session.commit()
+
+    order = Order.query.get(order.id)
+    assert order.get_total_amount() == 2 * 10 + 2 * 20
+    assert order.order_items[0].get_name() == "Shop Test 1"
+    assert order.order_items[0].get_total() == 20
+
+
+def test_order_total_of_orders_without_snapshot(shop_products):
+    order = Order()
+    order.order_items.append(OrderItem(barcode="shop-test-3", quantity=3))
+    order.insert()
+
+    assert order.get_total_amount() == 90
+    assert order.order_items[0].get_name() == "Shop Test 3"
+
+
+def test_order_details_load_in_constant_queries(shop_products):
+    for i in range(3):
+        make_order(shop_products.products[i : i + 3])
+    _db.session.expire_all()
+
+    statements = []
+
+    def count_selects(conn, cursor, statement, *args):
+        if statement.lstrip().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(_db.engine, "before_cursor_execute", count_selects)
+    try:
+        orders = Order.query.options(*Order.load_details()).all()
+        for order in orders:
+            order.billing_detail.email
+            order.get_total_amount()
+            for item in order.order_items:
+                item.get_name()
+                item.get_total()
+                item.product.description
+    finally:
+        event.remove(_db.engine, "before_cursor_execute", count_selects)
+
+    assert len(orders) == 3
+    assert len(statements) == 2
+
+
+def test_homepage_product_queries_do_not_grow(test_client, shop_products):
+    statements = []
+
+    def count_product_selects(conn, cursor, statement, *args):
+        if statement.lstrip().startswith("SELECT") and (
+            "FROM product" in statement or "JOIN product" in statement
+        ):
+            statements.append(statement)
+
+    # built once for all requests, see category/tree.py
+    get_category_tree()
+    event.listen(_db.engine, "before_cursor_execute", count_product_selects)
+    try:
+        response = test_client.get("/shop/home")
+    finally:
+        event.remove(
+            _db.engine, "before_cursor_execute", count_product_selects
+        )
+
+    assert response.status_code == 200
+    assert b"12 products" in response.data
+    assert b"Shop Test 12" in response.data
+    assert b"Shop Test 7" not in response.data
+    # the latest products, the count is read from the category tree
+    assert len(statements) == 1
@@ -1,8 +1,6 @@
-import json
-import os
 from datetime import datetime
 
-from flask import current_app
+from flask import abort
 from flask import flash
 from flask import jsonify
 from flask import redirect
@@ -18,6 +16,9 @@ from shopyo.api.html import notify_warning
 from shopyo.api.module import ModuleHelp
 from shopyo.api.security import get_safe_redirect
 
+from init import db
+from utils.conditional import conditional
+from utils.metrics import registry
 from utils.session import Cart
 
 from modules.box__default.admin.models import User
@@ -25,13 +26,29 @@ from modules.box__default.auth.email import send_async_email
 from modules.box__default.settings.helpers import get_setting
 from modules.box__ecommerce.category.models import Category
 from modules.box__ecommerce.category.models import SubCategory
+from modules.box__ecommerce.category.tree import get_category_tree
 from modules.box__ecommerce.product.models import Product
+from modules.box__ecommerce.product.search import FIELDS as SEARCH_FIELDS
+from modules.box__ecommerce.product.search import search_products
 from modules.box__ecommerce.shop.forms import CheckoutForm
+from modules.box__ecommerce.shop.helpers import KEYSET_SORTS
+from modules.box__ecommerce.shop.helpers import InvalidCursor
+from modules.box__ecommerce.shop.helpers import category_validators
 from modules.box__ecommerce.shop.helpers import get_cart_data
-from modules.box__ecommerce.shop.helpers import get_min_max_subcateg
+from modules.box__ecommerce.shop.helpers import get_price_filter
+from modules.box__ecommerce.shop.helpers import keyset_paginate_products
+from modules.box__ecommerce.shop.helpers import paginate_products
+from modules.box__ecommerce.shop.helpers import price_bounds
+from modules.box__ecommerce.shop.helpers import product_card_data
+from modules.box__ecommerce.shop.helpers import product_validators
+from modules.box__ecommerce.shop.inventory import OutOfStock
+from modules.box__ecommerce.shop.inventory import cart_lines
+from modules.box__ecommerce.shop.inventory import reserve_stock
+from modules.box__ecommerce.shop.inventory import take_reserved_stock
 from modules.box__ecommerce.shop.models import BillingDetail
 from modules.box__ecommerce.shop.models import Order
 from modules.box__ecommerce.shop.models import OrderItem
+from modules.box__ecommerce.shop.tasks import schedule_release
 from modules.box__ecommerce.shopman.models import Coupon
 from modules.box__ecommerce.shopman.models import DeliveryOption
 from modules.box__ecommerce.shopman.models import PaymentOption
@@ -40,12 +57,31 @@ mhelp = ModuleHelp(__file__, __name__)
 globals()[mhelp.blueprint_str] = mhelp.blueprint
 module_blueprint = globals()[mhelp.blueprint_str]
 
+SEARCH_PER_PAGE = 20
+SEARCH_MAX_PER_PAGE = 100
+
+registry.counter("shopcube_orders_placed_total", "Orders placed at checkout")
+registry.counter("shopcube_carts_created_total", "Carts given a first item")
+
+# session key of the stock reservation of the cart, see inventory.py
+RESERVATION_KEY = "stock_reservation"
+
+
+def out_of_stock(error):
+    flash(notify_warning(f"Not enough stock left for {error}"))
+    return mhelp.redirect_url("shop.cart")
+
 
 # mhelp._context.update({"get_currency_symbol": get_currency_symbol})
 
 
 def get_product(barcode):
-    return Product.query.filter_by(barcode=barcode).first()
+    return Cart.get_product(barcode)
+
+
+@module_blueprint.before_app_request
+def forget_cart_products():
+    Cart.forget_products()
 
 
 @module_blueprint.route("/home")
@@ -63,50 +99,76 @@ def homepage():
     return render_template("ecommerceus/index.html", **context)
 
 
+def keyset_listing_context(query):
+    """
+    Context of an html product listing, newest first: the page after
+    the cursor of the after query argument, filtered on the min and max
+    arguments, and the price bounds of the listing for the filter
+
+    Raises
+    ------
+    InvalidCursor
+    """
+    price_filter = get_price_filter(request.args)
+    products, next_cursor = keyset_paginate_products(
+        query, cursor=request.args.get("after"), price_filter=price_filter
+    )
+    min_max = price_bounds(query)
+
+    filter_min_max = min_max
+    filter_args = {}
+    if price_filter is not None:
+        filter_min_max = price_filter
+        filter_args = {"min": price_filter[0], "max": price_filter[1]}
+
+    return {
+        "products": products,
+        "next_cursor": next_cursor,
+        "first_page": "after" not in request.args,
+        "min_max": min_max,
+        "filter_min_max": filter_min_max,
+        "filter_args": filter_args,
+    }
+
+
+def first_page_redirect(endpoint, **values):
+    """
+    Redirect to the first page of a listing, for the numbered pages of
+    old links and for invalid cursors
+    """
+    filter_args = {
+        key: request.args[key] for key in ("min", "max") if key in request.args
+    }
+    return redirect(url_for(endpoint, **values, **filter_args))
+
+
 @module_blueprint.route("/page/<int:page>")
 @module_blueprint.route("/")
 def index(page=1):
     context = mhelp.context()
-    PAGINATION = 5
-    end = page * PAGINATION
-    start = end - PAGINATION
-    # total_pages = (data.count_posts(name, data.STATE_PUBLISHED) // PAGINATION) + 1
-    total_pages = (len(Product.query.all()) // PAGINATION) + 1
-    products = Product.query.all()[::-1][start:end]
-
-    min_price = None
-    max_price = None
-
-    def_min_price = min(p.selling_price for p in products)
-    def_max_price = max(p.selling_price for p in products)
-    filter_min_max = [def_min_price, def_max_price]
-    if request.args.get("min") and request.args.get("max"):
-        if (
-            request.args.get("min").isnumeric()
-            and request.args.get("max").isnumeric()
-        ):
-            min_price = int(request.args.get("min"))
-            max_price = int(request.args.get("max"))
-            print(min_price, max_price)
-            products = list(
-                p
-                for p in products
-                if min_price <= p.selling_price <= max_price
-            )
-            products = products[start:end]
-            filter_min_max = [min_price, max_price]
+
+    price_filter = get_price_filter(request.args)
+    pagination, min_max = paginate_products(
+        Product.query, page, price_filter=price_filter
+    )
+
+    filter_min_max = min_max
+    filter_args = {}
+    if price_filter is not None:
+        filter_min_max = price_filter
+        filter_args = {"min": price_filter[0], "max": price_filter[1]}
 
     cart_info = get_cart_data()
 
-    min_max = [def_min_price, def_max_price]
     context.update(
         {
             "current_category_name": "",
-            "total_pages": total_pages,
+            "total_pages": max(pagination.pages, 1),
             "page": page,
-            "products": products,
+            "products": pagination.items,
             "min_max": min_max,
             "filter_min_max": filter_min_max,
+            "filter_args": filter_args,
         }
     )
     context.update(cart_info)
@@ -114,12 +176,13 @@ def index(page=1):
 
 
 @module_blueprint.route("/c/<category_name>")
+@conditional(category_validators)
 def category(category_name):
 
     context = mhelp.context()
-    current_category = Category.query.filter(
-        Category.name == category_name
-    ).first()
+    current_category = get_category_tree().by_name(category_name)
+    if current_category is None:
+        abort(404)
 
     cart_info = get_cart_data()
 
@@ -135,57 +198,124 @@ def category(category_name):
 
 @module_blueprint.route("/sub/<sub_id>/page/<int:page>")
 @module_blueprint.route("/sub/<sub_id>")
-def subcategory(sub_id, page=1, methods=["GET"]):
+def subcategory(sub_id, page=None, methods=["GET"]):
+    if page is not None:
+        return first_page_redirect("shop.subcategory", sub_id=sub_id)
+
     context = mhelp.context()
-    PAGINATION = 5
-    end = page * PAGINATION
-    start = end - PAGINATION
-
-    subcategory = SubCategory.query.get(sub_id)
-    subcategory_name = subcategory.name
-
-    min_price = None
-    max_price = None
-    products = subcategory.products[start:end]
-    filter_min_max = get_min_max_subcateg(subcategory_name)
-    if request.args.get("min") and request.args.get("max"):
-        if (
-            request.args.get("min").isnumeric()
-            and request.args.get("max").isnumeric()
-        ):
-            min_price = int(request.args.get("min"))
-            max_price = int(request.args.get("max"))
-            print(min_price, max_price)
-            products = list(
-                p
-                for p in subcategory.products
-                if min_price <= p.selling_price <= max_price
-            )
-            products = products[start:end]
-            filter_min_max = [min_price, max_price]
 
-    total_pages = (len(products) // PAGINATION) + 1
-    current_category_name = subcategory.category.name
-    subcategory_name = subcategory.name
+    subcategory = SubCategory.query.get_or_404(sub_id)
+
+    try:
+        context.update(
+            keyset_listing_context(
+                Product.query.filter(Product.subcategory_id == subcategory.id)
+            )
+        )
+    except InvalidCursor:
+        return first_page_redirect("shop.subcategory", sub_id=sub_id)
 
     cart_info = get_cart_data()
 
     context.update(
         {
             "subcategory": subcategory,
-            "current_category_name": current_category_name,
-            "total_pages": total_pages,
-            "page": page,
-            "products": products,
-            "subcategory_name": subcategory_name,
-            "filter_min_max": filter_min_max,
+            "current_category_name": subcategory.category.name,
+            "subcategory_name": subcategory.name,
         }
     )
     context.update(cart_info)
     return mhelp.render("subcategory.html", **context)
 
 
+def keyset_listing_response(query):
+    """
+    json page of a product listing for infinite scroll, driven by the
+    after, sort, min and max query arguments
+    """
+    sort = request.args.get("sort", "new")
+    if sort not in KEYSET_SORTS:
+        return jsonify({"error": f"unknown sort {sort}"}), 400
+
+    try:
+        products, next_cursor = keyset_paginate_products(
+            query,
+            cursor=request.args.get("after"),
+            sort=sort,
+            price_filter=get_price_filter(request.args),
+        )
+    except InvalidCursor:
+        return jsonify({"error": "invalid cursor"}), 400
+
+    return jsonify(
+        {
+            "products": [product_card_data(p) for p in products],
+            "next": next_cursor,
+        }
+    )
+
+
+@module_blueprint.route("/sub/<sub_id>/products", methods=["GET"])
+def subcategory_products(sub_id):
+    subcategory = SubCategory.query.get_or_404(sub_id)
+    return keyset_listing_response(
+        Product.query.filter(Product.subcategory_id == subcategory.id)
+    )
+
+
+@module_blueprint.route("/c/<category_name>/products", methods=["GET"])
+def category_products(category_name):
+    category = Category.query.filter(
+        Category.name == category_name
+    ).first_or_404()
+    return keyset_listing_response(
+        Product.query.join(SubCategory).filter(
+            SubCategory.category_id == category.id
+        )
+    )
+
+
+@module_blueprint.route("/search", methods=["GET"])
+def search():
+    """
+    json page of the products matching the q query argument, best
+    matches first, driven by the page, per_page and fields arguments
+    """
+    query = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    per_page = min(
+        request.args.get("per_page", SEARCH_PER_PAGE, type=int),
+        SEARCH_MAX_PER_PAGE,
+    )
+    fields = request.args.get("fields")
+    if fields:
+        fields = fields.split(",")
+        unknown = set(fields) - set(SEARCH_FIELDS)
+        if unknown:
+            return (
+                jsonify({"error": f"unknown fields {', '.join(unknown)}"}),
+                400,
+            )
+    if page < 1 or per_page < 1:
+        return jsonify({"error": "page and per_page must be positive"}), 400
+
+    products, has_next = [], False
+    if query:
+        products, has_next = search_products(
+            query, page=page, per_page=per_page, fields=fields
+        )
+    return jsonify(
+        {
+            "query": query,
+            "page": page,
+            "products": [product_card_data(p) for p in products],
+            "next": page + 1 if has_next else None,
+        }
+    )
+
+
 @module_blueprint.route("/product/<product_barcode>")
+@conditional(product_validators)
 def product(product_barcode):
     context = mhelp.context()
     product = Product.query.filter_by(barcode=product_barcode).first()
@@ -212,7 +342,10 @@ def cart_add(product_barcode):
 
         item_info = {"quantity": quantity, "size": size, "color": color}
 
+        first_item = not session.get("cart")
         if Cart.add(barcode, item_info):
+            if first_item:
+                registry.inc("shopcube_carts_created_total")
             return mhelp.redirect_url("shop.product", product_barcode=barcode)
         else:
             flash(
@@ -240,6 +373,9 @@ def cart_remove(product_barcode, size, color):
 def cart():
     context = mhelp.context()
 
+    # one query for the cart lines with their sizes and colors, reused
+    # by the cart summary and the template
+    Cart.products(load_variants=True)
     cart_info = get_cart_data()
     delivery_options = DeliveryOption.query.all()
 
@@ -269,19 +405,8 @@ def checkout():
 
     delivery_options = DeliveryOption.query.all()
     payment_options = PaymentOption.query.all()
-    with open(
-        os.path.join(
-            current_app.config["BASE_DIR"],
-            "modules",
-            "box__ecommerce",
-            "shopman",
-            "data",
-            "country.json",
-        )
-    ) as f:
-        countries = json.load(f)
     form = CheckoutForm()
-    # country_choices = [(c["name"], c["name"]) for c in countries]
+    # country_choices = get_country_choices()
     country_choices = [("mauritius", "Mauritius")]
     form.default_country.choices = country_choices
     form.diff_country.choices = country_choices
@@ -296,6 +421,18 @@ def checkout():
     else:
         checkout_data = session["checkout_data"][0]
 
+    # the stock of the cart is held while the visitor checks out
+    lines = cart_lines(Cart.products(), Cart.data()["items"])
+    previous = session.get(RESERVATION_KEY)
+    try:
+        token = reserve_stock(lines, previous)
+    except OutOfStock as error:
+        return out_of_stock(error)
+    db.session.commit()
+    if token != previous:
+        session[RESERVATION_KEY] = token
+        schedule_release()
+
     context.update(
         {
             "get_product": get_product,
@@ -319,18 +456,7 @@ def checkout_process():
             return mhelp.redirect_url("shop.checkout")
 
         form = CheckoutForm()
-        with open(
-            os.path.join(
-                current_app.config["BASE_DIR"],
-                "modules",
-                "box__ecommerce",
-                "shopman",
-                "data",
-                "country.json",
-            )
-        ) as f:
-            countries = json.load(f)
-        # country_choices = [(c["name"], c["name"]) for c in countries]
+        # country_choices = get_country_choices()
         # form.default_country.choices = country_choices
         # form.diff_country.choices = country_choices
 
@@ -351,6 +477,15 @@ def checkout_process():
 
         print(request.form["paymentoption"])
         if form.validate_on_submit():
+            # taken before anything is added to the session, which may
+            # be rolled back, see inventory.py
+            lines = cart_lines(Cart.products(), Cart.data()["items"])
+            try:
+                take_reserved_stock(session.get(RESERVATION_KEY), lines)
+            except OutOfStock as error:
+                return out_of_stock(error)
+            session.pop(RESERVATION_KEY, None)
+
             if not form.diffAddress.data:
                 first_name = form.default_first_name.data
                 last_name = form.default_last_name.data
@@ -417,15 +552,23 @@ def checkout_process():
             cart_info = get_cart_data()
             cart_data = cart_info["cart_data"]
 
+            products = Cart.products()
             for barcode in Cart.data()["items"]:
+                product = products.get(barcode)
+                if product is None:
+                    continue
                 for item in Cart.data()["items"][barcode]:
                     order_item = OrderItem()
-                    product = Product.query.filter_by(barcode=barcode).first()
-                    order_item.barcode = barcode
+                    order_item.snapshot(product)
                     order_item.quantity = int(item["quantity"])
                     order_item.size = item["size"]
                     order_item.color = item["color"]
                     order.order_items.append(order_item)
+            order.total_amount = order.compute_total_amount()
+
+            # flushed so that the email can show the order reference
+            order.add()
+            db.session.flush()
 
             template = "shop/emails/order_info"
             subject = "FreaksBoutique - Order Details"
@@ -434,6 +577,7 @@ def checkout_process():
             send_async_email(email, subject, template, **context)
 
             order.insert()
+            registry.inc("shopcube_orders_placed_total")
             flash(notify_success("Great!"))
             context = mhelp.context()
             Cart.reset()
@@ -0,0 +1,109 @@
+from datetime import datetime
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from modules.box__ecommerce.shop.models import BillingDetail
+from modules.box__ecommerce.shop.models import Order
+
+ORDER_STATUSES = [
+    "pending",
+    "processing",
+    "shipped",
+    "cancelled",
+    "refunded",
+]
+ORDERS_PER_PAGE = 20
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ref(ref):
+    """
+    Order id of a reference as made by Order.get_ref, the part before #
+    being enough. None if it is not a valid reference
+    """
+    number = ref.split("#", 1)[0].strip()
+    if not number.isdigit() or int(number) % 19:
+        return None
+    return int(number) // 19
+
+
+def get_order_filters(args):
+    """
+    Order filters of the request arguments, invalid ones being dropped
+
+    Parameters
+    ----------
+    args: MultiDict
+        request.args
+
+    Returns
+    -------
+    dict
+        any of status, from, to, email and ref, with their raw values
+    """
+    filters = {}
+    status = args.get("status", "")
+    if status in ORDER_STATUSES:
+        filters["status"] = status
+    for name in ("from", "to"):
+        if _parse_date(args.get(name)) is not None:
+            filters[name] = args[name]
+    for name in ("email", "ref"):
+        value = args.get(name, "").strip()
+        if value:
+            filters[name] = value
+    return filters
+
+
+def filter_orders(query, filters):
+    if "status" in filters:
+        query = query.filter(Order.status == filters["status"])
+    if "from" in filters:
+        query = query.filter(Order.time >= _parse_date(filters["from"]))
+    if "to" in filters:
+        # the end date is included
+        end = _parse_date(filters["to"]) + timedelta(days=1)
+        query = query.filter(Order.time < end)
+    if "email" in filters:
+        query = query.filter(
+            Order.id.in_(
+                select(BillingDetail.order_id).where(
+                    BillingDetail.email == filters["email"]
+                )
+            )
+        )
+    if "ref" in filters:
+        query = query.filter(Order.id == parse_ref(filters["ref"]))
+    return query
+
+
+def paginate_orders(filters, page, per_page=ORDERS_PER_PAGE):
+    """
+    A page of orders, newest first, with billing details and items
+    loaded. Orders are not counted so that the cost of a page does not
+    grow with the number of orders, one more order than needed is
+    fetched instead to know if there is a next page
+
+    Returns
+    -------
+    tuple
+        list of orders, and whether there is a next page
+    """
+    page = max(page, 1)
+    query = filter_orders(Order.query, filters)
+    orders = (
+        query.options(*Order.load_details())
+        .order_by(Order.time.desc(), Order.id.desc())
+        .limit(per_page + 1)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+    return orders[:per_page], len(orders) > per_page
@@ -0,0 +1,78 @@
+"""
+Reference data of the shop: currencies and countries.
+
+The json files of shopman/data are read once per process, the first time
+they are needed, into dicts keyed by code along with the choices of the
+forms listing them, so that nothing here reads the disk afterwards.
+"""
+import json
+import os
+import threading
+
+dirpath = os.path.dirname(os.path.abspath(__file__))
+
+_data = {}
+_lock = threading.Lock()
+
+
+def _load(name):
+    """
+    Codes and form choices of shopman/data/<name>.json, loaded once
+
+    Returns
+    -------
+    dict
+        "by_code": code -> entry of the file, in the order of the file
+        "choices": tuple of (code, name)
+    """
+    with _lock:
+        if name not in _data:
+            with open(os.path.join(dirpath, "data", f"{name}.json")) as f:
+                entries = json.load(f)
+            key = "cc" if name == "currency" else "code"
+            by_code = {entry[key]: entry for entry in entries}
+            _data[name] = {
+                "by_code": by_code,
+                "choices": tuple(
+                    (code, entry["name"]) for code, entry in by_code.items()
+                ),
+            }
+        return _data[name]
+
+
+def get_currencies():
+    """
+    Returns
+    -------
+    dict
+        currency code -> dict of cc, symbol and name
+    """
+    return _load("currency")["by_code"]
+
+
+def get_currency_choices():
+    return _load("currency")["choices"]
+
+
+def currency_symbol(code):
+    """
+    Symbol of a currency, None if the code is unknown
+    """
+    currency = get_currencies().get(code)
+    if currency is None:
+        return None
+    return currency["symbol"]
+
+
+def get_countries():
+    """
+    Returns
+    -------
+    dict
+        country code -> dict of name and code
+    """
+    return _load("country")["by_code"]
+
+
+def get_country_choices():
+    return _load("country")["choices"]
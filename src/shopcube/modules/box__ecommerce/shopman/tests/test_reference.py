@@ -0,0 +1,51 @@
+"""
+This file (test_reference.py) contains the tests of the currencies and
+countries reference data, see shopman/reference.py
+"""
+from utils.enhance import set_setting
+
+from modules.box__default.settings.helpers import get_setting
+from modules.box__ecommerce.shop.helpers import get_currency_symbol
+from modules.box__ecommerce.shopman import reference
+
+
+def fail_open(*args, **kwargs):
+    raise AssertionError("reference data read again")
+
+
+def test_currencies():
+    currencies = reference.get_currencies()
+
+    assert currencies["EUR"]["name"] == "European Euro"
+    assert reference.currency_symbol("EUR") == "€"
+    assert reference.currency_symbol("XYZ") is None
+    assert ("EUR", "European Euro") in reference.get_currency_choices()
+    assert len(reference.get_currency_choices()) == len(currencies)
+
+
+def test_countries():
+    countries = reference.get_countries()
+
+    assert countries["MU"]["name"] == "Mauritius"
+    assert ("MU", "Mauritius") in reference.get_country_choices()
+
+
+def test_loaded_once(monkeypatch):
+    currencies = reference.get_currencies()
+    reference.get_countries()
+    monkeypatch.setattr(reference, "open", fail_open, raising=False)
+
+    assert reference.get_currencies() is currencies
+    assert reference.currency_symbol("USD") == "US$"
+    assert reference.get_country_choices()
+
+
+def test_currency_symbol_follows_the_setting(db_session):
+    currency = get_setting("CURRENCY")
+    try:
+        set_setting("CURRENCY", "EUR")
+        assert get_currency_symbol() == "€"
+        set_setting("CURRENCY", "USD")
+        assert get_currency_symbol() == "US$"
+    finally:
+        set_setting("CURRENCY", currency)
@@ -0,0 +1,78 @@
+"""
+This file (test_shopman.py) contains the tests for the order
+browser of the `shopman` blueprint.
+"""
+from datetime import datetime
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from modules.box__ecommerce.shop.models import BillingDetail
+from modules.box__ecommerce.shop.models import Order
+from modules.box__ecommerce.shopman.helpers import get_order_filters
+from modules.box__ecommerce.shopman.helpers import paginate_orders
+from modules.box__ecommerce.shopman.helpers import parse_ref
+
+
+@pytest.fixture
+def orders(db_session):
+    """
+    Adds 5 orders, one per day from the 1st to the 5th of January 2022,
+    the even days ones being shipped
+    """
+    orders = []
+    for day in range(1, 6):
+        order = Order(
+            time=datetime(2022, 1, day, 12),
+            status="shipped" if day % 2 == 0 else "pending",
+        )
+        order.billing_detail = BillingDetail(email=f"customer{day}@domain.com")
+        order.insert()
+        orders.append(order)
+    return orders
+
+
+def test_get_order_filters_drops_invalid_values():
+    args = MultiDict(
+        {
+            "status": "lost",
+            "from": "2022-01-02",
+            "to": "yesterday",
+            "email": " customer1@domain.com ",
+            "ref": "",
+        }
+    )
+
+    assert get_order_filters(args) == {
+        "from": "2022-01-02",
+        "email": "customer1@domain.com",
+    }
+
+
+def test_parse_ref():
+    assert parse_ref("38#Jan 01 2022, 12:00") == 2
+    assert parse_ref("38") == 2
+    assert parse_ref("39") is None
+    assert parse_ref("abc") is None
+
+
+def test_paginate_orders_newest_first(orders):
+    page, has_next = paginate_orders({}, 1, per_page=2)
+    assert [o.time.day for o in page] == [5, 4]
+    assert has_next
+
+    page, has_next = paginate_orders({}, 3, per_page=2)
+    assert [o.time.day for o in page] == [1]
+    assert not has_next
+
+
+def test_paginate_orders_filters(orders):
+    filters = {"status": "shipped", "from": "2022-01-03", "to": "2022-01-04"}
+    page, _ = paginate_orders(filters, 1)
+    assert [o.time.day for o in page] == [4]
+
+    page, _ = paginate_orders({"email": "customer3@domain.com"}, 1)
+    assert [o.id for o in page] == [orders[2].id]
+
+    page, _ = paginate_orders({"ref": orders[1].get_ref()}, 1)
+    assert [o.id for o in page] == [orders[1].id]
@@ -2,9 +2,6 @@
 # from flask import url_for
 # from flask import redirect
 
-import json
-import os
-
 from flask import flash
 from flask import request
 
@@ -18,6 +15,7 @@ from shopyo.api.module import ModuleHelp
 
 from utils.enhance import set_setting
 
+from modules.box__default.auth.email import dispatch_email
 from modules.box__default.auth.email import send_async_email
 from modules.box__default.settings.helpers import get_setting
 from modules.box__ecommerce.product.models import Product
@@ -26,6 +24,10 @@ from modules.box__ecommerce.shopman.forms import CouponForm
 from modules.box__ecommerce.shopman.forms import CurrencyForm
 from modules.box__ecommerce.shopman.forms import DeliveryOptionForm
 from modules.box__ecommerce.shopman.forms import PaymentOptionForm
+from modules.box__ecommerce.shopman.helpers import ORDER_STATUSES
+from modules.box__ecommerce.shopman.helpers import get_order_filters
+from modules.box__ecommerce.shopman.helpers import paginate_orders
+from modules.box__ecommerce.shopman.reference import get_currency_choices
 
 from .models import Coupon
 from .models import DeliveryOption
@@ -47,16 +49,7 @@ def get_product(barcode):
 def dashboard():
     context = mhelp.context()
     form = CurrencyForm()
-    with open(
-        os.path.join(
-            mhelp.dirpath,
-            "data",
-            "currency.json",
-        )
-    ) as f:
-        currencies = json.load(f)
-    currency_choices = [(c["cc"], c["name"]) for c in currencies]
-    form.currency.choices = currency_choices
+    form.currency.choices = get_currency_choices()
 
     context.update({"form": form, "current_currency": get_setting("CURRENCY")})
     return mhelp.render("dashboard.html", **context)
@@ -244,9 +237,19 @@ def coupon_update():
 @module_blueprint.route("/order/dashboard", methods=["GET", "POST"])
 @login_required
 def order():
-    orders = Order.query.all()
+    filters = get_order_filters(request.args)
+    page = request.args.get("page", 1, type=int)
+    orders, has_next = paginate_orders(filters, page)
     context = mhelp.context()
-    context.update({"dir": dir, "orders": orders, "get_product": get_product})
+    context.update(
+        {
+            "orders": orders,
+            "page": max(page, 1),
+            "has_next": has_next,
+            "filters": filters,
+            "order_statuses": ORDER_STATUSES,
+        }
+    )
     return mhelp.render("order.html", **context)
 
 
@@ -263,7 +266,7 @@ def order_delete(order_id):
 )
 @login_required
 def order_view(order_id):
-    order = Order.query.get(order_id)
+    order = Order.query.options(*Order.load_details()).get_or_404(order_id)
     context = mhelp.context()
     context.update({"dir": dir, "order": order})
     return mhelp.render("order_view.html", **context)
@@ -275,14 +278,7 @@ def order_status_change(order_id):
     if request.method == "POST":
         order_status = request.form["order_status"]
         order = Order.query.get(order_id)
-        valid_status = [
-            "pending",
-            "processing",
-            "shipped",
-            "cancelled",
-            "refunded",
-        ]
-        if order_status not in valid_status:
+        if order_status not in ORDER_STATUSES:
             return "unknown order status"
         previous_status = order.status
 
@@ -306,6 +302,6 @@ def order_status_change(order_id):
         html_content = mhelp.render("email_status_change.html", **context)
         msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
         msg.attach_alternative(html_content, "text/html")
-        msg.send()
+        dispatch_email(msg)
         flash(notify_success("Order Updated"))
         return mhelp.redirect_url("shopman.order_view", order_id=order_id)
@@ -1,6 +1,7 @@
 import datetime
 
 from init import db
+from utils.indexes import hot_path_index
 
 
 class Image(db.Model):
@@ -32,6 +33,11 @@ class Image(db.Model):
 
 class Resource(db.Model):
     __tablename__ = "resources"
+    __table_args__ = (
+        # image deletion by file name, images of products listings
+        hot_path_index("ix_resources_filename", "filename"),
+        hot_path_index("ix_resources_product_id", "product_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(50), nullable=False)
     type = db.Column(db.String(50), nullable=False)
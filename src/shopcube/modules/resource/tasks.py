@@ -0,0 +1,69 @@
+import os
+
+from flask import current_app
+
+from init import db
+
+from modules.box__default.jobs.helpers import task
+from modules.resource.models import Image
+
+THUMBNAIL_SIZE = 160, 160
+
+
+def thumbnail_name(filename):
+    return os.path.splitext(filename)[0] + "-thumb.jpg"
+
+
+def make_thumbnail(image):
+    """
+    Writes the jpeg thumbnail of an uploaded image and stores the image
+    dimensions on it
+    """
+    from PIL import Image as PILimage
+
+    img_fullpath = os.path.join(
+        current_app.config["UPLOADED_PATH_IMAGE"], image.filename
+    )
+    tmb_fullpath = os.path.join(
+        current_app.config["UPLOADED_PATH_THUMB"], image.thumbnail
+    )
+    with PILimage.open(img_fullpath) as im:
+        image.file_width, image.file_height = im.size
+        im.thumbnail(THUMBNAIL_SIZE)
+        # PNG is index while JPG needs RGB
+        if not im.mode == "RGB":
+            im = im.convert("RGB")
+        im.save(tmb_fullpath, "JPEG")
+
+
+@task("resource.make_thumbnail")
+def make_thumbnail_job(ctx, image_id):
+    image = Image.query.get(image_id)
+    if image is None:
+        return None
+    make_thumbnail(image)
+    db.session.commit()
+    return {"thumbnail": image.thumbnail}
+
+
+@task("resource.regenerate_thumbnails", max_attempts=1)
+def regenerate_thumbnails_job(ctx):
+    """
+    Rebuilds the thumbnails of all uploaded images, e.g. after a change
+    of THUMBNAIL_SIZE. Images whose file is missing or unreadable are
+    reported instead of failing the job
+    """
+    image_ids = [image_id for (image_id,) in db.session.query(Image.id)]
+    failed = []
+    for done, image_id in enumerate(image_ids, 1):
+        image = Image.query.get(image_id)
+        # None if deleted since the ids were read
+        if image is not None:
+            try:
+                make_thumbnail(image)
+            except OSError:
+                failed.append(image.filename)
+        if done % 50 == 0 or done == len(image_ids):
+            ctx.progress(done, len(image_ids))
+    db.session.commit()
+    return {"images": len(image_ids), "failed": failed}
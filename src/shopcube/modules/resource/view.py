@@ -4,14 +4,23 @@ import os
 # from flask import redirect
 # from flask import render_template
 from flask import Blueprint
+from flask import abort
 from flask import current_app
+from flask import jsonify
+from flask import make_response
+from flask import request
 from flask import send_from_directory
 
 from flask_login import login_required
-from PIL import Image as PILimage
+
+from init import db
 
 # from modules.box__ecommerce.product.models import Product
+from modules.box__default.theme.helpers import get_theme
 from modules.resource.models import Image
+from modules.resource.tasks import make_thumbnail_job
+from modules.resource.tasks import regenerate_thumbnails_job
+from modules.resource.tasks import thumbnail_name
 
 # from flask import url_for
 
@@ -44,40 +53,49 @@ globals()["{}_blueprint".format(module_info["module_name"])] = Blueprint(
 
 module_blueprint = globals()["{}_blueprint".format(module_info["module_name"])]
 
+THEME_CSS_MAX_AGE = 60 * 60 * 24 * 365
+
 
 @module_blueprint.route("/")
 def index():
     return module_info["display_string"]
 
 
+def send_theme_css(kind, active_theme):
+    """
+    Serves styles.css of a theme. Urls carrying the current content hash
+    as v are cached for a year as immutable, any other url must be
+    revalidated. The content hash is used as ETag so that revalidation
+    answers 304 without sending the file again
+    """
+    theme = get_theme(kind, active_theme)
+    if theme is None or theme["styles_hash"] is None:
+        abort(404)
+
+    immutable = request.args.get("v") == theme["styles_hash"]
+    response = send_from_directory(
+        theme["dir"],
+        "styles.css",
+        etag=theme["styles_hash"],
+        max_age=THEME_CSS_MAX_AGE if immutable else 0,
+    )
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
 @module_blueprint.route(
     "/theme/front/<active_theme>/styles.css", methods=["GET"]
 )
 def active_front_theme_css(active_theme):
-    theme_dir = os.path.join(
-        current_app.config["BASE_DIR"],
-        "static",
-        "themes",
-        "front",
-        active_theme,
-    )
-    # return theme_dir
-    return send_from_directory(theme_dir, "styles.css")
+    return send_theme_css("front", active_theme)
 
 
 @module_blueprint.route(
     "/theme/back/<active_theme>/styles.css", methods=["GET"]
 )
 def active_back_theme_css(active_theme):
-    theme_dir = os.path.join(
-        current_app.config["BASE_DIR"],
-        "static",
-        "themes",
-        "back",
-        active_theme,
-    )
-    # return theme_dir
-    return send_from_directory(theme_dir, "styles.css")
+    return send_theme_css("back", active_theme)
 
 
 @module_blueprint.route("/product/<filename>", methods=["GET"])
@@ -115,38 +133,22 @@ def upload_tinymce_image():
                 file.save(img_fullpath)
                 # get the file size to save to db
                 file_size = os.stat(img_fullpath).st_size
-                size = 160, 160
-                # read image into pillow
-                im = PILimage.open(img_fullpath)
-                # get image dimension to save to db
-                file_width, file_height = im.size
-                # convert to thumbnail
-                im.thumbnail(size)
-                thumbnail = fn + "-thumb.jpg"
-                tmb_fullpath = os.path.join(
-                    current_app.config["UPLOADED_PATH_THUMB"], thumbnail
-                )
-                # PNG is index while JPG needs RGB
-                if not im.mode == "RGB":
-                    im = im.convert("RGB")
-                # save thumbnail
-                im.save(tmb_fullpath, "JPEG")
 
-                # save to db
+                # save to db, the thumbnail and the image dimensions are
+                # made by a background job
                 img = Image(
                     filename=filename,
-                    thumbnail=thumbnail,
+                    thumbnail=thumbnail_name(filename),
                     file_size=file_size,
-                    file_width=file_width,
-                    file_height=file_height,
+                    file_width=0,
+                    file_height=0,
                 )
                 db.session.add(img)
                 db.session.commit()
+                make_thumbnail_job.enqueue(image_id=img.id)
             except OSError:
                 output = make_response(404)
-                output.headers["Error"] = (
-                    "Cannot create thumbnail for " + filename
-                )
+                output.headers["Error"] = "Cannot save " + filename
                 return output
             return jsonify({"location": filename})
 
@@ -154,3 +156,10 @@ def upload_tinymce_image():
     output = make_response(404)
     output.headers["Error"] = "Filename needs to be JPG, JPEG, GIF or PNG"
     return output
+
+
+@module_blueprint.route("/thumbnails/regenerate", methods=["POST"])
+@login_required
+def regenerate_thumbnails():
+    job = regenerate_thumbnails_job.enqueue()
+    return jsonify(job.to_dict()), 202
@@ -0,0 +1,200 @@
+"""
+Conditional GET of rendered pages.
+
+Views decorated with conditional answer If-None-Match and
+If-Modified-Since with 304 Not Modified before rendering anything. The
+validators of a page come from a function of the view arguments running
+a cheap query, usually the version and update time of the rows the page
+is built from, to which are added the settings version and the session
+of the visitor, whose cart and login show on every page:
+
+- ETag: weak, a hash of all of the above. Pages embed a csrf token
+  signed at render time, so two renders are never byte for byte equal
+- Last-Modified: the latest update time of the rows and settings, only
+  sent to visitors whose session holds nothing changing the pages, as
+  it cannot tell when the session changed
+
+Rows are versioned with VersionMixin: version is incremented and
+updated_at set by every UPDATE of the row, ORM or core. Rows showing
+other rows, e.g. a product its sizes and images, are touched with
+touch_rows when those change.
+"""
+import datetime
+import functools
+import hashlib
+import json
+import time
+
+from flask import Response
+from flask import current_app
+from flask import make_response
+from flask import request
+from flask import session
+
+from sqlalchemy import literal_column
+from werkzeug.http import is_resource_modified
+
+from init import db
+from utils.page_cache import anonymous_session
+
+
+class VersionMixin:
+    """
+    version and updated_at (UTC) columns, maintained by every update of
+    the row
+    """
+
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default="1",
+        onupdate=literal_column("version") + 1,
+    )
+    updated_at = db.Column(
+        db.DateTime,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+    )
+
+
+def _written(session, model):
+    """
+    Ids of the rows of model inserted or updated by the session, which
+    already have a new version
+    """
+    return {
+        obj.id
+        for obj in session.new | session.dirty
+        if isinstance(obj, model)
+        and (
+            obj in session.new
+            or session.is_modified(obj, include_collections=False)
+        )
+    }
+
+
+def touch_rows(session, model, ids):
+    """
+    Bumps the version and update time of rows of a VersionMixin model.
+    Runs a core UPDATE, so it can be called from flush events, in which
+    case the rows written by the flush are left as they are
+
+    Parameters
+    ----------
+    session: Session
+    model: VersionMixin model
+    ids: iterable
+        primary keys of the rows
+    """
+    ids = set(ids) - _written(session, model) - {None}
+    if not ids:
+        return
+    table = model.__table__
+    session.execute(
+        table.update()
+        .where(table.c.id.in_(sorted(ids)))
+        .values(updated_at=datetime.datetime.utcnow())
+    )
+
+
+def visitor_state():
+    """
+    What the session adds to the pages, None when it holds flashed
+    messages, which are shown once
+    """
+    if "_flashes" in session:
+        return None
+    state = json.dumps(dict(session), sort_keys=True, default=str)
+    time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    if time_limit:
+        # the csrf token of a page kept by the browser expires
+        state += f"/{int(time.time() // time_limit)}"
+    return state
+
+
+def page_etag(parts, state):
+    digest = hashlib.sha1()
+    for part in list(parts) + [state]:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def latest(*times):
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+
+def _settings_validators():
+    from modules.box__default.settings.helpers import get_settings_version
+
+    return get_settings_version()
+
+
+def conditional(validators):
+    """
+    Answers GET requests to the decorated view with 304 Not Modified when
+    the copy of the page the client has is still current
+
+    Parameters
+    ----------
+    validators: callable
+        called with the view arguments before the view, returns a list
+        of values that change whenever the page does and the latest
+        update time of what the page shows, or None when the page cannot
+        be validated, e.g. if the row is missing
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD") or not (
+                current_app.config.get("CONDITIONAL_GET", True)
+            ):
+                return view(*args, **kwargs)
+            page = validators(**kwargs)
+            if page is None:
+                return view(*args, **kwargs)
+            parts, last_modified = page
+            settings_version, settings_updated_at = _settings_validators()
+            parts = list(parts) + [settings_version]
+            if last_modified is not None:
+                last_modified = latest(last_modified, settings_updated_at)
+
+            state = visitor_state()
+            if state is not None:
+                etag = page_etag(parts, state)
+                if not is_resource_modified(
+                    request.environ,
+                    etag=f'W/"{etag}"',
+                    last_modified=(
+                        last_modified if anonymous_session() else None
+                    ),
+                ):
+                    response = Response(status=304)
+                    set_validators(response, etag, last_modified)
+                    return response
+
+            response = make_response(view(*args, **kwargs))
+            # the view may have changed the session, e.g. given a csrf
+            # token to a new visitor
+            state = visitor_state()
+            if response.status_code == 200 and state is not None:
+                set_validators(
+                    response, page_etag(parts, state), last_modified
+                )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None and anonymous_session():
+        response.last_modified = last_modified
+    # kept by the browser but checked with the server before every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
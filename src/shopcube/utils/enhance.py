@@ -4,6 +4,7 @@ import os
 from flask import current_app
 from flask import url_for
 
+from modules.box__default.settings.helpers import bump_settings_version
 from modules.box__default.settings.helpers import get_setting
 from modules.box__default.settings.models import Settings
 
@@ -22,6 +23,7 @@ def set_setting(key, value):
     if setting:
         setting.value = value
         setting.update()
+        bump_settings_version()
 
 
 def base_context():
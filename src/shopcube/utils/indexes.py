@@ -0,0 +1,137 @@
+"""
+Hot path indexes.
+
+Indexes the storefront relies on are declared in the models with
+hot_path_index, like any other index, so that migrations create them.
+At startup check_indexes compares them to the live database and logs a
+warning for each one missing, e.g. when migrations were not run after an
+upgrade, since the pages keep working but scan whole tables.
+"""
+import logging
+import os
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+
+from init import db
+
+logger = logging.getLogger(__name__)
+
+HOT_PATH = "hot_path"
+
+
+def hot_path_index(name, *columns, unique=False):
+    """
+    Index of a model's __table_args__ that check_indexes looks for
+    """
+    return db.Index(name, *columns, unique=unique, info={HOT_PATH: True})
+
+
+def declared_hot_indexes(metadata=None):
+    """
+    Returns
+    -------
+    list
+        (table name, index name, column names, unique) of the hot path
+        indexes declared in the models
+    """
+    metadata = metadata if metadata is not None else db.metadata
+    declared = []
+    for table in metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.info.get(HOT_PATH):
+                declared.append(
+                    (
+                        table.name,
+                        index.name,
+                        tuple(column.name for column in index.columns),
+                        bool(index.unique),
+                    )
+                )
+    return declared
+
+
+def _live_indexes(inspector, table):
+    """
+    (columns, unique) of the indexes and constraints of a live table
+    """
+    live = [
+        (tuple(index["column_names"]), bool(index["unique"]))
+        for index in inspector.get_indexes(table)
+    ]
+    live.extend(
+        (tuple(constraint["column_names"]), True)
+        for constraint in inspector.get_unique_constraints(table)
+    )
+    primary_key = inspector.get_pk_constraint(table)["constrained_columns"]
+    if primary_key:
+        live.append((tuple(primary_key), True))
+    return live
+
+
+def missing_indexes(bind, metadata=None):
+    """
+    Hot path indexes absent from the database. An index is present when
+    an index or constraint covers the same columns, in the same order,
+    and is unique if the declared one is. Tables not created yet are
+    skipped
+
+    Parameters
+    ----------
+    bind: Engine or Connection
+        database to look into
+
+    Returns
+    -------
+    list
+        (table name, index name, column names, unique)
+    """
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    live = {}
+    missing = []
+    for table, name, columns, unique in declared_hot_indexes(metadata):
+        if table not in tables:
+            continue
+        if table not in live:
+            live[table] = _live_indexes(inspector, table)
+        if not any(
+            columns == live_columns and (live_unique or not unique)
+            for live_columns, live_unique in live[table]
+        ):
+            missing.append((table, name, columns, unique))
+    return missing
+
+
+def check_indexes(app):
+    """
+    Logs a warning for every hot path index missing from the database of
+    the app
+
+    Returns
+    -------
+    list
+        the missing indexes, see missing_indexes
+    """
+    with app.app_context():
+        url = db.engine.url
+        if url.get_backend_name() == "sqlite" and not (
+            url.database and os.path.exists(url.database)
+        ):
+            # do not create the database file just to look at it
+            return []
+        try:
+            missing = missing_indexes(db.engine)
+        except SQLAlchemyError as e:
+            logger.warning("Could not check the database indexes: %s", e)
+            return []
+    for table, name, columns, unique in missing:
+        logger.warning(
+            "Missing %sindex %s on %s(%s), run the database migrations",
+            "unique " if unique else "",
+            name,
+            table,
+            ", ".join(columns),
+        )
+    app.extensions["missing_indexes"] = missing
+    return missing
@@ -0,0 +1,362 @@
+"""
+Per-request SQL and template instrumentation.
+
+When the INSTRUMENTATION config is set, every request records:
+
+- the number of SQL statements and the time spent running them, from
+  the cursor events of every SQLAlchemy engine
+- statements run several times with different parameters, the mark of
+  an N+1 pattern such as a query per product card
+- the time spent rendering each template, includes and extended
+  templates counted separately, a template's time including the
+  templates it includes
+
+The numbers are sent in a Server-Timing header, shown to admins in an
+overlay at the bottom of html pages when INSTRUMENTATION_OVERLAY is set,
+and aggregated per endpoint over the last INSTRUMENTATION_WINDOW
+requests. The aggregate is served as json at /_instrumentation/summary,
+to admins only, slowest endpoints first.
+"""
+import statistics
+import threading
+import time
+from collections import Counter
+from collections import defaultdict
+from collections import deque
+
+from flask import Blueprint
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from flask import jsonify
+from flask import request
+
+from flask_login import current_user
+from jinja2 import Template
+from markupsafe import escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# statements run at least this many times in a request are reported
+DUPLICATE_MIN = 3
+# duplicate statements and templates kept per endpoint in the summary
+SUMMARY_TOP = 5
+
+instrumentation_blueprint = Blueprint(
+    "instrumentation", __name__, url_prefix="/_instrumentation"
+)
+
+_engine_hooks_installed = False
+_engine_hooks_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    Numbers recorded for one request
+    """
+
+    def __init__(self, duplicate_min=DUPLICATE_MIN):
+        self.duplicate_min = duplicate_min
+        self.started = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.templates = defaultdict(float)
+        self.template_renders = Counter()
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.sql_time += seconds
+        self.statements[statement] += 1
+
+    def add_template(self, name, seconds):
+        self.templates[name] += seconds
+        self.template_renders[name] += 1
+
+    def duplicates(self):
+        """
+        (statement, times run) of the statements run at least
+        duplicate_min times, most run first
+        """
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= self.duplicate_min
+        ]
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        Value of the Server-Timing header
+        """
+        duplicated = sum(count for _, count in self.duplicates())
+        render_time = max(self.templates.values(), default=0.0)
+        return ", ".join(
+            [
+                f'sql;dur={self.sql_time * 1000:.1f};desc="{self.queries} '
+                f'queries ({duplicated} duplicated)"',
+                f'render;dur={render_time * 1000:.1f};desc="templates"',
+                f"total;dur={self.duration * 1000:.1f}",
+            ]
+        )
+
+
+def current_profile():
+    if not has_app_context():
+        return None
+    return g.get("_request_profile")
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    # kept on the execution context, not on the pooled connection, so
+    # that a statement which raises leaves nothing behind
+    if context is not None and current_profile() is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    profile = current_profile()
+    started = getattr(context, "_instrumentation_started", None)
+    if profile is not None and started is not None:
+        profile.add_query(statement, time.perf_counter() - started)
+
+
+def install_engine_hooks():
+    """
+    Listens to the cursor events of every engine, once per process
+    """
+    global _engine_hooks_installed
+    with _engine_hooks_lock:
+        if _engine_hooks_installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _engine_hooks_installed = True
+
+
+class InstrumentedTemplate(Template):
+    """
+    Template timing its render function, which also runs when the
+    template is included or extended by another one
+    """
+
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super()._from_namespace(environment, namespace, globals)
+        render = template.root_render_func
+        name = template.name or "<string>"
+
+        def timed_render(context):
+            profile = current_profile()
+            if profile is None:
+                yield from render(context)
+                return
+            started = time.perf_counter()
+            try:
+                yield from render(context)
+            finally:
+                profile.add_template(name, time.perf_counter() - started)
+
+        template.root_render_func = timed_render
+        return template
+
+
+class EndpointStats:
+    """
+    Profiles of the last window requests of an endpoint
+    """
+
+    def __init__(self, window):
+        # total over all requests, the rest over the window
+        self.requests = 0
+        self.durations = deque(maxlen=window)
+        self.queries = deque(maxlen=window)
+        self.sql_times = deque(maxlen=window)
+        self.duplicates = deque(maxlen=window)
+        self.templates = deque(maxlen=window)
+
+    def add(self, profile):
+        self.requests += 1
+        self.durations.append(profile.duration)
+        self.queries.append(profile.queries)
+        self.sql_times.append(profile.sql_time)
+        self.duplicates.append(dict(profile.duplicates()))
+        self.templates.append(dict(profile.templates))
+
+    def summary(self):
+        durations = sorted(self.durations)
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        duplicates = Counter()
+        for counts in self.duplicates:
+            for statement, count in counts.items():
+                duplicates[statement] = max(duplicates[statement], count)
+        templates = Counter()
+        for times in self.templates:
+            templates.update(times)
+        return {
+            "requests": self.requests,
+            "window": len(durations),
+            "mean_ms": statistics.mean(durations) * 1000,
+            "p95_ms": p95 * 1000,
+            "max_ms": durations[-1] * 1000,
+            "mean_queries": statistics.mean(self.queries),
+            "max_queries": max(self.queries),
+            "mean_sql_ms": statistics.mean(self.sql_times) * 1000,
+            "duplicate_statements": [
+                {"statement": statement, "max_per_request": count}
+                for statement, count in duplicates.most_common(SUMMARY_TOP)
+            ],
+            "templates_ms": {
+                name: seconds / len(durations) * 1000
+                for name, seconds in templates.most_common(SUMMARY_TOP)
+            },
+        }
+
+
+OVERLAY = """
+<div id="instrumentation-overlay" style="position:fixed;bottom:0;right:0;
+z-index:99999;background:#222;color:#eee;font:12px monospace;
+padding:6px 10px;max-width:50%;max-height:40%;overflow:auto;opacity:.9">
+<b>{endpoint}</b> {total:.1f} ms &middot; {queries} queries in
+{sql:.1f} ms{duplicates}{templates}
+</div>
+"""
+
+
+def render_overlay(profile, endpoint):
+    duplicates = "".join(
+        f"<br>&times;{count} {escape(statement[:200])}"
+        for statement, count in profile.duplicates()
+    )
+    templates = "".join(
+        f"<br>{escape(name)} {seconds * 1000:.1f} ms"
+        for name, seconds in sorted(
+            profile.templates.items(), key=lambda item: -item[1]
+        )
+    )
+    return OVERLAY.format(
+        endpoint=escape(endpoint),
+        total=profile.duration * 1000,
+        queries=profile.queries,
+        sql=profile.sql_time * 1000,
+        duplicates=duplicates,
+        templates=templates,
+    )
+
+
+def _is_admin():
+    return current_user.is_authenticated and current_user.is_admin
+
+
+class Instrumentation:
+    """
+    Records a RequestProfile per request and aggregates them per
+    endpoint
+
+    Parameters
+    ----------
+    window: int
+        requests kept per endpoint
+    duplicate_min: int
+        times a statement must run in a request to be reported
+    overlay: bool
+        show the numbers to admins at the bottom of html pages
+    """
+
+    def __init__(self, window=200, duplicate_min=DUPLICATE_MIN, overlay=False):
+        self.window = window
+        self.duplicate_min = duplicate_min
+        self.overlay = overlay
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        install_engine_hooks()
+        app.jinja_env.template_class = InstrumentedTemplate
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.register_blueprint(instrumentation_blueprint)
+        app.extensions["instrumentation"] = self
+
+    def start(self):
+        g._request_profile = RequestProfile(self.duplicate_min)
+
+    def finish(self, response):
+        profile = g.pop("_request_profile", None)
+        if profile is None:
+            return response
+        profile.finish()
+        endpoint = request.endpoint or "<unmatched>"
+        self.record(endpoint, profile)
+        response.headers["Server-Timing"] = profile.server_timing()
+        if (
+            self.overlay
+            and response.mimetype == "text/html"
+            and not response.direct_passthrough
+            and _is_admin()
+        ):
+            self.add_overlay(response, render_overlay(profile, endpoint))
+        return response
+
+    def add_overlay(self, response, overlay):
+        html = response.get_data(as_text=True)
+        position = html.rfind("</body>")
+        if position == -1:
+            position = len(html)
+        response.set_data(html[:position] + overlay + html[position:])
+
+    def record(self, endpoint, profile):
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats(self.window)
+            stats.add(profile)
+
+    def summary(self, limit=None):
+        """
+        Aggregated profiles per endpoint, highest p95 first
+        """
+        with self._lock:
+            summaries = [
+                dict(stats.summary(), endpoint=endpoint)
+                for endpoint, stats in self.endpoints.items()
+            ]
+        summaries.sort(key=lambda summary: summary["p95_ms"], reverse=True)
+        return summaries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+
+
+@instrumentation_blueprint.route("/summary")
+def summary():
+    if not _is_admin():
+        return jsonify({"error": "admins only"}), 403
+    instrumentation = current_app.extensions["instrumentation"]
+    limit = request.args.get("limit", type=int)
+    return jsonify({"endpoints": instrumentation.summary(limit)})
+
+
+def init_instrumentation(app):
+    """
+    Instruments the app if its INSTRUMENTATION config is set
+    """
+    if not app.config.get("INSTRUMENTATION", False):
+        return None
+    instrumentation = Instrumentation(
+        window=app.config.get("INSTRUMENTATION_WINDOW", 200),
+        duplicate_min=app.config.get(
+            "INSTRUMENTATION_DUPLICATE_MIN", DUPLICATE_MIN
+        ),
+        overlay=app.config.get("INSTRUMENTATION_OVERLAY", False),
+    )
+    instrumentation.init_app(app)
+    return instrumentation
@@ -0,0 +1,422 @@
+"""
+Module manifest, generated with
+
+    shopcube manifest
+
+It lists every module of modules/ with its blueprint, its
+available_everywhere globals and the contents of its info.json, so that
+create_app and the dashboard do not have to walk the modules folder and
+parse every info.json again. The manifest is validated at startup
+against the files it was built from and ignored, with a warning, when
+they changed since.
+
+Modules whose info.json sets "lazy": true and whose blueprint only
+declares routes have their url rules recorded in the manifest. With the
+MODULES_LAZY_LOAD config set, their view module is then only imported on
+the first request to one of their urls.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import time
+
+from flask import Blueprint
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "module_manifest.json"
+AUTOMATIC_METHODS = {"HEAD", "OPTIONS"}
+
+
+def manifest_path(base_path):
+    return os.path.join(base_path, MANIFEST_NAME)
+
+
+def _stat(path):
+    """
+    Size and modification time of a file, None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _module_dirs(base_path):
+    """
+    Yields box name (None for modules outside boxes) and module name of
+    every module folder
+    """
+    modules_dir = os.path.join(base_path, "modules")
+    for folder in sorted(os.listdir(modules_dir)):
+        if folder.startswith("__"):  # ignore __pycache__
+            continue
+        if not os.path.isdir(os.path.join(modules_dir, folder)):
+            continue
+        if not folder.startswith("box__"):
+            yield None, folder
+            continue
+        for sub_folder in sorted(
+            os.listdir(os.path.join(modules_dir, folder))
+        ):
+            if sub_folder.startswith("__"):
+                continue
+            if not os.path.isdir(
+                os.path.join(modules_dir, folder, sub_folder)
+            ):
+                continue  # box_info.json
+            yield folder, sub_folder
+
+
+def _module_dir(base_path, box, name):
+    return os.path.join(base_path, "modules", *filter(None, [box, name]))
+
+
+def _signature(base_path, box, name):
+    """
+    Stats of the files the manifest entry of a module is built from
+    """
+    module_dir = _module_dir(base_path, box, name)
+    return {
+        filename: _stat(os.path.join(module_dir, filename))
+        for filename in ("info.json", "view.py", "global.py")
+    }
+
+
+def scan_modules(base_path):
+    """
+    Builds the manifest from the modules folder, without importing the
+    modules. Entries carry no url rules, hence are never lazily loaded
+
+    Returns
+    -------
+    dict
+        the manifest
+    """
+    modules = []
+    for box, name in _module_dirs(base_path):
+        module_dir = _module_dir(base_path, box, name)
+        package = ".".join(filter(None, ["modules", box, name]))
+        info = None
+        info_path = os.path.join(module_dir, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                info = json.load(f)
+        modules.append(
+            {
+                "name": name,
+                "box": box,
+                "package": package,
+                "blueprint": f"{name}_blueprint",
+                "global": os.path.exists(
+                    os.path.join(module_dir, "global.py")
+                ),
+                "globals": [],
+                "models": os.path.exists(
+                    os.path.join(module_dir, "models.py")
+                ),
+                "tasks": os.path.exists(os.path.join(module_dir, "tasks.py")),
+                "info": info,
+                "signature": _signature(base_path, box, name),
+                "lazy": False,
+                "options": None,
+                "rules": [],
+            }
+        )
+    return {"version": MANIFEST_VERSION, "modules": modules}
+
+
+def _find_attribute(module, value):
+    name = getattr(value, "__name__", None)
+    if name and getattr(module, name, None) is value:
+        return name
+    for name, attr in vars(module).items():
+        if attr is value:
+            return name
+    return None
+
+
+def _routes_only(blueprint, rule_count):
+    """
+    Whether registering the blueprint does nothing but adding its url
+    rules, i.e. it has no request hooks, app hooks, error handlers,
+    context processors, nested blueprints nor commands that lazy loading
+    would leave out
+    """
+    blank = Blueprint("blank", __name__)
+    hooks = (
+        "before_request_funcs",
+        "after_request_funcs",
+        "teardown_request_funcs",
+        "template_context_processors",
+        "url_value_preprocessors",
+        "url_default_functions",
+        "error_handler_spec",
+    )
+    return (
+        all(
+            dict(getattr(blueprint, hook)) == dict(getattr(blank, hook))
+            for hook in hooks
+        )
+        # every route records one function, app hooks record others
+        and len(blueprint.deferred_functions) == rule_count
+        and not blueprint._blueprints
+        and not blueprint.cli.commands
+    )
+
+
+def inspect_module(entry, base_path):
+    """
+    Imports a module to record its globals and, for lazy modules, the
+    url rules of its blueprint
+    """
+    if entry["global"]:
+        mod_global = importlib.import_module(f"{entry['package']}.global")
+        entry["globals"] = sorted(mod_global.available_everywhere)
+
+    view = importlib.import_module(f"{entry['package']}.view")
+    blueprint = getattr(view, entry["blueprint"])
+    if not (entry["info"] or {}).get("lazy"):
+        return entry
+
+    app = Flask(__name__)
+    app.register_blueprint(blueprint)
+    rules = []
+    for rule in app.url_map.iter_rules():
+        endpoint = rule.endpoint
+        if not endpoint.startswith(f"{blueprint.name}."):
+            continue
+        if endpoint == f"{blueprint.name}.static":
+            continue
+        attribute = _find_attribute(view, app.view_functions[endpoint])
+        if attribute is None:
+            rules = None
+            break
+        path = rule.rule
+        if blueprint.url_prefix:
+            path = path[len(blueprint.url_prefix.rstrip("/")) :]
+        rules.append(
+            {
+                "rule": path,
+                "endpoint": endpoint.split(".", 1)[1],
+                "view": attribute,
+                "methods": sorted(set(rule.methods) - AUTOMATIC_METHODS),
+                "defaults": rule.defaults,
+                "strict_slashes": rule.strict_slashes,
+            }
+        )
+
+    if rules is None or not _routes_only(blueprint, len(rules)):
+        logger.warning(
+            "Module %s asks to be lazily loaded but its blueprint does more "
+            "than declaring routes, it is loaded at startup",
+            entry["name"],
+        )
+        return entry
+
+    static_folder = None
+    if blueprint.has_static_folder:
+        static_folder = os.path.relpath(
+            blueprint.static_folder, blueprint.root_path
+        )
+    entry["lazy"] = True
+    entry["rules"] = rules
+    entry["options"] = {
+        "name": blueprint.name,
+        "root_path": os.path.relpath(blueprint.root_path, base_path),
+        "url_prefix": blueprint.url_prefix,
+        "subdomain": blueprint.subdomain,
+        "template_folder": blueprint.template_folder,
+        "static_folder": static_folder,
+        "static_url_path": blueprint.static_url_path,
+    }
+    return entry
+
+
+def build_manifest(base_path):
+    """
+    Scans and imports every module
+
+    Returns
+    -------
+    dict
+        the manifest
+    """
+    manifest = scan_modules(base_path)
+    for entry in manifest["modules"]:
+        inspect_module(entry, base_path)
+    return manifest
+
+
+def write_manifest(base_path, manifest=None):
+    if manifest is None:
+        manifest = build_manifest(base_path)
+    path = manifest_path(base_path)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    return path
+
+
+def is_valid(manifest, base_path):
+    """
+    Whether the manifest still matches the modules folder. Only stats
+    files, nothing is imported nor parsed
+    """
+    if not manifest or manifest.get("version") != MANIFEST_VERSION:
+        return False
+    entries = manifest["modules"]
+    if [(e["box"], e["name"]) for e in entries] != list(
+        _module_dirs(base_path)
+    ):
+        return False
+    return all(
+        e["signature"] == _signature(base_path, e["box"], e["name"])
+        for e in entries
+    )
+
+
+def load_manifest(base_path):
+    """
+    Manifest written by ``shopcube manifest``, or one scanned from the
+    modules folder if it is missing or out of date
+
+    Returns
+    -------
+    dict
+        the manifest
+    """
+    manifest = None
+    try:
+        with open(manifest_path(base_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        logger.info(
+            "No module manifest, run `shopcube manifest` to speed up startup"
+        )
+    else:
+        if is_valid(manifest, base_path):
+            return manifest
+        logger.warning(
+            "Module manifest is out of date and was ignored, "
+            "run `shopcube manifest` to regenerate it"
+        )
+    return scan_modules(base_path)
+
+
+class LazyView:
+    """
+    View function importing the view module of a lazy module the first
+    time it is called
+    """
+
+    def __init__(self, package, attribute):
+        self.package = package
+        self.attribute = attribute
+        self.__name__ = attribute
+        self._view = None
+
+    @property
+    def view(self):
+        if self._view is None:
+            view = importlib.import_module(f"{self.package}.view")
+            self._view = getattr(view, self.attribute)
+        return self._view
+
+    def __call__(self, *args, **kwargs):
+        return self.view(*args, **kwargs)
+
+
+def make_lazy_blueprint(entry, base_path):
+    """
+    Blueprint with the name, templates, static files and url rules of
+    a lazy module, dispatching to views imported on first use
+    """
+    options = dict(entry["options"])
+    name = options.pop("name")
+    options["root_path"] = os.path.join(base_path, options["root_path"])
+    blueprint = Blueprint(name, f"{entry['package']}.view", **options)
+    for rule in entry["rules"]:
+        blueprint.add_url_rule(
+            rule["rule"],
+            endpoint=rule["endpoint"],
+            view_func=LazyView(entry["package"], rule["view"]),
+            methods=rule["methods"],
+            defaults=rule["defaults"],
+            strict_slashes=rule["strict_slashes"],
+        )
+    return blueprint
+
+
+def register_modules(app, manifest, base_path, lazy=False):
+    """
+    Registers the blueprints of the manifest modules on the app. The
+    seconds spent importing and registering each module are kept in
+    app.extensions["module_load_times"]
+
+    Parameters
+    ----------
+    lazy: bool
+        defer importing the views of lazy modules
+
+    Returns
+    -------
+    dict
+        available_everywhere globals of all modules
+    """
+    available_everywhere = {}
+    load_times = app.extensions.setdefault("module_load_times", {})
+    for entry in manifest["modules"]:
+        started = time.perf_counter()
+        package = entry["package"]
+        if lazy and entry["lazy"]:
+            # models and tasks are still needed by migrations and workers
+            for submodule in ("models", "tasks"):
+                if entry[submodule]:
+                    importlib.import_module(f"{package}.{submodule}")
+            blueprint = make_lazy_blueprint(entry, base_path)
+        else:
+            view = importlib.import_module(f"{package}.view")
+            blueprint = getattr(view, entry["blueprint"])
+        app.register_blueprint(blueprint)
+
+        if entry["global"]:
+            mod_global = importlib.import_module(f"{package}.global")
+            available_everywhere.update(mod_global.available_everywhere)
+        load_times[package] = time.perf_counter() - started
+        logger.debug("Loaded module %s", package)
+    return available_everywhere
+
+
+def main(argv, base_path):
+    parser = argparse.ArgumentParser(prog="shopcube manifest")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with status 1 if the manifest is missing or out of date",
+    )
+    args = parser.parse_args(argv)
+
+    if args.check:
+        try:
+            with open(manifest_path(base_path)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if not is_valid(manifest, base_path):
+            print("module manifest is missing or out of date")
+            return 1
+        print("module manifest is up to date")
+        return 0
+
+    manifest = build_manifest(base_path)
+    path = write_manifest(base_path, manifest)
+    lazy = [e["name"] for e in manifest["modules"] if e["lazy"]]
+    print(f"wrote {len(manifest['modules'])} modules to {path}")
+    if lazy:
+        print("lazily loadable:", ", ".join(lazy))
+    return 0
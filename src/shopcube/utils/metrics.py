@@ -0,0 +1,332 @@
+"""
+Metrics in the Prometheus text format, correct across worker processes.
+
+Counters, gauges and histograms are declared once on the process wide
+registry and updated in memory:
+
+    registry.counter("shopcube_orders_placed_total", "Orders placed")
+    registry.inc("shopcube_orders_placed_total")
+
+With gunicorn every worker has its own registry. When the registry has a
+directory, configured with METRICS_DIR, each process writes its values to
+its own file there, at most every flush_interval seconds, and the
+process answering a scrape adds up the files of all the processes.
+Counters and histograms of processes that exited are kept, gauges only
+count live processes. Like the files of prometheus_client's
+multiprocess mode, the directory should be emptied when the app is
+deployed.
+
+Only the standard library is used.
+"""
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+# seconds, for request latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    def __init__(self, name, kind, documentation, labelnames, buckets):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes the labels {', '.join(self.labelnames)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+        + "}"
+    )
+
+
+def format_metric(metric, samples):
+    """
+    Text exposition lines of a metric
+
+    Parameters
+    ----------
+    metric: Metric
+    samples: dict
+        label values -> value, or for histograms list of bucket counts
+        followed by the sum and the count
+    """
+    lines = [
+        f"# HELP {metric.name} {metric.documentation}",
+        f"# TYPE {metric.name} {metric.kind}",
+    ]
+    for key, value in sorted(samples.items()):
+        if metric.kind != "histogram":
+            labels = _labels(metric.labelnames, key)
+            lines.append(f"{metric.name}{labels} {_format_value(value)}")
+            continue
+        cumulative = 0
+        for bound, count in zip(metric.buckets + (math.inf,), value):
+            cumulative += count
+            labels = _labels(
+                metric.labelnames, key, ("le", _format_value(bound))
+            )
+            lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+        labels = _labels(metric.labelnames, key)
+        lines.append(f"{metric.name}_sum{labels} {_format_value(value[-2])}")
+        lines.append(f"{metric.name}_count{labels} {value[-1]}")
+    return lines
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process, see the module docstring
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.directory = None
+        self.flush_interval = 1.0
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._values = {}
+        self._pid = os.getpid()
+        # a pid can be reused, the token keeps files of processes apart
+        self._token = uuid.uuid4().hex[:8]
+        self._flushed_at = 0.0
+
+    def _check_fork(self):
+        # values inherited from the master are not this worker's
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def configure(self, directory=None, flush_interval=1.0):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+    #
+    # declaration
+    #
+
+    def _declare(self, name, kind, documentation, labelnames, buckets=None):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(
+                    name, kind, documentation, labelnames, buckets
+                )
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"{name} is already declared differently")
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._declare(name, "counter", documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._declare(name, "gauge", documentation, labelnames)
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        return self._declare(
+            name, "histogram", documentation, labelnames, sorted(buckets)
+        )
+
+    def add_collector(self, name, func):
+        """
+        Registers a function, called with the registry before the values
+        are written or collected, to copy in values kept elsewhere with
+        set. A collector replaces the previous one of the same name
+        """
+        self._collectors[name] = func
+
+    #
+    # updates
+    #
+
+    def _samples(self, metric):
+        return self._values.setdefault(metric.name, {})
+
+    def inc(self, name, amount=1, **labels):
+        metric = self.metrics[name]
+        key = metric.key(labels)
+        with self._lock:
+            self._check_fork()
+            samples = self._samples(metric)
+            samples[key] = samples.get(key, 0) + amount
+
+    def dec(self, name, amount=1, **labels):
+        self.inc(name, -amount, **labels)
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge, or a counter totalled elsewhere in the process
+        """
+        metric = self.metrics[name]
+        key = metric.key(labels)
+        with self._lock:
+            self._check_fork()
+            self._samples(metric)[key] = value
+
+    def observe(self, name, value, **labels):
+        metric = self.metrics[name]
+        key = metric.key(labels)
+        with self._lock:
+            self._check_fork()
+            samples = self._samples(metric)
+            counts = samples.get(key)
+            if counts is None:
+                counts = samples[key] = [0] * (len(metric.buckets) + 3)
+            for i, bound in enumerate(metric.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(metric.buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    #
+    # collection
+    #
+
+    def snapshot(self):
+        """
+        Values of this process, metric name -> label values -> value
+        """
+        for collector in list(self._collectors.values()):
+            collector(self)
+        with self._lock:
+            self._check_fork()
+            return {
+                name: {
+                    key: list(value) if isinstance(value, list) else value
+                    for key, value in samples.items()
+                }
+                for name, samples in self._values.items()
+            }
+
+    def _path(self):
+        return os.path.join(self.directory, f"{self._pid}-{self._token}.json")
+
+    def flush(self, force=False):
+        """
+        Writes the values of this process to the directory, at most every
+        flush_interval seconds unless forced
+        """
+        if self.directory is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        snapshot = self.snapshot()
+        data = {
+            "pid": self._pid,
+            "values": {
+                name: [[list(key), value] for key, value in samples.items()]
+                for name, samples in snapshot.items()
+            },
+        }
+        path = self._path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _merge(self, total, name, key, value):
+        samples = total.setdefault(name, {})
+        if isinstance(value, list):
+            current = samples.get(key)
+            if current is None:
+                samples[key] = list(value)
+            elif len(current) == len(value):
+                samples[key] = [a + b for a, b in zip(current, value)]
+        else:
+            samples[key] = samples.get(key, 0) + value
+
+    def collect(self):
+        """
+        Values of all the processes, metric name -> label values -> value
+        """
+        if self.directory is None:
+            return self.snapshot()
+        self.flush(force=True)
+        total = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed or replaced meanwhile
+            alive = data["pid"] == self._pid or _pid_alive(data["pid"])
+            for name, samples in data["values"].items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                for key, value in samples:
+                    self._merge(total, name, tuple(key), value)
+        return total
+
+    def render(self):
+        """
+        Metrics of all the processes in the Prometheus text format
+        """
+        values = self.collect()
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(
+                format_metric(self.metrics[name], values.get(name, {}))
+            )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# incremented by the caches of several modules, told apart by label
+registry.counter(
+    "shopcube_cache_requests_total",
+    "Cache lookups by result, hit or miss",
+    ("cache", "result"),
+)
@@ -0,0 +1,506 @@
+"""
+Full-page cache of the storefront for anonymous visitors.
+
+When the PAGE_CACHE config is set, GET requests to PAGE_CACHE_ENDPOINTS
+made by a visitor who is not logged in and whose session holds nothing
+but a csrf token and empty values, so no cart, wishlist or flashed
+message, are answered from the cache. Pages are keyed by host, path,
+sorted query string and active front theme, and kept PAGE_CACHE_TTL
+seconds at most.
+
+The ETag and Last-Modified validators of a page (see
+utils/conditional.py) are stored with it, so that a visitor whose copy
+is still current gets a 304 Not Modified from the cache too.
+
+Each page is tagged with what it was built from, e.g. product:12 or
+category:3, by tag_page while it renders, and purge_tags drops every
+page carrying one of the tags. A purge only records the time at which
+the tag was purged: a page is served if it was rendered after the last
+purge of all its tags, which works the same whatever the backend and
+however many processes share it. Every page carries SITE_TAG, purged
+when a setting changes.
+
+The csrf token of the visitor rendering a page is replaced by a
+placeholder before it is stored, and each visitor served the page gets
+their own token in its place.
+
+Backends, selected with PAGE_CACHE_BACKEND:
+
+- "memory": an LRU dict of the process bounded by PAGE_CACHE_MAX_ENTRIES
+  and PAGE_CACHE_MAX_BYTES
+- "filesystem": files in PAGE_CACHE_DIR, shared by the processes of a
+  host
+- "redis": a redis server at PAGE_CACHE_URL, shared by all hosts. Any
+  client with the get, set, delete and mget methods of redis-py can be
+  passed to RedisPageBackend instead
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from flask import request
+from flask import session
+
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+
+SITE_TAG = "site"
+CACHED_ENDPOINTS = (
+    "shop.homepage",
+    "shop.product",
+    "shop.category",
+    "shop.subcategory",
+)
+# session keys a cacheable visitor may have, other keys must be empty
+ANONYMOUS_SESSION_KEYS = {"csrf_token", "_fresh", "_permanent"}
+# response headers stored with a page
+VALIDATOR_HEADERS = ("ETag", "Last-Modified", "Cache-Control")
+STORED_HEADERS = ("Content-Type", "Content-Language") + VALIDATOR_HEADERS
+CSRF_PLACEHOLDER = b"<!--page-cache-csrf-token-->"
+
+
+class MemoryPageBackend:
+    """
+    Pages kept in a dict of the process, the least recently used ones
+    being dropped past max_entries pages or max_bytes of page bodies
+
+    Parameters
+    ----------
+    max_entries: int
+    max_bytes: int
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._pages = OrderedDict()
+        self._purged = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                return None
+            if page["expires"] <= time.time():
+                self._drop(key)
+                return None
+            self._pages.move_to_end(key)
+            return page
+
+    def _drop(self, key):
+        page = self._pages.pop(key)
+        self.size -= len(page["body"])
+
+    def set(self, key, page):
+        if len(page["body"]) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pages:
+                self._drop(key)
+            self._pages[key] = page
+            self.size += len(page["body"])
+            while (
+                len(self._pages) > self.max_entries
+                or self.size > self.max_bytes
+            ):
+                self._drop(next(iter(self._pages)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._pages:
+                self._drop(key)
+
+    def purge_times(self, tags):
+        return {tag: self._purged.get(tag, 0.0) for tag in tags}
+
+    def purge(self, tags, now):
+        with self._lock:
+            for tag in tags:
+                self._purged[tag] = now
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+class FileSystemPageBackend:
+    """
+    Pages pickled to files of a directory, with one more file per purged
+    tag holding the time of its last purge
+
+    Parameters
+    ----------
+    directory: str
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tags_directory = os.path.join(directory, "tags")
+        os.makedirs(self.tags_directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                page = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if page["expires"] <= time.time():
+            self.delete(key)
+            return None
+        return page
+
+    def set(self, key, page):
+        self._write(self._path(key), pickle.dumps(page))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def purge_times(self, tags):
+        times = {}
+        for tag in tags:
+            try:
+                with open(
+                    os.path.join(self.tags_directory, _digest(tag)), "rb"
+                ) as f:
+                    times[tag] = float(f.read())
+            except (OSError, ValueError):
+                times[tag] = 0.0
+        return times
+
+    def purge(self, tags, now):
+        for tag in tags:
+            self._write(
+                os.path.join(self.tags_directory, _digest(tag)),
+                repr(now).encode("ascii"),
+            )
+
+
+class RedisPageBackend:
+    """
+    Pages stored in redis, expiring with their ttl. Purge times are
+    stored without a ttl, so that the volatile eviction policies never
+    drop them and bring stale pages back
+
+    Parameters
+    ----------
+    client: object
+        redis.Redis or anything with its get, set, delete and mget
+        methods
+    prefix: str
+        prefix of the keys, for several shops on a server
+    """
+
+    def __init__(self, client, prefix="shopcube:page:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def set(self, key, page):
+        ttl = max(int(page["expires"] - time.time()), 1)
+        self.client.set(self.prefix + key, pickle.dumps(page), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def purge_times(self, tags):
+        tags = list(tags)
+        values = self.client.mget([f"{self.prefix}tag:{tag}" for tag in tags])
+        return {
+            tag: float(value) if value is not None else 0.0
+            for tag, value in zip(tags, values)
+        }
+
+    def purge(self, tags, now):
+        for tag in tags:
+            self.client.set(f"{self.prefix}tag:{tag}", repr(now))
+
+
+def anonymous_session():
+    """
+    Whether the session has no cart, wishlist, flashed message or other
+    data changing the pages
+    """
+    return not any(
+        value
+        for key, value in session.items()
+        if key not in ANONYMOUS_SESSION_KEYS
+    )
+
+
+def current_capture():
+    """
+    Tags of the page being rendered for the cache, None when the
+    response will not be cached
+    """
+    if not has_app_context():
+        return None
+    return g.get("_page_cache_tags")
+
+
+def tag_page(*tags):
+    """
+    Marks the page being rendered as depending on tags
+    """
+    tags_of_page = current_capture()
+    if tags_of_page is not None:
+        tags_of_page.update(tags)
+
+
+def get_page_cache(app=None):
+    app = app or current_app
+    return app.extensions.get("page_cache")
+
+
+def purge_tags(*tags):
+    """
+    Drops the cached pages carrying one of tags, now
+    """
+    cache = get_page_cache() if has_app_context() else None
+    if cache is not None and tags:
+        cache.purge(tags)
+
+
+def purge_on_commit(session, tags):
+    """
+    Drops the cached pages carrying one of tags when the session commits
+    """
+    session.info.setdefault("page_cache_purge", set()).update(tags)
+
+
+@event.listens_for(Session, "after_commit")
+def _purge_committed_tags(session):
+    tags = session.info.pop("page_cache_purge", None)
+    if tags:
+        purge_tags(*tags)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_purged_tags(session, previous_transaction):
+    session.info.pop("page_cache_purge", None)
+
+
+class PageCache:
+    """
+    Parameters
+    ----------
+    backend: object
+        MemoryPageBackend, FileSystemPageBackend, RedisPageBackend or any
+        object with the same get, set, delete, purge_times and purge
+        methods
+    ttl: float
+        seconds a page is kept at most
+    endpoints: iterable
+        endpoints whose pages are cached
+    vary: callable
+        returns a string added to the key of every page, e.g. the name of
+        the active theme
+    """
+
+    def __init__(
+        self, backend, ttl=300, endpoints=CACHED_ENDPOINTS, vary=None
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.endpoints = set(endpoints)
+        self.vary = vary
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "stale": 0}
+
+    def init_app(self, app):
+        app.extensions["page_cache"] = self
+        app.before_request(self.serve)
+        app.after_request(self.store)
+
+    def cacheable(self):
+        if request.method not in ("GET", "HEAD"):
+            return False
+        if request.endpoint not in self.endpoints:
+            return False
+        if current_user.is_authenticated:
+            return False
+        return anonymous_session()
+
+    def key(self):
+        query = "&".join(
+            f"{name}={value}"
+            for name, value in sorted(request.args.items(multi=True))
+        )
+        return _digest(
+            "\n".join(
+                [
+                    request.host,
+                    request.path,
+                    query,
+                    self.vary() if self.vary is not None else "",
+                ]
+            )
+        )
+
+    def fresh(self, page):
+        purged = self.backend.purge_times(page["tags"])
+        return all(when < page["rendered"] for when in purged.values())
+
+    def serve(self):
+        if not self.cacheable():
+            return None
+        key = self.key()
+        page = self.backend.get(key)
+        if page is not None:
+            if self.fresh(page):
+                self.stats["hits"] += 1
+                return self._response(page)
+            self.stats["stale"] += 1
+            self.backend.delete(key)
+        self.stats["misses"] += 1
+        g._page_cache_key = key
+        g._page_cache_started = time.time()
+        g._page_cache_tags = {SITE_TAG}
+        return None
+
+    def _not_modified(self, page):
+        headers = dict(page["headers"])
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return None
+        if is_resource_modified(
+            request.environ,
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+        ):
+            return None
+        response = Response(status=304)
+        for name in VALIDATOR_HEADERS:
+            if name in headers:
+                response.headers[name] = headers[name]
+        return response
+
+    def _response(self, page):
+        response = self._not_modified(page)
+        if response is not None:
+            response.headers["X-Page-Cache"] = "hit"
+            return response
+        body = page["body"]
+        if CSRF_PLACEHOLDER in body:
+            body = body.replace(
+                CSRF_PLACEHOLDER, generate_csrf().encode("ascii")
+            )
+        response = Response(body, status=page["status"])
+        for name, value in page["headers"]:
+            response.headers[name] = value
+        response.headers["X-Page-Cache"] = "hit"
+        return response
+
+    def store(self, response):
+        key = g.pop("_page_cache_key", None)
+        tags = g.pop("_page_cache_tags", None)
+        if key is None:
+            return response
+        response.headers["X-Page-Cache"] = "miss"
+        if (
+            response.status_code != 200
+            or response.mimetype != "text/html"
+            or response.is_streamed
+            or "Set-Cookie" in response.headers
+            # the view put a flash message or a cart in the session
+            or not anonymous_session()
+        ):
+            return response
+        body = response.get_data()
+        token = g.get("csrf_token")
+        if token:
+            body = body.replace(token.encode("ascii"), CSRF_PLACEHOLDER)
+        self.backend.set(
+            key,
+            {
+                "status": response.status_code,
+                "headers": [
+                    (name, response.headers[name])
+                    for name in STORED_HEADERS
+                    if name in response.headers
+                ],
+                "body": body,
+                "tags": sorted(tags),
+                "rendered": g.pop("_page_cache_started"),
+                "expires": time.time() + self.ttl,
+            },
+        )
+        self.stats["stored"] += 1
+        return response
+
+    def purge(self, tags):
+        self.backend.purge(tags, time.time())
+
+
+def make_backend(app):
+    kind = app.config.get("PAGE_CACHE_BACKEND", "memory")
+    if kind == "memory":
+        return MemoryPageBackend(
+            app.config.get("PAGE_CACHE_MAX_ENTRIES", 1000),
+            app.config.get("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+        )
+    if kind == "filesystem":
+        directory = app.config.get("PAGE_CACHE_DIR") or os.path.join(
+            app.instance_path, "page_cache"
+        )
+        return FileSystemPageBackend(directory)
+    if kind == "redis":
+        import redis
+
+        return RedisPageBackend(
+            redis.Redis.from_url(app.config["PAGE_CACHE_URL"])
+        )
+    raise ValueError(f"Unknown PAGE_CACHE_BACKEND {kind}")
+
+
+def active_front_theme():
+    from modules.box__default.settings.helpers import get_setting
+
+    return str(get_setting("ACTIVE_FRONT_THEME"))
+
+
+def init_page_cache(app):
+    """
+    Installs the page cache when PAGE_CACHE is set. Called once the
+    modules are registered so that their before request hooks, e.g. the
+    metrics, also run for the pages served from the cache
+    """
+    if not app.config.get("PAGE_CACHE", False):
+        return None
+    cache = PageCache(
+        make_backend(app),
+        ttl=app.config.get("PAGE_CACHE_TTL", 300),
+        endpoints=app.config.get("PAGE_CACHE_ENDPOINTS", CACHED_ENDPOINTS),
+        vary=active_front_theme,
+    )
+    cache.init_app(app)
+    return cache
@@ -0,0 +1,45 @@
+"""
+Comparison of measurements against a saved baseline, shared by the
+startup profiler (utils/startup_profile.py) and the benchmark runner
+(benchmarks/runner.py).
+
+Only the standard library is imported here, so that the startup profiler
+does not change what it measures.
+"""
+
+
+def is_slower(current, baseline, tolerance, min_delta):
+    """
+    Whether a measurement grew by more than tolerance, the part of the
+    baseline it may grow by, and by more than min_delta, below which
+    differences are noise
+    """
+    return current - baseline > max(baseline * tolerance, min_delta)
+
+
+def slower_values(current, baseline, tolerance, min_delta, message):
+    """
+    Regressions of measurements against their baseline
+
+    Parameters
+    ----------
+    current: dict
+        name -> measurement, compared in the order of the dict
+    baseline: dict
+        name -> measurement, a missing name counting as 0
+    message: str
+        format of a regression, given name, before and after
+
+    Returns
+    -------
+    list
+        messages, empty if there is no regression
+    """
+    regressions = []
+    for name, after in current.items():
+        before = baseline.get(name, 0.0)
+        if is_slower(after, before, tolerance, min_delta):
+            regressions.append(
+                message.format(name=name, before=before, after=after)
+            )
+    return regressions
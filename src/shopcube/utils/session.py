@@ -1,7 +1,10 @@
 import copy
 
+from flask import g
 from flask import session
 
+from sqlalchemy.orm import selectinload
+
 from modules.box__ecommerce.product.models import Product
 
 
@@ -54,11 +57,68 @@ class Cart:
     def _num_items(cls):
         return sum(cls.items_quantity(barcode) for barcode in cls._data())
 
+    @classmethod
+    def _products_memo(cls):
+        """
+        barcode -> Product (or None if no such product) resolved during
+        the current request
+        """
+        if "cart_products" not in g:
+            g.cart_products = {}
+        return g.cart_products
+
+    @classmethod
+    def forget_products(cls):
+        g.pop("cart_products", None)
+
+    @classmethod
+    def resolve(cls, barcodes, load_variants=False):
+        """
+        Resolves barcodes to products with a single IN query, reusing the
+        rows already resolved during the request
+
+        Parameters
+        ----------
+        barcodes: iterable
+            barcodes to resolve
+        load_variants: bool
+            also load sizes and colors of the products, as needed
+            by the cart page
+
+        Returns
+        -------
+        dict
+            barcode -> Product, or None if the barcode does not exist
+        """
+        memo = cls._products_memo()
+        barcodes = set(barcodes)
+        missing = barcodes - memo.keys()
+        if missing:
+            query = Product.query.filter(Product.barcode.in_(missing))
+            if load_variants:
+                query = query.options(
+                    selectinload(Product.sizes), selectinload(Product.colors)
+                )
+            for product in query.all():
+                memo.setdefault(product.barcode, product)
+            for barcode in missing:
+                memo.setdefault(barcode, None)
+        return {barcode: memo[barcode] for barcode in barcodes}
+
+    @classmethod
+    def products(cls, load_variants=False):
+        return cls.resolve(cls._data(), load_variants=load_variants)
+
+    @classmethod
+    def get_product(cls, barcode):
+        return cls.resolve([barcode])[barcode]
+
     @classmethod
     def _total_price(cls):
         cart_total_price = 0
-        for barcode in cls._data():
-            product = Product.query.filter_by(barcode=barcode).first()
+        for barcode, product in cls.products().items():
+            if product is None:
+                continue
             cart_total_price += (
                 cls.items_quantity(barcode) * product.selling_price
             )
@@ -115,7 +175,7 @@ class Cart:
             'size': 'XL'
         }
         """
-        product = Product.query.filter_by(barcode=barcode).first()
+        product = cls.get_product(barcode)
         if cls.has_barcode(barcode):
             has_order = cls.has_order(barcode, item_info)
             if has_order:
@@ -157,10 +217,15 @@ class Cart:
         """
         cls.reset()
 
+        cls.resolve(
+            form_dict[key].strip()
+            for key in form_dict
+            if key.startswith("barcode")
+        )
+
         for key in form_dict:
             if key.startswith("barcode"):
                 barcode = form_dict[key].strip()
-                product = Product.query.get(barcode)
 
                 number = key.split("_")[1]
 
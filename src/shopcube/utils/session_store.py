@@ -0,0 +1,406 @@
+"""
+Server-side sessions.
+
+The session cookie only carries a random session id, the session data
+(cart, wishlist, checkout details, login and csrf tokens) is kept by a
+backend selected with the SESSION_BACKEND config:
+
+- "sql": the sessions table of the app database
+- "memory": an in-process LRU dict, for tests and single process setups
+- "cookie": Flask's default signed cookie session
+
+Sessions are serialized with Flask's tagged json in compact form, and
+compressed with zlib past SESSION_COMPRESS_MIN bytes. A session is only
+written back when its serialized form changed, or when its expiry must
+be pushed back, so most requests do not write at all. Expired sessions
+are deleted in bulk every SESSION_GC_INTERVAL seconds.
+
+Logging in or out gives the session a new id, the record of the old one
+being deleted, so that an id planted in a visitor's browser before they
+log in is worthless afterwards.
+"""
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import session as current_session
+from flask.sessions import SecureCookieSession
+from flask.sessions import SessionInterface
+from flask.sessions import session_json_serializer
+
+from flask_login import user_logged_in
+from flask_login import user_logged_out
+from sqlalchemy import delete
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import update
+
+from init import db
+
+SID_BYTES = 32
+
+
+class SessionRecord(db.Model):
+    __tablename__ = "sessions"
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+
+def dumps(data, compress_min=1024):
+    """
+    Compact bytes of a session dict, prefixed with j for plain json or z
+    for zlib compressed json
+    """
+    raw = session_json_serializer.dumps(data).encode("utf-8")
+    if len(raw) >= compress_min:
+        return b"z" + zlib.compress(raw)
+    return b"j" + raw
+
+
+def loads(blob):
+    blob = bytes(blob)
+    if blob[:1] == b"z":
+        return session_json_serializer.loads(zlib.decompress(blob[1:]))
+    return session_json_serializer.loads(blob[1:])
+
+
+class SQLSessionBackend:
+    """
+    Sessions stored in the sessions table. Statements run on their own
+    connection so that saving a session never commits, nor is rolled
+    back with, the work of the request
+
+    Parameters
+    ----------
+    engine: Engine
+        optional, defaults to the engine of the app database
+    """
+
+    table = SessionRecord.__table__
+
+    def __init__(self, engine=None):
+        self._engine = engine
+
+    @property
+    def engine(self):
+        return self._engine if self._engine is not None else db.engine
+
+    def load(self, sid):
+        """
+        Returns
+        -------
+        tuple
+            stored bytes and expiry, None if there is no such session or
+            it expired
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(self.table.c.data, self.table.c.expires).where(
+                    self.table.c.id == sid
+                )
+            ).first()
+        if row is None or row.expires <= datetime.now():
+            return None
+        return bytes(row.data), row.expires
+
+    def save(self, sid, blob, expires):
+        values = {"data": blob, "expires": expires}
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                update(self.table)
+                .where(self.table.c.id == sid)
+                .values(**values)
+            ).rowcount
+            if not updated:
+                connection.execute(insert(self.table).values(id=sid, **values))
+
+    def touch(self, sid, expires):
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(self.table)
+                .where(self.table.c.id == sid)
+                .values(expires=expires)
+            )
+
+    def delete(self, sid):
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(self.table).where(self.table.c.id == sid)
+            )
+
+    def gc(self, now=None):
+        """
+        Deletes expired sessions with a single statement
+
+        Returns
+        -------
+        int
+            number of sessions deleted
+        """
+        now = now or datetime.now()
+        with self.engine.begin() as connection:
+            return connection.execute(
+                delete(self.table).where(self.table.c.expires <= now)
+            ).rowcount
+
+
+class MemorySessionBackend:
+    """
+    Sessions kept in a dict of the process, the least recently used
+    ones being dropped past max_entries
+
+    Parameters
+    ----------
+    max_entries: int
+        number of sessions kept
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def load(self, sid):
+        with self._lock:
+            stored = self._sessions.get(sid)
+            if stored is None:
+                return None
+            if stored[1] <= datetime.now():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return stored
+
+    def save(self, sid, blob, expires):
+        with self._lock:
+            self._sessions[sid] = (blob, expires)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def touch(self, sid, expires):
+        with self._lock:
+            stored = self._sessions.get(sid)
+            if stored is not None:
+                self._sessions[sid] = (stored[0], expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def gc(self, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            expired = [
+                sid
+                for sid, (_, expires) in self._sessions.items()
+                if expires <= now
+            ]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+
+class ServerSession(SecureCookieSession):
+    """
+    Session dict with the id it is stored under and the bytes it was
+    loaded from, to find out whether it changed
+    """
+
+    def __init__(self, initial=None, sid=None, stored=None, expires=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.stored = stored
+        self.expires = expires
+        # id to delete when the session is saved under a new one
+        self.previous_sid = None
+
+    @property
+    def new(self):
+        return self.stored is None
+
+    def regenerate(self):
+        """
+        Saves the session under a new id, deleting the current record
+        """
+        if self.sid and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.stored = None
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Flask session interface storing sessions in a backend
+
+    Parameters
+    ----------
+    backend: object
+        SQLSessionBackend, MemorySessionBackend or any object with the
+        same load, save, touch, delete and gc methods
+    """
+
+    session_class = ServerSession
+
+    def __init__(self, backend, compress_min=1024, gc_interval=3600):
+        self.backend = backend
+        self.compress_min = compress_min
+        self.gc_interval = gc_interval
+        self._next_gc = time.monotonic() + gc_interval
+        self._gc_lock = threading.Lock()
+        self.stats = {"loads": 0, "writes": 0, "touches": 0, "skipped": 0}
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime
+
+    def open_session(self, app, request):
+        # static files never use the session, do not load it for them
+        if request.path.startswith(f"{app.static_url_path}/"):
+            return self.session_class()
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self.backend.load(sid)
+            self.stats["loads"] += 1
+            if stored is not None:
+                blob, expires = stored
+                try:
+                    data = loads(blob)
+                except ValueError:
+                    data = None
+                if data is not None:
+                    return self.session_class(
+                        data, sid=sid, stored=blob, expires=expires
+                    )
+            # unknown or expired ids are not reused so that a session id
+            # cannot be chosen by the client, sid is only kept to drop
+            # the cookie
+            return self.session_class(sid=sid)
+        return self.session_class()
+
+    def _should_touch(self, app, session):
+        lifetime = self._lifetime(app)
+        return session.expires - datetime.now() < lifetime / 2
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        self.collect_garbage()
+
+        previous_sid = session.previous_sid
+        if previous_sid:
+            self.backend.delete(previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if not session.new:
+                self.backend.delete(session.sid)
+            if session.sid or previous_sid:
+                response.delete_cookie(
+                    name,
+                    domain=domain,
+                    path=path,
+                    secure=secure,
+                    samesite=samesite,
+                    httponly=httponly,
+                )
+            return
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        new = session.new
+        if new:
+            session.sid = secrets.token_urlsafe(SID_BYTES)
+
+        blob = dumps(dict(session), self.compress_min)
+        expires = datetime.now() + self._lifetime(app)
+        if blob != session.stored:
+            self.backend.save(session.sid, blob, expires)
+            self.stats["writes"] += 1
+        elif self._should_touch(app, session):
+            self.backend.touch(session.sid, expires)
+            self.stats["touches"] += 1
+        else:
+            self.stats["skipped"] += 1
+            expires = session.expires
+        session.stored = blob
+        session.expires = expires
+
+        if new or (session.permanent and self.should_set_cookie(app, session)):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+
+    def collect_garbage(self, force=False):
+        """
+        Deletes the expired sessions if gc_interval seconds passed since
+        it was last done by this process
+
+        Returns
+        -------
+        int
+            number of sessions deleted, None if it was not time yet
+        """
+        now = time.monotonic()
+        with self._gc_lock:
+            if not force and now < self._next_gc:
+                return None
+            self._next_gc = now + self.gc_interval
+        return self.backend.gc()
+
+
+def regenerate_session(sender, **extra):
+    """
+    Receiver of the flask_login user_logged_in and user_logged_out
+    signals, giving the session a new id against session fixation
+    """
+    if isinstance(current_session, ServerSession):
+        current_session.regenerate()
+
+
+def make_backend(app):
+    kind = app.config.get("SESSION_BACKEND", "sql")
+    if kind == "sql":
+        return SQLSessionBackend()
+    if kind == "memory":
+        return MemorySessionBackend(
+            app.config.get("SESSION_MEMORY_MAX", 10000)
+        )
+    raise ValueError(f"Unknown SESSION_BACKEND {kind}")
+
+
+def init_session_store(app):
+    """
+    Installs the server-side session interface unless SESSION_BACKEND is
+    cookie
+    """
+    if app.config.get("SESSION_BACKEND", "sql") == "cookie":
+        return
+    app.session_interface = ServerSessionInterface(
+        make_backend(app),
+        compress_min=app.config.get("SESSION_COMPRESS_MIN", 1024),
+        gc_interval=app.config.get("SESSION_GC_INTERVAL", 3600),
+    )
+    user_logged_in.connect(regenerate_session, app)
+    user_logged_out.connect(regenerate_session, app)
@@ -0,0 +1,251 @@
+"""
+Startup profiler, run with
+
+    shopcube profile-startup [--runs N] [--url URL] [--top N]
+                             [--baseline FILE] [--save-baseline FILE]
+
+Every run starts a fresh interpreter with -X importtime that imports app
+like the wsgi servers do, then serves a first request with the test
+client. The report gives the import time of every top level package,
+the time spent loading each module of modules/, and the time from
+interpreter start to the first response. Medians are reported over the
+runs.
+
+With --baseline the report is compared to one saved with
+--save-baseline and the command exits with status 1 when startup got
+slower by more than the tolerance, or when one of HEAVY_MODULES is now
+imported at startup.
+
+Only the standard library is imported here, so that the profiler does
+not change what it measures.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from utils.regressions import slower_values
+
+# should only be imported when first used, never at startup
+HEAVY_MODULES = ("pandas", "numpy", "PIL", "openpyxl")
+# differences below this many seconds are noise
+MIN_DELTA = 0.05
+REPORT_PREFIX = "startup-profile:"
+
+CHILD_CODE = """
+from utils.startup_profile import profile_child
+profile_child({url!r})
+"""
+
+
+def profile_child(url):
+    """
+    Runs in the profiled interpreter. Prints the timings as json on
+    stdout
+    """
+    started = time.perf_counter()
+    import app as app_module
+
+    imported = time.perf_counter()
+
+    status = None
+    if url is not None:
+        response = app_module.app.test_client().get(url)
+        status = response.status_code
+    served = time.perf_counter()
+
+    report = {
+        "import_app": imported - started,
+        "first_request": served - imported,
+        "ready_at": time.time(),
+        "status": status,
+        "module_load": app_module.app.extensions.get("module_load_times", {}),
+        "heavy_modules": sorted(
+            name for name in HEAVY_MODULES if name in sys.modules
+        ),
+    }
+    print(REPORT_PREFIX + json.dumps(report), flush=True)
+
+
+def parse_importtime(lines):
+    """
+    Import time per top level package from the -X importtime output
+
+    Parameters
+    ----------
+    lines: iterable
+        stderr lines of the interpreter
+
+    Returns
+    -------
+    dict
+        package -> seconds spent importing its modules, the self time of
+        each module being counted once
+    """
+    packages = defaultdict(float)
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, _, name = line[len("import time:") :].split("|")
+            self_us = int(self_us)
+        except ValueError:
+            continue  # header
+        packages[name.strip().split(".")[0]] += self_us / 1e6
+    return dict(packages)
+
+
+def profile_once(base_path, url="/"):
+    """
+    Profiles the startup of one interpreter
+
+    Returns
+    -------
+    dict
+        total, import_app and first_request seconds, status of the first
+        response, import time per package, load time per module and the
+        heavy modules imported
+    """
+    started = time.time()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_CODE.format(url=url)],
+        cwd=base_path,
+        capture_output=True,
+        text=True,
+    )
+    report = None
+    for line in process.stdout.splitlines():
+        if line.startswith(REPORT_PREFIX):
+            report = json.loads(line[len(REPORT_PREFIX) :])
+    if report is None:
+        raise RuntimeError(
+            f"profiled interpreter failed:\n{process.stderr[-3000:]}"
+        )
+    report["total"] = report.pop("ready_at") - started
+    report["imports"] = parse_importtime(process.stderr.splitlines())
+    return report
+
+
+def _median_dict(dicts):
+    keys = set().union(*dicts)
+    return {
+        key: statistics.median(d.get(key, 0.0) for d in dicts) for key in keys
+    }
+
+
+def profile_startup(base_path, runs=3, url="/"):
+    """
+    Median of the timings of several runs of profile_once
+    """
+    reports = [profile_once(base_path, url) for _ in range(runs)]
+    summary = {
+        name: statistics.median(r[name] for r in reports)
+        for name in ("total", "import_app", "first_request")
+    }
+    summary["runs"] = runs
+    summary["url"] = url
+    summary["status"] = reports[-1]["status"]
+    summary["imports"] = _median_dict([r["imports"] for r in reports])
+    summary["module_load"] = _median_dict([r["module_load"] for r in reports])
+    summary["heavy_modules"] = sorted(
+        set().union(*(r["heavy_modules"] for r in reports))
+    )
+    return summary
+
+
+def compare_to_baseline(report, baseline, tolerance=0.25):
+    """
+    Regressions of a report against a baseline report
+
+    Parameters
+    ----------
+    tolerance: float
+        part by which a timing may grow before being a regression
+
+    Returns
+    -------
+    list
+        messages, empty if there is no regression
+    """
+    message = "{name} went from {before:.3f}s to {after:.3f}s"
+    regressions = slower_values(
+        {
+            name: report[name]
+            for name in ("total", "import_app", "first_request")
+        },
+        baseline,
+        tolerance,
+        MIN_DELTA,
+        message,
+    )
+    for group in ("imports", "module_load"):
+        regressions += slower_values(
+            dict(sorted(report[group].items())),
+            baseline[group],
+            tolerance,
+            MIN_DELTA,
+            message,
+        )
+    for name in report["heavy_modules"]:
+        if name not in baseline["heavy_modules"]:
+            regressions.append(f"{name} is now imported at startup")
+    return regressions
+
+
+def _print_times(title, times, top):
+    print(f"\n{title}")
+    ranked = sorted(times.items(), key=lambda item: item[1], reverse=True)
+    for name, seconds in ranked[:top]:
+        print(f"  {seconds * 1000:9.1f} ms  {name}")
+
+
+def print_report(report, top=20):
+    print(f"startup profile, median of {report['runs']} runs")
+    print(f"  import app     {report['import_app'] * 1000:9.1f} ms")
+    if report["url"] is not None:
+        print(
+            f"  first request  {report['first_request'] * 1000:9.1f} ms"
+            f"  (GET {report['url']} -> {report['status']})"
+        )
+    print(f"  total          {report['total'] * 1000:9.1f} ms")
+    _print_times("imports per package", report["imports"], top)
+    _print_times("module loading", report["module_load"], top)
+    if report["heavy_modules"]:
+        print("\nheavy modules imported:", ", ".join(report["heavy_modules"]))
+
+
+def main(argv, base_path):
+    parser = argparse.ArgumentParser(prog="shopcube profile-startup")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--url", default="/", help="url of the first request, none to skip"
+    )
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--baseline", help="baseline json to compare to")
+    parser.add_argument("--save-baseline", help="write the report as json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    url = None if args.url.lower() == "none" else args.url
+    report = profile_startup(base_path, runs=args.runs, url=url)
+    print_report(report, top=args.top)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        print(f"\nbaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("\nregressions against", args.baseline)
+            for message in regressions:
+                print("  " + message)
+            return 1
+        print("\nno regression against", args.baseline)
+    return 0
@@ -0,0 +1,177 @@
+"""
+Registry of the functions modules make available to every template
+through the available_everywhere dict of their global.py.
+
+The globals are installed once as jinja globals instead of being merged
+into the context of every render. A function is only run when a
+template calls it, and its result is kept for the rest of the request
+so that calling it again from another template or block costs nothing.
+Functions decorated with template_global(ttl=...) are additionally
+cached across requests for ttl seconds, until invalidate() is called.
+"""
+import functools
+import threading
+import time
+
+from flask import g
+
+from werkzeug.local import LocalProxy
+
+
+def template_global(ttl=None, per_request=True):
+    """
+    Sets how the result of an available_everywhere function is cached
+
+    Parameters
+    ----------
+    ttl: float
+        seconds the result is kept across requests, results must then
+        not depend on the request nor be bound to the db session
+    per_request: bool
+        keep the result for the rest of the request
+    """
+
+    def decorator(func):
+        func.template_global_ttl = ttl
+        func.template_global_per_request = per_request
+        return func
+
+    return decorator
+
+
+def lazy_value(func, *args):
+    """
+    Template variable computed from func(*args) each time it is rendered
+    or tested, instead of at every render of every template
+    """
+    return LocalProxy(functools.partial(func, *args))
+
+
+class _Stats:
+    __slots__ = ("calls", "request_hits", "ttl_hits", "misses", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.request_hits = 0
+        self.ttl_hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TemplateGlobals:
+    """
+    Parameters
+    ----------
+    entities: dict
+        name -> value of the available_everywhere dicts. Functions are
+        wrapped, classes and other values are exposed as is
+    """
+
+    def __init__(self, entities=None):
+        self._entries = {}
+        self._ttl_cache = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        for name, value in (entities or {}).items():
+            self.register(name, value)
+
+    def register(self, name, value):
+        if callable(value) and not isinstance(value, type):
+            value = self._wrap(name, value)
+        self._entries[name] = value
+
+    def _wrap(self, name, func):
+        ttl = getattr(func, "template_global_ttl", None)
+        per_request = getattr(func, "template_global_per_request", True)
+        stats = self._stats[name] = _Stats()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                key = None
+
+            memo = None
+            if per_request and key is not None:
+                memo = g.setdefault("_template_globals", {})
+                if key in memo:
+                    self._count(stats, "request_hits")
+                    return memo[key]
+
+            if ttl is not None and key is not None:
+                cached = self._ttl_cache.get(key)
+                if cached is not None and cached[1] > time.monotonic():
+                    self._count(stats, "ttl_hits")
+                    if memo is not None:
+                        memo[key] = cached[0]
+                    return cached[0]
+
+            started = time.perf_counter()
+            value = func(*args, **kwargs)
+            self._count(stats, "misses", time.perf_counter() - started)
+
+            if memo is not None:
+                memo[key] = value
+            if ttl is not None and key is not None:
+                self._ttl_cache[key] = (value, time.monotonic() + ttl)
+            return value
+
+        return wrapper
+
+    def _count(self, stats, outcome, seconds=0.0):
+        with self._lock:
+            stats.calls += 1
+            setattr(stats, outcome, getattr(stats, outcome) + 1)
+            stats.seconds += seconds
+
+    def invalidate(self, *names):
+        """
+        Drops the cross request results of the given globals, of all
+        globals if no name is given
+        """
+        with self._lock:
+            if not names:
+                self._ttl_cache.clear()
+                return
+            for key in list(self._ttl_cache):
+                if key[0] in names:
+                    del self._ttl_cache[key]
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+            global name -> calls, request_hits, ttl_hits, misses and
+            seconds spent computing misses
+        """
+        with self._lock:
+            return {
+                name: stats.to_dict() for name, stats in self._stats.items()
+            }
+
+    def init_app(self, app, extra=None):
+        """
+        Installs the globals, plus extra values, in the jinja environment
+        of the app
+        """
+        app.extensions["template_globals"] = self
+
+        @app.before_request
+        def reset_template_globals():
+            g.pop("_template_globals", None)
+
+        app.jinja_env.globals.update(self._entries)
+        if extra:
+            app.jinja_env.globals.update(extra)
+
+
+def invalidate_template_globals(app, *names):
+    registry = app.extensions.get("template_globals")
+    if registry is not None:
+        registry.invalidate(*names)
@@ -0,0 +1,105 @@
+"""
+Tests the hot path index check of utils/indexes.py
+"""
+import logging
+
+import pytest
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import create_engine
+from sqlalchemy import text
+
+from utils.indexes import check_indexes
+from utils.indexes import declared_hot_indexes
+from utils.indexes import hot_path_index
+from utils.indexes import missing_indexes
+
+
+@pytest.fixture
+def metadata():
+    metadata = MetaData()
+    Table(
+        "item",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("code", String(10)),
+        Column("shop", Integer),
+        Column("name", String(10)),
+        hot_path_index("ix_item_code", "code", unique=True),
+        hot_path_index("ix_item_shop_name", "shop", "name"),
+    )
+    Table("absent", metadata, Column("id", Integer, primary_key=True))
+    return metadata
+
+
+def test_declared_hot_indexes(metadata):
+    assert declared_hot_indexes(metadata) == [
+        ("item", "ix_item_code", ("code",), True),
+        ("item", "ix_item_shop_name", ("shop", "name"), False),
+    ]
+
+
+def test_models_declare_barcode_unique():
+    assert ("product", "ix_product_barcode", ("barcode",), True) in (
+        declared_hot_indexes()
+    )
+
+
+def test_models_declare_subcategory_listing_index():
+    assert (
+        "product",
+        "ix_product_subcategory",
+        ("subcategory_id", "selling_price", "id"),
+        False,
+    ) in declared_hot_indexes()
+
+
+def test_missing_indexes(metadata):
+    engine = create_engine("sqlite://")
+    metadata.tables["item"].create(engine)
+
+    assert missing_indexes(engine, metadata) == []
+
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_item_code"))
+        connection.execute(text("DROP INDEX ix_item_shop_name"))
+        connection.execute(text("CREATE INDEX ix_other ON item (code)"))
+        connection.execute(text("CREATE INDEX ix_name ON item (name, shop)"))
+
+    # a non unique index on the column does not make a unique one, the
+    # column order matters
+    assert [name for _, name, _, _ in missing_indexes(engine, metadata)] == [
+        "ix_item_code",
+        "ix_item_shop_name",
+    ]
+
+
+def test_unique_constraint_counts_as_unique_index(metadata):
+    engine = create_engine("sqlite://")
+    legacy = MetaData()
+    Table(
+        "item",
+        legacy,
+        Column("id", Integer, primary_key=True),
+        Column("code", String(10)),
+        Column("shop", Integer),
+        Column("name", String(10)),
+        UniqueConstraint("code"),
+    )
+    legacy.create_all(engine)
+
+    assert missing_indexes(engine, metadata) == [
+        ("item", "ix_item_shop_name", ("shop", "name"), False)
+    ]
+
+
+def test_check_indexes(flask_app, caplog):
+    with caplog.at_level(logging.WARNING, logger="utils.indexes"):
+        assert check_indexes(flask_app) == []
+
+    assert not caplog.records
+    assert flask_app.extensions["missing_indexes"] == []
@@ -0,0 +1,128 @@
+"""
+Tests the request instrumentation of utils/instrumentation.py
+"""
+from flask import Flask
+from flask import render_template
+
+import jinja2
+import pytest
+from flask_login import LoginManager
+from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import utils.instrumentation
+from utils.instrumentation import Instrumentation
+
+TEMPLATES = {
+    "page.html": "<html><body>{% for i in items %}"
+    "{% include 'card.html' %}{% endfor %}</body></html>",
+    "card.html": "<p>{{ load(i) }}</p>",
+}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.jinja_loader = jinja2.DictLoader(TEMPLATES)
+    LoginManager(app).user_loader(lambda user_id: None)
+    Instrumentation(overlay=True).init_app(app)
+    engine = create_engine("sqlite://")
+
+    def load(i):
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT :i"), {"i": i}).scalar()
+
+    @app.route("/cards/<int:count>")
+    def cards(count):
+        return render_template("page.html", items=range(count), load=load)
+
+    @app.route("/broken")
+    def broken():
+        with engine.connect() as connection:
+            try:
+                connection.execute(text("SELECT * FROM missing"))
+            except OperationalError:
+                pass
+            return ",".join(connection.info)
+
+    @app.route("/plain")
+    def plain():
+        return "plain"
+
+    return app
+
+
+def server_timing(response):
+    return dict(
+        (part.split(";")[0], part)
+        for part in response.headers["Server-Timing"].split(", ")
+    )
+
+
+class TestInstrumentation:
+    def test_server_timing(self, app):
+        response = app.test_client().get("/cards/4")
+        timing = server_timing(response)
+
+        assert '"4 queries (4 duplicated)"' in timing["sql"]
+        assert set(timing) == {"sql", "render", "total"}
+        assert (
+            '"0 queries'
+            in server_timing(app.test_client().get("/plain"))["sql"]
+        )
+
+    def test_failed_statement_leaves_the_connection_alone(self, app):
+        response = app.test_client().get("/broken")
+
+        assert response.data == b""
+        assert '"0 queries' in server_timing(response)["sql"]
+
+    def test_summary_slowest_first(self, app):
+        client = app.test_client()
+        for _ in range(3):
+            client.get("/cards/5")
+        client.get("/plain")
+
+        summary = app.extensions["instrumentation"].summary()
+
+        assert [s["endpoint"] for s in summary] == ["cards", "plain"]
+        cards = summary[0]
+        assert cards["requests"] == 3
+        assert cards["max_queries"] == 5
+        assert cards["duplicate_statements"][0]["max_per_request"] == 5
+        assert set(cards["templates_ms"]) == {"page.html", "card.html"}
+
+    def test_summary_over_the_window(self, app):
+        app.extensions["instrumentation"].window = 2
+        client = app.test_client()
+        client.get("/cards/5")
+        client.get("/cards/1")
+        client.get("/cards/1")
+
+        cards = app.extensions["instrumentation"].summary()[0]
+
+        assert cards["requests"] == 3
+        assert cards["window"] == 2
+        assert cards["max_queries"] == 1
+        assert cards["duplicate_statements"] == []
+
+    def test_summary_endpoint_is_for_admins(self, app, monkeypatch):
+        client = app.test_client()
+        client.get("/plain")
+
+        assert client.get("/_instrumentation/summary").status_code == 403
+
+        monkeypatch.setattr(utils.instrumentation, "_is_admin", lambda: True)
+        data = client.get("/_instrumentation/summary?limit=1").get_json()
+        assert len(data["endpoints"]) == 1
+
+    def test_overlay_only_for_admins(self, app, monkeypatch):
+        client = app.test_client()
+
+        assert b"instrumentation-overlay" not in client.get("/cards/3").data
+
+        monkeypatch.setattr(utils.instrumentation, "_is_admin", lambda: True)
+        html = client.get("/cards/3").get_data(as_text=True)
+        assert html.index("instrumentation-overlay") < html.index("</body>")
+        assert "&times;3 SELECT" in html
@@ -0,0 +1,121 @@
+"""
+Tests the module manifest of utils/manifest.py
+"""
+import json
+
+from flask import Flask
+from flask import url_for
+
+import pytest
+
+from utils import manifest as module_manifest
+from utils.manifest import LazyView
+from utils.manifest import build_manifest
+from utils.manifest import inspect_module
+from utils.manifest import is_valid
+from utils.manifest import load_manifest
+from utils.manifest import make_lazy_blueprint
+from utils.manifest import scan_modules
+from utils.manifest import write_manifest
+
+
+@pytest.fixture
+def base_path(flask_app):
+    return flask_app.config["BASE_DIR"]
+
+
+def get_entry(manifest, name):
+    return next(e for e in manifest["modules"] if e["name"] == name)
+
+
+class TestManifest:
+    def test_scan_lists_modules_and_info(self, base_path):
+        manifest = scan_modules(base_path)
+        names = [e["name"] for e in manifest["modules"]]
+
+        assert "shop" in names and "resource" in names
+        shop = get_entry(manifest, "shop")
+        assert shop["package"] == "modules.box__ecommerce.shop"
+        assert shop["blueprint"] == "shop_blueprint"
+        assert shop["global"] is True
+        assert shop["info"]["url_prefix"] == "/shop"
+        assert get_entry(manifest, "www")["box"] is None
+        assert get_entry(manifest, "dashboard")["info"] is None
+
+    def test_is_valid(self, base_path):
+        manifest = scan_modules(base_path)
+        assert is_valid(manifest, base_path)
+
+        stale = json.loads(json.dumps(manifest))
+        get_entry(stale, "shop")["signature"]["view.py"] = [0, 0]
+        assert not is_valid(stale, base_path)
+
+        stale = json.loads(json.dumps(manifest))
+        stale["modules"].pop()
+        assert not is_valid(stale, base_path)
+
+        assert not is_valid(None, base_path)
+        assert not is_valid(dict(manifest, version=0), base_path)
+
+    def test_load_manifest(self, base_path, tmp_path, monkeypatch):
+        path = tmp_path / "manifest.json"
+        monkeypatch.setattr(module_manifest, "MANIFEST_NAME", str(path))
+
+        # missing, scanned instead
+        manifest = load_manifest(base_path)
+        assert not any(e["lazy"] for e in manifest["modules"])
+
+        write_manifest(base_path, build_manifest(base_path))
+        manifest = load_manifest(base_path)
+        assert get_entry(manifest, "jobs")["lazy"]
+
+        manifest["modules"].pop()
+        path.write_text(json.dumps(manifest))
+        manifest = load_manifest(base_path)
+        assert not any(e["lazy"] for e in manifest["modules"])
+
+    def test_inspect_records_rules_of_lazy_modules(self, base_path):
+        manifest = scan_modules(base_path)
+        jobs = inspect_module(get_entry(manifest, "jobs"), base_path)
+
+        assert jobs["lazy"]
+        assert jobs["options"]["url_prefix"] == "/jobs"
+        rules = {rule["endpoint"]: rule for rule in jobs["rules"]}
+        assert rules["status"]["rule"] == "/<int:job_id>"
+        assert rules["status"]["view"] == "status"
+        assert rules["status"]["methods"] == ["GET"]
+
+    def test_blueprint_with_hooks_is_not_lazy(self, base_path):
+        manifest = scan_modules(base_path)
+        shop = get_entry(manifest, "shop")
+        # shop registers a before_app_request hook
+        shop["info"]["lazy"] = True
+
+        assert not inspect_module(shop, base_path)["lazy"]
+        assert get_entry(manifest, "shop")["rules"] == []
+
+    def test_lazy_blueprint(self, base_path):
+        manifest = scan_modules(base_path)
+        entry = get_entry(manifest, "resource")
+        entry["info"]["lazy"] = True
+        inspect_module(entry, base_path)
+
+        app = Flask(__name__)
+        app.register_blueprint(make_lazy_blueprint(entry, base_path))
+
+        with app.test_request_context():
+            assert url_for("resource.index") == "/resource/"
+        response = app.test_client().get("/resource/")
+        assert response.data.decode() == entry["info"]["display_string"]
+
+    def test_lazy_view_imports_on_first_call(self):
+        view = LazyView("modules.resource", "index")
+
+        assert view._view is None
+        assert view() == "Files"
+        assert view._view is not None
+
+    def test_app_uses_manifest(self, flask_app):
+        manifest = flask_app.extensions["module_manifest"]
+
+        assert len(manifest["modules"]) == len(flask_app.blueprints)
@@ -0,0 +1,86 @@
+"""
+Tests the metrics registry of utils/metrics.py
+"""
+import multiprocessing
+
+import pytest
+
+from utils.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry()
+    registry.counter("orders_total", "Orders")
+    registry.counter("requests_total", "Requests", ("endpoint",))
+    registry.gauge("in_flight", "In flight")
+    registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    return registry
+
+
+def work(registry, orders):
+    registry.inc("orders_total", orders)
+    registry.inc("in_flight")
+    registry.observe("latency_seconds", 0.5)
+    registry.flush(force=True)
+
+
+class TestMetricsRegistry:
+    def test_render(self, registry):
+        registry.inc("orders_total")
+        registry.inc("requests_total", 2, endpoint='shop."index"')
+        registry.observe("latency_seconds", 0.05)
+        registry.observe("latency_seconds", 0.5)
+        registry.observe("latency_seconds", 3)
+
+        lines = registry.render().splitlines()
+
+        assert "# TYPE orders_total counter" in lines
+        assert "orders_total 1" in lines
+        assert 'requests_total{endpoint="shop.\\"index\\""} 2' in lines
+        assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{le="1"} 2' in lines
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+        assert "latency_seconds_sum 3.55" in lines
+        assert "latency_seconds_count 3" in lines
+
+    def test_labels_are_checked(self, registry):
+        with pytest.raises(ValueError):
+            registry.inc("requests_total", page="x")
+        with pytest.raises(ValueError):
+            registry.gauge("orders_total", "Orders")
+
+    def test_collectors(self, registry):
+        registry.add_collector(
+            "orders", lambda registry: registry.set("orders_total", 42)
+        )
+
+        assert "orders_total 42" in registry.render().splitlines()
+
+    def test_processes_are_added_up(self, registry, tmp_path):
+        registry.configure(str(tmp_path))
+        registry.inc("orders_total")
+        registry.inc("in_flight")
+        context = multiprocessing.get_context("fork")
+        for orders in (2, 3):
+            process = context.Process(target=work, args=(registry, orders))
+            process.start()
+            process.join()
+
+        lines = registry.render().splitlines()
+
+        # the exited processes still count for counters, not for gauges
+        assert "orders_total 6" in lines
+        assert "in_flight 1" in lines
+        assert "latency_seconds_count 2" in lines
+        assert len(list(tmp_path.glob("*.json"))) == 3
+
+    def test_forked_process_starts_from_zero(self, registry, tmp_path):
+        registry.configure(str(tmp_path))
+        registry.inc("orders_total", 10)
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=work, args=(registry, 1))
+        process.start()
+        process.join()
+
+        assert "orders_total 11" in registry.render().splitlines()
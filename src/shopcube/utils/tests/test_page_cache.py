@@ -0,0 +1,216 @@
+"""
+Tests the full-page cache of utils/page_cache.py
+"""
+import time
+
+from flask import Flask
+from flask import make_response
+from flask import render_template_string
+from flask import session
+
+import pytest
+from flask_login import LoginManager
+from flask_wtf.csrf import CSRFProtect
+
+from utils.page_cache import FileSystemPageBackend
+from utils.page_cache import MemoryPageBackend
+from utils.page_cache import PageCache
+from utils.page_cache import RedisPageBackend
+from utils.page_cache import tag_page
+
+
+class RedisStandIn:
+    """
+    The part of the redis client used by RedisPageBackend
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+
+def make_page(body=b"page", tags=("site",), rendered=None, ttl=60):
+    now = time.time()
+    return {
+        "status": 200,
+        "headers": [],
+        "body": body,
+        "tags": list(tags),
+        "rendered": now if rendered is None else rendered,
+        "expires": now + ttl,
+    }
+
+
+@pytest.fixture(params=["memory", "filesystem", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryPageBackend()
+    if request.param == "filesystem":
+        return FileSystemPageBackend(str(tmp_path))
+    return RedisPageBackend(RedisStandIn())
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "secret"
+    app.config["WTF_CSRF_ENABLED"] = False
+    CSRFProtect(app)
+    LoginManager(app).user_loader(lambda user_id: None)
+    theme = {"name": "front"}
+
+    @app.route("/product/<int:product_id>")
+    def product(product_id):
+        tag_page(f"product:{product_id}")
+        response = make_response(
+            render_template_string(
+                "<p>product {{ id }}</p><input value='{{ csrf_token() }}'>",
+                id=product_id,
+            )
+        )
+        response.set_etag(f"product-{product_id}", weak=True)
+        response.cache_control.no_cache = True
+        return response
+
+    @app.route("/cart/add")
+    def cart_add():
+        session["cart"] = {"items": {"1": []}}
+        return "added"
+
+    @app.route("/missing")
+    def missing():
+        return "missing", 404
+
+    PageCache(
+        MemoryPageBackend(),
+        endpoints=["product", "missing"],
+        vary=lambda: theme["name"],
+    ).init_app(app)
+    app.theme = theme
+    return app
+
+
+def csrf_token(html):
+    return html.split("value='")[1].split("'")[0]
+
+
+class TestPageBackends:
+    def test_round_trip(self, backend):
+        backend.set("key", make_page(b"hello"))
+
+        assert backend.get("key")["body"] == b"hello"
+        backend.delete("key")
+        assert backend.get("key") is None
+
+    def test_expired_pages_are_dropped(self, backend):
+        if isinstance(backend, RedisPageBackend):
+            pytest.skip("redis expires keys itself")
+        page = make_page()
+        page["expires"] = time.time() - 1
+        backend.set("key", page)
+
+        assert backend.get("key") is None
+
+    def test_purge_times(self, backend):
+        backend.purge(["product:1"], 123.5)
+
+        assert backend.purge_times(["product:1", "product:2"]) == {
+            "product:1": 123.5,
+            "product:2": 0.0,
+        }
+
+    def test_memory_limits(self):
+        backend = MemoryPageBackend(max_entries=2, max_bytes=10)
+        backend.set("a", make_page(b"aaaa"))
+        backend.set("b", make_page(b"bbbb"))
+        backend.get("a")
+        backend.set("c", make_page(b"cccc"))
+
+        # b was the least recently used
+        assert backend.get("b") is None
+        assert len(backend) == 2
+        backend.set("d", make_page(b"dddddddd"))
+        assert len(backend) == 1
+        assert backend.size == 8
+        backend.set("e", make_page(b"e" * 11))
+        assert backend.get("e") is None
+
+
+class TestPageCache:
+    def test_hit_with_own_csrf_token(self, app):
+        first = app.test_client().get("/product/1")
+        second_client = app.test_client()
+        second = second_client.get("/product/1")
+
+        assert first.headers["X-Page-Cache"] == "miss"
+        assert second.headers["X-Page-Cache"] == "hit"
+        first_html = first.get_data(as_text=True)
+        second_html = second.get_data(as_text=True)
+        first_token = csrf_token(first_html)
+        second_token = csrf_token(second_html)
+        assert first_token != second_token
+        assert second_html.replace(second_token, first_token) == first_html
+        # the token served from the cache is the one of the session
+        with second_client.session_transaction() as sess:
+            assert sess["csrf_token"]
+
+    def test_not_modified(self, app):
+        first = app.test_client().get("/product/1")
+        response = app.test_client().get(
+            "/product/1", headers={"If-None-Match": first.headers["ETag"]}
+        )
+
+        assert response.status_code == 304
+        assert response.headers["X-Page-Cache"] == "hit"
+        assert response.headers["ETag"] == 'W/"product-1"'
+        assert "no-cache" in response.headers["Cache-Control"]
+        assert response.data == b""
+        other = app.test_client().get(
+            "/product/1", headers={"If-None-Match": 'W/"product-2"'}
+        )
+        assert other.status_code == 200
+        assert other.headers["ETag"] == 'W/"product-1"'
+
+    def test_purged_tags_only(self, app):
+        client = app.test_client()
+        client.get("/product/1")
+        client.get("/product/2")
+
+        app.extensions["page_cache"].purge(["product:1"])
+
+        assert client.get("/product/1").headers["X-Page-Cache"] == "miss"
+        assert client.get("/product/1").headers["X-Page-Cache"] == "hit"
+        assert client.get("/product/2").headers["X-Page-Cache"] == "hit"
+
+    def test_vary(self, app):
+        client = app.test_client()
+        client.get("/product/1")
+        app.theme["name"] = "other"
+
+        assert client.get("/product/1").headers["X-Page-Cache"] == "miss"
+
+    def test_query_string_order(self, app):
+        client = app.test_client()
+        client.get("/product/1?a=1&b=2")
+
+        response = client.get("/product/1?b=2&a=1")
+        assert response.headers["X-Page-Cache"] == "hit"
+
+    def test_not_cached(self, app):
+        client = app.test_client()
+        client.get("/missing")
+
+        assert client.get("/missing").headers["X-Page-Cache"] == "miss"
+        client.get("/cart/add")
+        assert "X-Page-Cache" not in client.get("/product/3").headers
@@ -0,0 +1,29 @@
+"""
+Tests the baseline comparison of utils/regressions.py
+"""
+from utils.regressions import is_slower
+from utils.regressions import slower_values
+
+
+class TestRegressions:
+    def test_is_slower(self):
+        # within the tolerance
+        assert not is_slower(1.2, 1.0, tolerance=0.25, min_delta=0.05)
+        assert is_slower(1.3, 1.0, tolerance=0.25, min_delta=0.05)
+        # within the noise
+        assert not is_slower(0.04, 0.0, tolerance=0.25, min_delta=0.05)
+        assert is_slower(0.06, 0.0, tolerance=0.25, min_delta=0.05)
+
+    def test_slower_values(self):
+        regressions = slower_values(
+            {"total": 1.5, "new": 0.5, "import_app": 0.8},
+            {"total": 1.0, "import_app": 0.8},
+            tolerance=0.25,
+            min_delta=0.05,
+            message="{name} went from {before:.1f}s to {after:.1f}s",
+        )
+
+        assert regressions == [
+            "total went from 1.0s to 1.5s",
+            "new went from 0.0s to 0.5s",
+        ]
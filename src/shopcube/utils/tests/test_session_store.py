@@ -0,0 +1,242 @@
+"""
+Tests the server-side sessions of utils/session_store.py
+"""
+from datetime import datetime
+from datetime import timedelta
+
+from flask import Flask
+from flask import session
+
+import pytest
+from flask_login import LoginManager
+from flask_login import UserMixin
+from flask_login import login_user
+from flask_login import logout_user
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from utils.session_store import MemorySessionBackend
+from utils.session_store import ServerSessionInterface
+from utils.session_store import SessionRecord
+from utils.session_store import SQLSessionBackend
+from utils.session_store import dumps
+from utils.session_store import init_session_store
+from utils.session_store import loads
+
+
+@pytest.fixture
+def sql_backend():
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    SessionRecord.__table__.create(engine)
+    return SQLSessionBackend(engine)
+
+
+@pytest.fixture
+def backend():
+    return MemorySessionBackend()
+
+
+@pytest.fixture
+def app(backend):
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = ServerSessionInterface(backend)
+
+    @app.route("/add/<barcode>")
+    def add(barcode):
+        cart = session.setdefault("cart", {})
+        cart.setdefault(barcode, []).append({"quantity": 1})
+        return "ok"
+
+    @app.route("/cart")
+    def cart():
+        return str(len(session.get("cart", {})))
+
+    @app.route("/clear")
+    def clear():
+        session.clear()
+        return "ok"
+
+    return app
+
+
+def get_sid(client):
+    for cookie in client.cookie_jar:
+        if cookie.name == "session":
+            return cookie.value
+    return None
+
+
+def in_a_day():
+    return datetime.now() + timedelta(days=1)
+
+
+class TestSerialization:
+    def test_round_trip(self):
+        data = {"cart": {"a": [{"quantity": 2}]}, "_flashes": [("info", "x")]}
+
+        assert loads(dumps(data)) == data
+        assert dumps(data).startswith(b"j")
+
+    def test_large_sessions_are_compressed(self):
+        data = {"checkout_data": {"address": "x" * 5000}}
+        blob = dumps(data, compress_min=1024)
+
+        assert blob.startswith(b"z")
+        assert len(blob) < 1000
+        assert loads(blob) == data
+
+
+class TestBackends:
+    @pytest.mark.parametrize("name", ["memory", "sql"])
+    def test_save_load_delete(self, name, backend, sql_backend):
+        backend = {"memory": backend, "sql": sql_backend}[name]
+
+        assert backend.load("sid") is None
+        backend.save("sid", b"j{}", in_a_day())
+        backend.save("sid", b'j{"a":1}', in_a_day())
+        assert backend.load("sid")[0] == b'j{"a":1}'
+
+        backend.delete("sid")
+        assert backend.load("sid") is None
+
+    @pytest.mark.parametrize("name", ["memory", "sql"])
+    def test_expired_sessions(self, name, backend, sql_backend):
+        backend = {"memory": backend, "sql": sql_backend}[name]
+        past = datetime.now() - timedelta(minutes=1)
+        backend.save("old", b"j{}", past)
+        backend.save("older", b"j{}", past)
+        backend.save("alive", b"j{}", in_a_day())
+
+        assert backend.load("old") is None
+        assert backend.gc() >= 1
+        assert backend.load("alive") is not None
+
+        backend.touch("alive", past)
+        assert backend.gc() == 1
+
+    def test_memory_backend_drops_least_recently_used(self):
+        backend = MemorySessionBackend(max_entries=2)
+        backend.save("a", b"j{}", in_a_day())
+        backend.save("b", b"j{}", in_a_day())
+        backend.load("a")
+        backend.save("c", b"j{}", in_a_day())
+
+        assert len(backend) == 2
+        assert backend.load("b") is None
+        assert backend.load("a") is not None
+
+
+class TestServerSessionInterface:
+    def test_cookie_only_carries_the_session_id(self, app, backend):
+        client = app.test_client()
+        client.get("/add/b1")
+        sid = get_sid(client)
+
+        assert len(backend) == 1
+        assert loads(backend.load(sid)[0]) == {
+            "cart": {"b1": [{"quantity": 1}]}
+        }
+
+    def test_unchanged_sessions_are_not_written(self, app):
+        interface = app.session_interface
+        client = app.test_client()
+        client.get("/add/b1")
+        assert interface.stats["writes"] == 1
+
+        assert client.get("/cart").data == b"1"
+        assert interface.stats["writes"] == 1
+        assert interface.stats["skipped"] == 1
+
+        # nested changes are seen too
+        client.get("/add/b1")
+        assert interface.stats["writes"] == 2
+
+    def test_empty_sessions_are_not_stored(self, app, backend):
+        client = app.test_client()
+        client.get("/cart")
+
+        assert len(backend) == 0
+        assert get_sid(client) is None
+
+    def test_cleared_session_is_deleted(self, app, backend):
+        client = app.test_client()
+        client.get("/add/b1")
+        client.get("/clear")
+
+        assert len(backend) == 0
+        assert get_sid(client) is None
+
+    def test_unknown_session_id_is_not_reused(self, app, backend):
+        client = app.test_client()
+        client.set_cookie("localhost", "session", "chosen-by-client")
+        client.get("/add/b1")
+
+        assert backend.load("chosen-by-client") is None
+        assert get_sid(client) != "chosen-by-client"
+
+    def test_static_files_do_not_load_the_session(self, app):
+        client = app.test_client()
+        client.get("/add/b1")
+        loads_before = app.session_interface.stats["loads"]
+        client.get("/static/missing.css")
+
+        assert app.session_interface.stats["loads"] == loads_before
+
+    def test_garbage_collection(self, app, backend):
+        backend.save("old", b"j{}", datetime.now() - timedelta(minutes=1))
+        interface = app.session_interface
+
+        assert interface.collect_garbage() is None
+        assert interface.collect_garbage(force=True) == 1
+
+
+class User(UserMixin):
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+def test_login_and_logout_change_the_session_id():
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.config["SESSION_BACKEND"] = "memory"
+    init_session_store(app)
+    backend = app.session_interface.backend
+    login_manager = LoginManager(app)
+    login_manager.user_loader(User)
+
+    @app.route("/add")
+    def add():
+        session["cart"] = {"b1": [{"quantity": 1}]}
+        return "ok"
+
+    @app.route("/login")
+    def login():
+        login_user(User("1"))
+        return "ok"
+
+    @app.route("/logout")
+    def logout():
+        logout_user()
+        return "ok"
+
+    client = app.test_client()
+    client.get("/add")
+    planted = get_sid(client)
+
+    client.get("/login")
+    logged_in = get_sid(client)
+    assert logged_in != planted
+    assert backend.load(planted) is None
+    # the cart is kept
+    assert loads(backend.load(logged_in)[0])["cart"] == {
+        "b1": [{"quantity": 1}]
+    }
+
+    client.get("/logout")
+    assert get_sid(client) not in (planted, logged_in)
+    assert backend.load(logged_in) is None
@@ -0,0 +1,57 @@
+"""
+Tests the startup profiler of utils/startup_profile.py
+"""
+from utils.startup_profile import HEAVY_MODULES
+from utils.startup_profile import compare_to_baseline
+from utils.startup_profile import parse_importtime
+from utils.startup_profile import profile_once
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:      1000 |       1000 |     sqlalchemy.sql
+import time:      2000 |       3000 |   sqlalchemy
+DEBUG:utils.manifest:Loaded module modules.www
+import time:       500 |        500 |   modules.www.view
+"""
+
+
+def make_report(**changes):
+    report = {
+        "total": 1.0,
+        "import_app": 0.8,
+        "first_request": 0.1,
+        "imports": {"sqlalchemy": 0.2},
+        "module_load": {"modules.www": 0.01},
+        "heavy_modules": [],
+    }
+    report.update(changes)
+    return report
+
+
+class TestStartupProfile:
+    def test_parse_importtime(self):
+        imports = parse_importtime(IMPORTTIME.splitlines())
+
+        assert imports == {"sqlalchemy": 0.003, "modules": 0.0005}
+
+    def test_regressions(self):
+        baseline = make_report()
+        report = make_report(
+            total=1.5,
+            imports={"sqlalchemy": 0.2, "pandas": 0.4},
+            heavy_modules=["pandas"],
+        )
+
+        regressions = compare_to_baseline(report, baseline, tolerance=0.25)
+
+        assert len(regressions) == 3
+        assert regressions[0].startswith("total went from 1.000s")
+        assert "pandas is now imported at startup" in regressions
+
+    def test_heavy_modules_not_imported_at_startup(self, flask_app):
+        report = profile_once(flask_app.config["BASE_DIR"], url=None)
+
+        assert report["heavy_modules"] == []
+        assert not set(HEAVY_MODULES) & set(report["imports"])
+        assert "modules.box__ecommerce.shop" in report["module_load"]
+        assert report["total"] >= report["import_app"] > 0
@@ -0,0 +1,107 @@
+"""
+Tests the lazy, memoized template globals of utils/template_globals.py
+"""
+from flask import Flask
+from flask import render_template_string
+
+import pytest
+
+from utils.template_globals import TemplateGlobals
+from utils.template_globals import invalidate_template_globals
+from utils.template_globals import lazy_value
+from utils.template_globals import template_global
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.calls
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+class TestTemplateGlobals:
+    def test_unused_global_is_not_evaluated(self, app):
+        counter = Counter()
+        TemplateGlobals({"count": counter}).init_app(app)
+
+        with app.test_request_context():
+            assert render_template_string("hello") == "hello"
+
+        assert counter.calls == 0
+
+    def test_result_kept_for_the_request(self, app):
+        counter = Counter()
+        registry = TemplateGlobals({"count": counter})
+        registry.init_app(app)
+
+        @app.route("/")
+        def index():
+            return render_template_string("{{ count() }}-{{ count() }}")
+
+        client = app.test_client()
+        assert client.get("/").data == b"1-1"
+        assert client.get("/").data == b"2-2"
+        assert registry.stats()["count"]["misses"] == 2
+        assert registry.stats()["count"]["request_hits"] == 2
+
+    def test_arguments_are_part_of_the_key(self, app):
+        counter = Counter()
+        TemplateGlobals({"count": counter}).init_app(app)
+
+        with app.test_request_context():
+            rendered = render_template_string(
+                "{{ count('a') }}{{ count('b') }}{{ count('a') }}"
+            )
+
+        assert rendered == "121"
+
+    def test_ttl_cache_and_invalidation(self, app):
+        counter = template_global(ttl=60)(Counter())
+        registry = TemplateGlobals({"count": counter})
+        registry.init_app(app)
+        count = app.jinja_env.globals["count"]
+
+        with app.test_request_context():
+            assert count() == 1
+        with app.test_request_context():
+            assert count() == 1
+        assert registry.stats()["count"]["ttl_hits"] == 1
+
+        invalidate_template_globals(app, "count")
+        with app.test_request_context():
+            assert count() == 2
+
+    def test_classes_and_values_are_not_wrapped(self, app):
+        TemplateGlobals({"Counter": Counter, "answer": 42}).init_app(app)
+
+        assert app.jinja_env.globals["Counter"] is Counter
+        assert app.jinja_env.globals["answer"] == 42
+
+    def test_lazy_value(self, app):
+        names = []
+
+        def get_name(prefix):
+            names.append(prefix)
+            return prefix + "cube"
+
+        TemplateGlobals().init_app(
+            app, extra={"name": lazy_value(get_name, "shop")}
+        )
+
+        with app.test_request_context():
+            assert render_template_string("nothing") == "nothing"
+            assert names == []
+            assert render_template_string("{{ name }}") == "shopcube"
+
+    def test_registered_on_shopcube_app(self, flask_app):
+        registry = flask_app.extensions["template_globals"]
+
+        assert "get_currency_symbol" in registry.stats()
+        assert "APP_NAME" in flask_app.jinja_env.globals